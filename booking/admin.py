@@ -1,9 +1,53 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Trip, Booking, City, Area
+from .models import User, Trip, Booking, City, Area, SeatLayout, WaitlistEntry, PaymentEvent, ArchivedTrip, ArchivedBooking, PHONE_REGEX
+from django.db.models import Q
 from django.db import transaction
 from django.utils.timezone import timedelta
 from django.contrib import messages
+from . import seat_events
+from .signals import seats_released
+from .disruption import cancel_trip
+from .pagination import EstimatedCountPaginator
+
+
+# Changelist settings for the big tables: no exact COUNT(*) of the whole table or of the filtered rows
+class LargeTableAdminMixin:
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class CityListFilter(admin.SimpleListFilter):
+    """Filter by city through an area foreign key: one query for the (short) city list instead of every area."""
+    field_path = None
+
+    def lookups(self, request, model_admin):
+        return City.objects.order_by('name').values_list('id', 'name')
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{f'{self.field_path}__city_id': self.value()})
+        return queryset
+
+
+class StartCityFilter(CityListFilter):
+    title = 'start city'
+    parameter_name = 'start_city'
+    field_path = 'start_location'
+
+
+class DestinationCityFilter(CityListFilter):
+    title = 'destination city'
+    parameter_name = 'destination_city'
+    field_path = 'destination'
+
+
+class TripStartCityFilter(StartCityFilter):
+    field_path = 'trip__start_location'
+
+
+class TripDestinationCityFilter(DestinationCityFilter):
+    field_path = 'trip__destination'
 
 
 # Admin for User model
@@ -46,26 +90,66 @@ class AreaAdmin(admin.ModelAdmin):
     search_fields = ('name', 'city__name')
     ordering = ('city', 'name')
 
+    def get_queryset(self, request):
+        # Area.__str__ prints the city: joined for the area autocomplete of the trip form
+        return super().get_queryset(request).select_related('city')
+
+
+# Admin for SeatLayout model
+@admin.register(SeatLayout)
+class SeatLayoutAdmin(admin.ModelAdmin):
+    list_display = ('bus_type', 'seat_count', 'seats_per_row', 'rows')
+    list_filter = ('bus_type',)
+    readonly_fields = ('rows',)
+
+    def get_readonly_fields(self, request, obj=None):
+        # A layout is shared by every trip of its bus type and size: resizing it would remap their booked seats
+        if obj is not None and obj.trips.exists():
+            return self.readonly_fields + ('bus_type', 'seat_count', 'seats_per_row')
+        return self.readonly_fields
+
 
 # Admin for Trip model
 @admin.register(Trip)
-class TripAdmin(admin.ModelAdmin):
+class TripAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('start_location', 'destination', 'bus_type',
                     'departure_date', 'arrival_date', 
                     'total_seats', 'available_seats',
                     'price')
-    list_filter = ('start_location', 'destination', 'departure_date', 'bus_type')
-    search_fields = ('start_location__name', 'destination__name', 'bus_type')
+    list_filter = (StartCityFilter, DestinationCityFilter, 'bus_type')
+    search_fields = ('^start_location__city__name', '^destination__city__name', '^start_location__name', '^destination__name')
+    date_hierarchy = 'departure_date'
+    ordering = ('-departure_date',)
+    autocomplete_fields = ('start_location', 'destination')
 
     fieldsets = (
         (None, {'fields': ('start_location', 'destination','bus_type')}),
         ('Schedule', {'fields': ('departure_date', 'arrival_date')}),
-        ('Details', {'fields': ('total_seats', 'available_seats', 'price', 'seats')}),
+        ('Details', {'fields': ('total_seats', 'available_seats', 'price', 'layout', 'seat_map', 'cancelled_at')}),
     )
 
-    readonly_fields = ('available_seats', 'created_at', 'updated_at', 'seats')
+    readonly_fields = ('available_seats', 'created_at', 'updated_at', 'layout', 'seat_map', 'cancelled_at')
+
+    def seat_map(self, obj):
+        """Booked seats by label."""
+        if not obj.pk:
+            return '-'
+        booked = [obj.seat_label(seat) for seat in obj.unavailable_seats]
+        return f"Booked ({len(booked)}/{obj.total_seats}): {', '.join(booked) or 'none'}"
+
+    seat_map.short_description = "Seat Map"
+
+    def get_queryset(self, request):
+        # Trip.__str__ prints both areas with their cities; joined here so the changelist and the
+        # trip autocomplete of other admins don't query them per row
+        return super().get_queryset(request).select_related('start_location__city', 'destination__city')
 
-    actions = ['duplicate_trip_for_30_days']
+    def save_model(self, request, obj, form, change):
+        if change and {'bus_type', 'total_seats'} & set(form.changed_data):
+            obj.layout = SeatLayout.for_bus(obj.bus_type, obj.total_seats)
+        super().save_model(request, obj, form, change)
+
+    actions = ['duplicate_trip_for_30_days', 'cancel_trips']
 
     def duplicate_trip_for_30_days(self, request, queryset):
         if queryset.count() != 1:
@@ -86,7 +170,7 @@ class TripAdmin(admin.ModelAdmin):
                 arrival_date=new_arrival,
                 total_seats=original_trip.total_seats,
                 available_seats=original_trip.total_seats,
-                seats={str(n): "available" for n in range(1, original_trip.total_seats + 1)},
+                layout=original_trip.layout,
                 price=original_trip.price,
             )
 
@@ -94,14 +178,26 @@ class TripAdmin(admin.ModelAdmin):
 
     duplicate_trip_for_30_days.short_description = "Duplicate selected Trip for 30 days"
 
+    def cancel_trips(self, request, queryset):
+        cancelled = 0
+        for trip_id in queryset.order_by('id').values_list('id', flat=True):
+            cancelled += len(cancel_trip(trip_id))
+        self.message_user(request, f"Trips cancelled; {cancelled} booking(s) cancelled and their passengers notified.")
+
+    cancel_trips.short_description = "Cancel selected trips and all their bookings"
+
 
 # Admin for Booking model (Updated)
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
+class BookingAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'customer_name', 'customer_phone', 'trip', 'seats_booked', 'display_selected_seats', 'status', 'booking_date', 'total_price',
                     "payment_reference", "payment_status", "expires_at","payment_type",)
-    list_filter = ('status', 'booking_date')
-    search_fields = ('user__name', 'trip__start_location__name', 'trip__destination__name')
+    list_filter = ('status', 'payment_status', 'payment_type', TripStartCityFilter, TripDestinationCityFilter)
+    list_select_related = ('user', 'trip__layout', 'trip__start_location__city', 'trip__destination__city')
+    search_fields = ('^customer_name', '^user__email')
+    search_help_text = "Exact phone number, payment reference, order id or booking id; or the start of a customer name or email."
+    date_hierarchy = 'booking_date'
+    autocomplete_fields = ('user', 'trip')
 
     fieldsets = (
         (None, {'fields': ('user', 'trip')}),
@@ -111,24 +207,112 @@ class BookingAdmin(admin.ModelAdmin):
     readonly_fields = ('total_price', 'booking_date')
 
     def display_selected_seats(self, obj):
-        """Display booked seat numbers in admin panel."""
-        return ", ".join(map(str, obj.selected_seats))
+        """Display booked seat labels in admin panel."""
+        return ", ".join(obj.seat_labels)
 
     display_selected_seats.short_description = "Selected Seats"
 
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Identifiers are looked up by exact match on their indexes; a LIKE '%...%' over these
+        columns would scan the table. A term that could be an identifier is also matched by the
+        prefix searches above, since names and emails have digits too ("ali99@gmail.com").
+        """
+        term = search_term.strip()
+        if PHONE_REGEX.regex.fullmatch(term):
+            return queryset.filter(customer_phone=term), False
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if term and not any(char.isspace() for char in term) and any(char.isdigit() for char in term):
+            matches = Q(payment_reference=term) | Q(payment_order_id=term)
+            if term.isdigit():
+                matches |= Q(pk=int(term))
+            results = results | queryset.filter(matches)
+        return results, may_have_duplicates
+
     actions = ['confirm_bookings']
 
     def confirm_bookings(self, request, queryset):
-        queryset.update(status='CONFIRMED')
-        self.message_user(request, "Selected bookings have been confirmed.")
+        # Only PENDING bookings still hold their seats; confirming a cancelled one would revive it without them
+        confirmed = queryset.filter(status='PENDING').update(status='CONFIRMED')
+        self.message_user(request, f"{confirmed} pending booking(s) have been confirmed.")
     confirm_bookings.short_description = "Confirm selected bookings"
 
+    def release_and_delete(self, bookings):
+        """
+        Delete bookings and give the seats of the live ones back. Each trip is locked once, in id
+        order, and its bookings are re-read under the lock so a concurrent cancel isn't released twice.
+        """
+        by_trip = {}
+        for booking_id, trip_id in bookings.values_list('id', 'trip_id'):
+            by_trip.setdefault(trip_id, []).append(booking_id)
+        with transaction.atomic():
+            for trip_id in sorted(by_trip):
+                trip = Trip.objects.select_for_update().get(pk=trip_id)
+                locked = Booking.objects.select_for_update().filter(id__in=by_trip[trip_id])
+                live = list(locked.exclude(status='CANCELLED').only('id', 'seats_booked', 'selected_seats'))
+                seats = [seat for booking in live for seat in booking.selected_seats]
+                if live:
+                    trip.release_seats(seats)
+                    trip.available_seats += sum(booking.seats_booked for booking in live)
+                    trip.save()
+                Booking.objects.filter(id__in=by_trip[trip_id]).delete()
+                if live:
+                    seat_events.publish_on_commit(trip_id, seat_events.RELEASED, seats)
+                    transaction.on_commit(lambda trip_id=trip_id: seats_released.send(sender=Trip, trip_id=trip_id))
+
     def delete_model(self, request, obj):
         """Override delete to update trip seats."""
-        with transaction.atomic():
-            trip = obj.trip
-            for seat_number in obj.selected_seats:
-                trip.seats[str(seat_number)] = 'available'
-            trip.available_seats += obj.seats_booked
-            trip.save()
-            super().delete_model(request, obj)
\ No newline at end of file
+        self.release_and_delete(Booking.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        """Bulk delete from the changelist: same seat release as delete_model instead of a bare DELETE."""
+        self.release_and_delete(queryset)
+
+
+# Admin for WaitlistEntry model
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('trip', 'user', 'seats_requested', 'status', 'booking', 'created_at', 'offered_at')
+    list_filter = ('status',)
+    list_select_related = ('user', 'trip__start_location__city', 'trip__destination__city', 'booking__user',
+                           'booking__trip__start_location__city', 'booking__trip__destination__city')
+    search_fields = ('user__name', 'user__email', 'user__phone_number')
+    autocomplete_fields = ('trip', 'user', 'booking')
+
+
+# Admin for PaymentEvent model: gateway callbacks are read-only evidence
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'source', 'order_id', 'transaction_id', 'success', 'received_at', 'processed_at', 'outcome')
+    list_filter = ('source', 'success', 'outcome')
+    search_fields = ('order_id', 'transaction_id')
+    readonly_fields = [field.name for field in PaymentEvent._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+# Read-only admins for the archive tables
+class ArchiveAdminMixin:
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedTrip)
+class ArchivedTripAdmin(ArchiveAdminMixin, LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'start_location', 'destination', 'bus_type', 'departure_date', 'total_seats', 'available_seats', 'archived_at')
+    list_filter = ('bus_type',)
+    date_hierarchy = 'departure_date'
+
+
+@admin.register(ArchivedBooking)
+class ArchivedBookingAdmin(ArchiveAdminMixin, LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'user', 'trip', 'customer_name', 'seats_booked', 'status', 'payment_status', 'total_price', 'booking_date')
+    list_filter = ('status', 'payment_status', 'payment_type')
+    search_fields = ('customer_name', 'customer_phone', 'payment_order_id', 'user__email')
+    list_select_related = ('user', 'trip')
+    raw_id_fields = ('user', 'trip')
+    date_hierarchy = 'booking_date'
@@ -0,0 +1,225 @@
+import functools
+import time
+import uuid
+from dataclasses import dataclass
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from rest_framework.response import Response
+from . import metrics
+from .utils import shared_cache
+
+# Per-trip admission control for the booking path. At most ADMISSION_CONCURRENCY requests per trip
+# run the booking views at once, each holding a slot: a cache lease (add() is atomic on every
+# backend; the timeout frees the slot of a worker that died). Everyone else gets a signed ticket
+# from a per-trip counter and a 429 with their position, and is let in in ticket order: tickets up
+# to the `called` counter may take a free slot, and each finished request calls the next ticket.
+# Only meaningful with a cache shared by every process (Redis/Memcached): with locmem each process
+# would keep its own slots and ticket numbers, so admission control stays off there.
+SLOT_KEY = 'admission_slot_{}_{}'
+ISSUED_KEY = 'admission_issued_{}'  # Last ticket handed out
+CALLED_KEY = 'admission_called_{}'  # Tickets up to this one may take a slot
+CALLED_AT_KEY = 'admission_called_at_{}'
+NUDGE_KEY = 'admission_nudge_{}'
+USED_KEY = 'admission_used_{}_{}'  # A ticket that already took a slot
+SERVICE_KEY = 'admission_service_{}'  # Moving average of the seconds a slot is held
+TICKET_SALT = 'booking.admission'
+
+
+@dataclass
+class Admission:
+    trip_id: int
+    admitted: bool
+    slot: int = None
+    lease: str = None
+    ticket: int = None
+    position: int = 0
+    estimated_wait: float = 0.0
+    started: float = 0.0
+
+
+def enabled():
+    return settings.ADMISSION_CONCURRENCY > 0 and shared_cache()
+
+
+def _counter(key, default=0):
+    value = cache.get(key)
+    return default if value is None else value
+
+
+def _advance(trip_id, amount=1):
+    key = CALLED_KEY.format(trip_id)
+    if not cache.add(key, amount, timeout=None):
+        try:
+            cache.incr(key, amount)
+        except ValueError:  # Evicted in between
+            cache.set(key, amount, timeout=None)
+    cache.set(CALLED_AT_KEY.format(trip_id), time.time(), timeout=None)
+
+
+def _issue(trip_id):
+    key = ISSUED_KEY.format(trip_id)
+    if cache.add(key, 1, timeout=None):
+        return 1
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def _free_slots(trip_id):
+    keys = [SLOT_KEY.format(trip_id, slot) for slot in range(settings.ADMISSION_CONCURRENCY)]
+    held = cache.get_many(keys)
+    return [slot for slot, key in enumerate(keys) if key not in held]
+
+
+def _take_slot(trip_id):
+    lease = uuid.uuid4().hex
+    for slot in _free_slots(trip_id):
+        if cache.add(SLOT_KEY.format(trip_id, slot), lease, timeout=settings.ADMISSION_LEASE_SECONDS):
+            return slot, lease
+    return None, None
+
+
+def _heal(trip_id, issued, called):
+    """
+    Call more tickets when the queue stopped moving while slots are free: called tickets whose
+    holders gave up, or leases that expired, never release. One request per stall does it. With
+    no slot held at all nobody is being served, so every ticket is called at once: the queue of
+    a rush whose users gave up doesn't hold later arrivals back.
+    """
+    stalled = time.time() - _counter(CALLED_AT_KEY.format(trip_id), 0) > settings.ADMISSION_STALL_SECONDS
+    if stalled and cache.add(NUDGE_KEY.format(trip_id), 1, timeout=settings.ADMISSION_STALL_SECONDS):
+        free = len(_free_slots(trip_id))
+        if free == settings.ADMISSION_CONCURRENCY:
+            free = max(issued - called, free)
+        if free:
+            _advance(trip_id, free)
+            metrics.incr('admission_healed', free)
+            return called + free
+    return called
+
+
+def sign_ticket(trip_id, user_id, ticket):
+    return signing.dumps([trip_id, user_id, ticket], salt=TICKET_SALT, compress=True)
+
+
+def read_ticket(token, trip_id, user_id):
+    """The ticket number in a token issued to this user for this trip, or None."""
+    if not token:
+        return None
+    try:
+        ticket_trip, ticket_user, ticket = signing.loads(token, salt=TICKET_SALT, max_age=settings.ADMISSION_TICKET_MAX_AGE)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    return ticket if (ticket_trip, ticket_user) == (trip_id, user_id) else None
+
+
+def estimate_wait(trip_id, position):
+    service = _counter(SERVICE_KEY.format(trip_id), settings.ADMISSION_SERVICE_SECONDS)
+    return round(position * service / max(settings.ADMISSION_CONCURRENCY, 1), 1)
+
+
+def admit(trip_id, ticket=None):
+    """
+    Try to let a booking request for a trip in. Without a ticket the request only goes straight
+    to a slot when nobody is queued; otherwise it is given the next ticket. A ticket holder takes
+    a slot once the ticket has been called, and only once: a replayed ticket queues again.
+    Returns an Admission; release() it when admitted.
+    """
+    if not enabled():
+        return Admission(trip_id, admitted=True)
+    counters = cache.get_many([ISSUED_KEY.format(trip_id), CALLED_KEY.format(trip_id)])
+    issued = counters.get(ISSUED_KEY.format(trip_id), 0)
+    called = counters.get(CALLED_KEY.format(trip_id), 0)
+    used = USED_KEY.format(trip_id, ticket)
+    if ticket is not None and ticket <= called and not cache.add(used, 1, timeout=settings.ADMISSION_TICKET_MAX_AGE):
+        ticket = None
+    if ticket is None and issued > called:
+        ticket = _issue(trip_id)
+        metrics.incr('admission_tickets')
+    if ticket is None or ticket <= called:
+        slot, lease = _take_slot(trip_id)
+        if slot is not None:
+            metrics.incr('admission_admitted')
+            return Admission(trip_id, admitted=True, slot=slot, lease=lease, ticket=ticket, started=time.monotonic())
+        if ticket is None:  # Every slot is busy: join the queue
+            ticket = _issue(trip_id)
+            metrics.incr('admission_tickets')
+        else:  # Called but beaten to the last slot: the ticket stays good for the next try
+            cache.delete(used)
+    if ticket > called:
+        called = _heal(trip_id, max(issued, ticket), called)
+    metrics.incr('admission_queued')
+    position = max(ticket - called, 0)
+    return Admission(trip_id, admitted=False, ticket=ticket, position=position,
+                     estimated_wait=estimate_wait(trip_id, position))
+
+
+def release(admission):
+    """Give the slot back and call the next ticket, if anyone is waiting."""
+    if admission.lease is None:
+        return
+    trip_id = admission.trip_id
+    key = SLOT_KEY.format(trip_id, admission.slot)
+    if cache.get(key) == admission.lease:  # Not if the lease expired and the slot went to someone else
+        cache.delete(key)
+    held = time.monotonic() - admission.started
+    service_key = SERVICE_KEY.format(trip_id)
+    previous = _counter(service_key, held)
+    cache.set(service_key, previous + (held - previous) * 0.2, timeout=settings.ADMISSION_TICKET_MAX_AGE)
+    metrics.observe('admission_hold', held)
+    if _counter(ISSUED_KEY.format(trip_id)) > _counter(CALLED_KEY.format(trip_id)):
+        _advance(trip_id)
+
+
+def status(trip_id, ticket):
+    """Queue position of a ticket without taking a slot: for clients polling while they wait."""
+    called = _counter(CALLED_KEY.format(trip_id))
+    position = max(ticket - called, 0)
+    return {
+        'position': position,
+        'ready': position == 0,
+        'estimated_wait_seconds': estimate_wait(trip_id, position),
+        'queue_length': max(_counter(ISSUED_KEY.format(trip_id)) - called, 0),
+    }
+
+
+def reset(trip_id):
+    cache.delete_many([ISSUED_KEY.format(trip_id), CALLED_KEY.format(trip_id), CALLED_AT_KEY.format(trip_id),
+                       NUDGE_KEY.format(trip_id), SERVICE_KEY.format(trip_id)] +
+                      [SLOT_KEY.format(trip_id, slot) for slot in range(settings.ADMISSION_CONCURRENCY)])
+
+
+def queued_response(admission, user_id):
+    token = sign_ticket(admission.trip_id, user_id, admission.ticket)
+    response = Response({
+        "error": "This departure is busy; you are in the queue.",
+        "admission_ticket": token,
+        "position": admission.position,
+        "estimated_wait_seconds": admission.estimated_wait,
+    }, status=429)
+    response['Retry-After'] = str(max(int(admission.estimated_wait), 1))
+    response['X-Admission-Ticket'] = token
+    return response
+
+
+def admission_controlled(view_method):
+    """
+    Run a booking view method (request, trip_id, ...) inside an admission slot of the trip, or
+    answer 429 with a queue ticket before any database work. Clients retry with the ticket in
+    the X-Admission-Ticket header (or the admission_ticket query parameter) once the queue
+    status says ready.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, trip_id, *args, **kwargs):
+        token = request.headers.get('X-Admission-Ticket') or request.query_params.get('admission_ticket')
+        admission = admit(trip_id, read_ticket(token, trip_id, request.user.id))
+        if not admission.admitted:
+            return queued_response(admission, request.user.id)
+        try:
+            return view_method(self, request, trip_id, *args, **kwargs)
+        finally:
+            release(admission)
+    return wrapper
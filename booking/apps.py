@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class BookingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'booking'
+
+    def ready(self):
+        from . import waitlist  # noqa: F401  (connects the seats_released receiver)
+        from .autocomplete import connect_signals
+        connect_signals()
+        from . import search_cache, slow_queries
+        search_cache.connect_signals()
+        slow_queries.connect_signals()
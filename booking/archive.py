@@ -0,0 +1,109 @@
+import heapq
+import itertools
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from . import metrics
+from .models import Trip, Booking, ArchivedTrip, ArchivedBooking
+
+logger = logging.getLogger(__name__)
+
+
+def archive_departed_trips(days=None, batch_size=None, limit=None):
+    """
+    Move trips that departed more than ARCHIVE_AFTER_DAYS ago, with all their bookings, into the
+    archive tables. Each batch of trips is copied and deleted in one transaction, so a trip is
+    always in exactly one of the two places. Returns the number of trips archived.
+    """
+    days = settings.ARCHIVE_AFTER_DAYS if days is None else days
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    cutoff = timezone.now() - timezone.timedelta(days=days)
+    archived = 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        ids = list(Trip.objects.filter(departure_date__lt=cutoff).order_by('id').values_list('id', flat=True)[:size])
+        if not ids:
+            break
+        archived += _archive_batch(ids)
+        if len(ids) < size:
+            break
+    if archived:
+        metrics.incr('archived_trips', archived)
+        logger.info(f"Archived {archived} departed trips")
+    return archived
+
+
+def _archive_batch(trip_ids):
+    with transaction.atomic():
+        trips = list(Trip.objects.select_for_update()
+                     .filter(id__in=trip_ids)
+                     .select_related('start_location__city', 'destination__city', 'layout'))
+        ArchivedTrip.objects.bulk_create([
+            ArchivedTrip(
+                id=trip.id, bus_type=trip.bus_type,
+                start_city=trip.start_location.city.name, start_area=trip.start_location.name,
+                destination_city=trip.destination.city.name, destination_area=trip.destination.name,
+                departure_date=trip.departure_date, arrival_date=trip.arrival_date,
+                total_seats=trip.total_seats, available_seats=trip.available_seats, price=trip.price,
+                created_at=trip.created_at, updated_at=trip.updated_at,
+            ) for trip in trips
+        ])
+        layouts = {trip.id: trip.layout for trip in trips}
+        batch = []
+        for booking in Booking.objects.filter(trip_id__in=trip_ids).order_by('id').iterator(chunk_size=2000):
+            batch.append(ArchivedBooking(
+                id=booking.id, user_id=booking.user_id, trip_id=booking.trip_id,
+                customer_name=booking.customer_name, customer_phone=booking.customer_phone,
+                seats_booked=booking.seats_booked, selected_seats=booking.selected_seats,
+                seat_labels=[layouts[booking.trip_id].label(seat) for seat in booking.selected_seats],
+                payment_status=booking.payment_status, payment_order_id=booking.payment_order_id,
+                status=booking.status, payment_reference=booking.payment_reference,
+                payment_type=booking.payment_type, booking_date=booking.booking_date,
+                expires_at=booking.expires_at, total_price=booking.total_price,
+            ))
+            if len(batch) >= 2000:
+                ArchivedBooking.objects.bulk_create(batch)
+                batch = []
+        ArchivedBooking.objects.bulk_create(batch)
+        # Bookings (and waitlist entries) go with their trip through the cascade
+        Trip.objects.filter(id__in=trip_ids).delete()
+    return len(trips)
+
+
+# History reads: live rows first, then the archive, behind one interface.
+
+def user_history(user, offset, limit, fields=None, archived_fields=None):
+    """
+    One page of a user's bookings, newest first, across the live and archive tables: the first
+    offset + limit rows of each (both come back in booking_date order off their indexes) are
+    merged and the page sliced off. Returns (bookings, total).
+
+    With `fields` and `archived_fields` the page holds values_list() tuples instead of model
+    instances; both lists must have 'id' and 'booking_date' at the same positions.
+    """
+    end = offset + limit
+    live = Booking.objects.filter(user=user).order_by('-booking_date', '-id')
+    archived = ArchivedBooking.objects.filter(user=user).order_by('-booking_date', '-id')
+    if fields:
+        live, archived = live.values_list(*fields), archived.values_list(*archived_fields)
+        date_at, id_at = fields.index('booking_date'), fields.index('id')
+        key = lambda row: (row[date_at], row[id_at])
+    else:
+        live = live.select_related('trip__start_location__city', 'trip__destination__city')
+        archived = archived.select_related('trip')
+        key = lambda booking: (booking.booking_date, booking.id)
+    merged = heapq.merge(live[:end], archived[:end], key=key, reverse=True)
+    page = list(itertools.islice(merged, offset, end))
+    total = Booking.objects.filter(user=user).count() + ArchivedBooking.objects.filter(user=user).count()
+    return page, total
+
+
+def find_archived_booking(order_id):
+    bookings = ArchivedBooking.objects.select_related('user', 'trip')
+    lookup = {'id': order_id} if str(order_id).isdigit() else {'payment_order_id': order_id}
+    return bookings.filter(**lookup).first()
+
+
+def archived_export_queryset(**filters):
+    return ArchivedBooking.objects.filter(**filters).select_related('user', 'trip')
@@ -0,0 +1,164 @@
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from .models import City, Area
+from .utils import shared_cache
+
+# In-process prefix index over city and area names. Every name is indexed under its normalised
+# form, the same without a leading article (el/al/ال) and as a consonant skeleton shared by
+# Arabic and Latin spellings (رمسيس and "Ramses" are both "rmss"), each from every word start so
+# "gab" finds "Sidi Gaber". Lookups are a bisect into one sorted array. Edits reach other processes
+# through a generation counter in the cache, so only a shared cache (Redis/Memcached) keeps every
+# index current; with locmem an index is rebuilt once it is LOCAL_MAX_AGE seconds old instead.
+GENERATION_KEY = 'autocomplete_generation'
+SCAN_PER_RESULT = 20
+LOCAL_MAX_AGE = 60
+
+ARABIC_FOLD = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ة': 'ه', 'ى': 'ي', 'ؤ': 'و', 'ئ': 'ي', 'ـ': None,
+})
+# Arabic letters to the Latin consonant they are usually written with in Egypt; long vowels drop out
+ARABIC_TO_LATIN = str.maketrans({
+    'ب': 'b', 'ت': 't', 'ث': 's', 'ج': 'g', 'ح': 'h', 'خ': 'kh', 'د': 'd', 'ذ': 'z', 'ر': 'r', 'ز': 'z',
+    'س': 's', 'ش': 'sh', 'ص': 's', 'ض': 'd', 'ط': 't', 'ظ': 'z', 'ع': '', 'غ': 'gh', 'ف': 'f', 'ق': 'q',
+    'ك': 'k', 'ل': 'l', 'م': 'm', 'ن': 'n', 'ه': 'h', 'ء': '', 'ا': '', 'و': '', 'ي': '',
+})
+LATIN_TO_SKELETON = str.maketrans({'a': '', 'e': '', 'i': '', 'o': '', 'u': '', 'y': '', 'j': 'g', 'c': 'k', 'x': 'ks'})
+ARTICLE = re.compile(r'^(?:(?:al|el)\s+|ال)')
+SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).translate(ARABIC_FOLD)
+    return SEPARATORS.sub(' ', text).strip()
+
+
+def skeleton(normalized):
+    words = []
+    for word in ARTICLE.sub('', normalized).split():
+        word = ARTICLE.sub('', word)
+        word = word.translate(ARABIC_TO_LATIN).translate(LATIN_TO_SKELETON)
+        word = re.sub(r'(.)\1+', r'\1', word)
+        if word:
+            words.append(word)
+    return ' '.join(words)
+
+
+def variants(name):
+    normalized = normalize(name)
+    forms = {normalized, ARTICLE.sub('', normalized), skeleton(normalized)}
+    keys = set()
+    for form in filter(None, forms):
+        words = form.split()
+        keys.update(' '.join(words[i:]) for i in range(len(words)))
+    return keys
+
+
+class LocationIndex:
+    def __init__(self, cities, areas):
+        self.cities = cities  # {id: name}
+        self.areas = areas    # {id: (name, city_id)}
+        pairs = []
+        for city_id, name in cities.items():
+            pairs.extend((key, 'city', city_id) for key in variants(name))
+        for area_id, (name, _) in areas.items():
+            pairs.extend((key, 'area', area_id) for key in variants(name))
+        pairs.sort()
+        self.keys = [key for key, _, _ in pairs]
+        self.entries = [(kind, pk) for _, kind, pk in pairs]
+
+    @classmethod
+    def load(cls):
+        cities = dict(City.objects.values_list('id', 'name'))
+        areas = {pk: (name, city_id) for pk, name, city_id in Area.objects.values_list('id', 'name', 'city_id')}
+        return cls(cities, areas)
+
+    def _scan(self, key, kind, max_scan=None):
+        matches = {}
+        start = bisect.bisect_left(self.keys, key)
+        stop = len(self.keys) if max_scan is None else min(len(self.keys), start + max_scan)
+        for i in range(start, stop):
+            if not self.keys[i].startswith(key):
+                break
+            entry_kind, pk = self.entries[i]
+            if kind in (None, entry_kind):
+                rank = (self.keys[i] != key, len(self.keys[i]))
+                matches[(entry_kind, pk)] = min(rank, matches.get((entry_kind, pk), rank))
+        return matches
+
+    def search(self, text, kind=None, city_id=None, limit=10, spelling=True):
+        """
+        (kind, id) pairs whose name starts with text at a word boundary, exact and shorter names first,
+        then (with `spelling`) names sharing its consonant skeleton. With a limit only the first
+        SCAN_PER_RESULT * limit keys after the prefix are looked at, so a one-letter prefix costs the
+        same as a long one.
+        """
+        normalized = normalize(text)
+        if not normalized:
+            return []
+        max_scan = limit * SCAN_PER_RESULT if limit else None
+        matches = self._scan(normalized, kind, max_scan)
+        consonants = skeleton(normalized) if spelling else ''
+        if consonants:
+            for key, rank in self._scan(consonants, kind, max_scan).items():
+                matches.setdefault(key, (True, rank[1] + 100))  # Spelling-variant hits rank after direct ones
+        if city_id is not None:
+            matches = {key: rank for key, rank in matches.items() if key[0] == 'city' or self.areas[key[1]][1] == city_id}
+        ranked = sorted(matches, key=lambda key: (matches[key], key))
+        return ranked[:limit] if limit else ranked
+
+    def resolve(self, text, kind, city_id=None):
+        """
+        Ids of every `kind` location matching text, for turning a typed name into an id filter. Only
+        direct matches count: skeletons are loose enough ("alex" and "luxor" are both "lks") that they
+        are fine for suggestions but would filter in trips of unrelated cities.
+        """
+        return [pk for _, pk in self.search(text, kind, city_id=city_id, limit=None, spelling=False)]
+
+    def describe(self, kind, pk):
+        if kind == 'city':
+            return {'type': 'city', 'id': pk, 'name': self.cities[pk]}
+        name, city_id = self.areas[pk]
+        return {'type': 'area', 'id': pk, 'name': name, 'city_id': city_id, 'city': self.cities.get(city_id)}
+
+
+_index = None
+_index_generation = None
+_index_built_at = 0
+_lock = threading.Lock()
+
+
+def _stale(generation):
+    if _index is None or generation != _index_generation:
+        return True
+    return not shared_cache() and time.monotonic() - _index_built_at > LOCAL_MAX_AGE
+
+
+def get_index():
+    """The current index, rebuilt when any process has bumped the generation since it was built."""
+    global _index, _index_generation, _index_built_at
+    generation = cache.get(GENERATION_KEY, 0)
+    if _stale(generation):
+        with _lock:
+            if _stale(generation):
+                _index, _index_generation, _index_built_at = LocationIndex.load(), generation, time.monotonic()
+    return _index
+
+
+def invalidate(**kwargs):
+    if not cache.add(GENERATION_KEY, 1, timeout=None):
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:  # Evicted between add() and incr()
+            cache.set(GENERATION_KEY, 1, timeout=None)
+
+
+def connect_signals():
+    for model in (City, Area):
+        post_save.connect(invalidate, sender=model, dispatch_uid=f'autocomplete_{model.__name__}_save')
+        post_delete.connect(invalidate, sender=model, dispatch_uid=f'autocomplete_{model.__name__}_delete')
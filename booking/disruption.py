@@ -0,0 +1,177 @@
+import logging
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.timezone import localtime
+from . import metrics, seat_events
+from .mail import dispatcher
+from .models import Booking, Trip, WaitlistEntry
+from .seating import pick_seats
+from .signals import seats_released
+
+logger = logging.getLogger(__name__)
+
+LIVE_STATUSES = ('PENDING', 'CONFIRMED')
+
+
+def _lock_trips(*trip_ids):
+    """Lock the trips in id order (so two disruptions crossing the same pair can't deadlock) and return them by id."""
+    trips = {trip.id: trip for trip in Trip.objects.select_for_update().select_related('layout')
+             .filter(id__in=trip_ids).order_by('id')}
+    missing = set(trip_ids) - set(trips)
+    if missing:
+        raise Trip.DoesNotExist(f"Trip {min(missing)} does not exist")
+    return trips
+
+
+def _live_bookings(trip_id):
+    return list(Booking.objects.select_for_update().select_related('user')
+                .filter(trip_id=trip_id, status__in=LIVE_STATUSES).order_by('booking_date', 'id'))
+
+
+def _close(trip):
+    """Stop selling a trip that is called off and let its waitlist go."""
+    trip.cancelled_at = trip.cancelled_at or timezone.now()
+    WaitlistEntry.objects.filter(trip_id=trip.id, status__in=('WAITING', 'OFFERED')).update(status='LEFT')
+
+
+def cancel_trip(trip_id, reason='', notify=True):
+    """
+    Call a trip off: cancel all its live bookings in one transaction under the trip lock, free
+    their seats and close the trip to new bookings. Returns the cancelled bookings.
+    """
+    with metrics.timed('disruption'), transaction.atomic():
+        trip = _lock_trips(trip_id)[trip_id]
+        bookings = _live_bookings(trip_id)
+        seats = [seat for booking in bookings for seat in booking.selected_seats]
+        trip.release_seats(seats)
+        trip.available_seats = min(trip.available_seats + sum(booking.seats_booked for booking in bookings), trip.total_seats)
+        _close(trip)
+        trip.save()
+        Booking.objects.filter(id__in=[booking.id for booking in bookings]).update(status='CANCELLED')
+        for booking in bookings:
+            booking.status = 'CANCELLED'
+        if seats:
+            seat_events.publish_on_commit(trip_id, seat_events.RELEASED, seats)
+        if notify:
+            transaction.on_commit(lambda: notify_passengers(bookings, trip, None, reason))
+    metrics.incr('disruption_bookings_cancelled', len(bookings))
+    logger.warning(f"Trip {trip_id} called off: {len(bookings)} bookings cancelled. {reason}")
+    return bookings
+
+
+def plan_move(bookings, target, seat_map=None):
+    """
+    New seats on `target` for each booking: {booking id: [seats]}. Seats in `seat_map`
+    ({old seat: new seat}) are placed as given; other seats keep their number when it is free
+    on the target, and the rest of each party is seated together where possible.
+    Raises ValidationError when the target can't take everyone.
+    """
+    seat_map = {str(old): int(new) for old, new in (seat_map or {}).items()}
+    free = target.free_bitmap
+    needed = sum(booking.seats_booked for booking in bookings)
+    if needed > target.available_seats or needed > bin(free).count('1'):
+        raise ValidationError(f"The replacement trip has {target.available_seats} free seats; {needed} are needed.")
+
+    def take(seat):
+        nonlocal free
+        if not 0 < seat <= target.total_seats or not free >> (seat - 1) & 1:
+            raise ValidationError(f"Seat {seat} is not available on the replacement trip.")
+        free &= ~(1 << (seat - 1))
+        return seat
+
+    plan = {booking.id: [] for booking in bookings}
+    unplaced = {}
+    # Explicit mappings first, then same-number seats, so neither is taken by an automatic pick
+    for booking in bookings:
+        for seat in booking.selected_seats:
+            if str(seat) in seat_map:
+                plan[booking.id].append(take(seat_map[str(seat)]))
+    for booking in bookings:
+        for seat in booking.selected_seats:
+            if str(seat) in seat_map:
+                continue
+            if str(seat).isdigit() and 0 < int(seat) <= target.total_seats and free >> (int(seat) - 1) & 1:
+                plan[booking.id].append(take(int(seat)))
+            else:
+                unplaced[booking.id] = unplaced.get(booking.id, 0) + 1
+    for booking_id, count in unplaced.items():
+        picked = pick_seats(free, target.total_seats, count, seats_per_row=target.layout.seats_per_row)
+        if not picked:
+            raise ValidationError("Not enough seats on the replacement trip.")
+        plan[booking_id].extend(take(seat) for seat in picked)
+    return plan
+
+
+def move_trip(trip_id, target_trip_id, seat_map=None, reason='', notify=True, close=True):
+    """
+    Move every live booking of a trip onto a replacement trip in one transaction. Both trips are
+    locked in id order, so bookings racing for the target's seats either land before (and are
+    worked around) or wait until the move is done. All or nothing: if the target can't take
+    everyone nothing changes. The target must have the same fare, since booking totals and gateway
+    orders are for the old one. The source trip is closed unless close=False. Returns
+    {booking id: new seats}.
+    """
+    if trip_id == target_trip_id:
+        raise ValidationError("The replacement trip must be a different trip.")
+    with metrics.timed('disruption'), transaction.atomic():
+        trips = _lock_trips(trip_id, target_trip_id)
+        source, target = trips[trip_id], trips[target_trip_id]
+        if target.cancelled_at:
+            raise ValidationError("The replacement trip has been cancelled.")
+        if target.price != source.price:
+            raise ValidationError(f"The replacement trip costs {target.price} instead of {source.price}; "
+                                  f"cancel the trip and let passengers rebook instead.")
+        bookings = _live_bookings(trip_id)
+        plan = plan_move(bookings, target, seat_map)
+
+        old_seats = [seat for booking in bookings for seat in booking.selected_seats]
+        new_seats = [seat for seats in plan.values() for seat in seats]
+        moved = sum(booking.seats_booked for booking in bookings)
+        source.release_seats(old_seats)
+        source.available_seats = min(source.available_seats + moved, source.total_seats)
+        if close:
+            _close(source)
+        target.book_seats(new_seats)
+        target.available_seats -= moved
+        source.save()
+        target.save()
+        for booking in bookings:
+            booking.trip = target
+            booking.selected_seats = sorted(plan[booking.id])
+        Booking.objects.bulk_update(bookings, ['trip', 'selected_seats'])
+        if old_seats:
+            seat_events.publish_on_commit(source.id, seat_events.RELEASED, old_seats)
+            seat_events.publish_on_commit(target.id, seat_events.BOOKED, new_seats)
+            if not close:  # The source keeps running: its freed seats go to its waitlist
+                transaction.on_commit(lambda: seats_released.send(sender=Trip, trip_id=source.id))
+        if notify:
+            transaction.on_commit(lambda: notify_passengers(bookings, source, target, reason))
+    metrics.incr('disruption_bookings_moved', len(bookings))
+    logger.warning(f"Trip {trip_id} disrupted: {len(bookings)} bookings moved to trip {target_trip_id}. {reason}")
+    return plan
+
+
+def notify_passengers(bookings, trip, target=None, reason=''):
+    """Queue one email per booking; the mail dispatcher sends them in batches at MAIL_DISPATCH_RATE."""
+    route = f"{trip.start_location} → {trip.destination} on {localtime(trip.departure_date):%a, %b %d, %I:%M %p}"
+    for booking in bookings:
+        if target is None:
+            subject = 'Your trip has been cancelled'
+            change = f"We're sorry: your trip {route} has been cancelled, and booking #{booking.id} with it."
+            if booking.payment_status == 'PAID':
+                change += " Your payment will be refunded."
+        else:
+            subject = 'Your trip has changed'
+            change = (f"Your trip {route} can no longer run. "
+                      f"Booking #{booking.id} has been moved to the departure on "
+                      f"{localtime(target.departure_date):%a, %b %d, %I:%M %p}, seats "
+                      f"{', '.join(target.seat_label(seat) for seat in booking.selected_seats)}. "
+                      f"Download your updated ticket from the app.")
+        body = f"Dear {booking.customer_name},\n\n{change}\n" + (f"\nReason: {reason}\n" if reason else '')
+        dispatcher.enqueue(EmailMessage(
+            subject=subject, body=body, from_email=settings.EMAIL_HOST_USER, to=[booking.user.email],
+        ))
+    metrics.incr('disruption_notifications', len(bookings))
@@ -0,0 +1,125 @@
+import json
+from decimal import Decimal
+from functools import lru_cache
+from django.http import HttpResponse
+from django.utils import timezone
+
+# Serializer-free encoders for the hot read endpoints. Rows come straight from values_list() in the
+# field orders below and are turned into the exact structures the DRF serializers produce, then
+# rendered the way rest_framework's JSONRenderer renders them (compact, unescaped unicode). The
+# output is byte-for-byte the serializer output; FastEncoderCompatibilityTests checks that.
+CENTS = Decimal('0.01')
+
+TRIP_FIELDS = (
+    'id', 'start_location__city__name', 'start_location__name', 'destination__city__name', 'destination__name',
+    'bus_type', 'departure_date', 'arrival_date', 'total_seats', 'available_seats', 'price',
+    'created_at', 'updated_at', 'occupancy',
+)
+BOOKING_LIST_FIELDS = (
+    'id', 'booking_date', 'trip_id', 'trip__start_location__name', 'trip__destination__name', 'trip__bus_type',
+    'trip__departure_date', 'trip__price', 'seats_booked', 'selected_seats', 'payment_status', 'status',
+    'total_price', 'payment_type',
+)
+ARCHIVED_BOOKING_LIST_FIELDS = tuple(
+    {'trip__start_location__name': 'trip__start_area', 'trip__destination__name': 'trip__destination_area'}.get(field, field)
+    for field in BOOKING_LIST_FIELDS
+)
+
+
+def render(data):
+    """Same bytes as rest_framework.renderers.JSONRenderer().render(data)."""
+    body = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    return body.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode('utf-8')
+
+
+def accepts_fast_json(request):
+    """Only plain JSON responses take the fast path; the browsable API and ?indent= keep the serializers."""
+    return request.accepted_renderer.format == 'json' and 'indent' not in (request.accepted_media_type or '')
+
+
+def json_response(body, status=200):
+    return HttpResponse(body, status=status, content_type='application/json')
+
+
+def format_datetime(value, tz):
+    # DRF DateTimeField: converted to the current time zone, ISO 8601, UTC written as Z
+    if not value:
+        return None
+    value = value.astimezone(tz).isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def format_decimal(value):
+    # DRF DecimalField with COERCE_DECIMAL_TO_STRING and decimal_places=2
+    return None if value is None else f'{value.quantize(CENTS):f}'
+
+
+@lru_cache(maxsize=4096)
+def seat_statuses(total_seats, occupancy):
+    """TripSerializer.get_seat_statuses for one occupancy bitmap; trips with the same bitmap share it."""
+    booked = int.from_bytes(occupancy, 'little')
+    return tuple({'seat': str(n), 'status': 'booked' if booked >> (n - 1) & 1 else 'available'}
+                 for n in range(1, total_seats + 1))
+
+
+def _trip(row, tz):
+    (pk, start_city, start_area, destination_city, destination_area, bus_type, departure, arrival,
+     total_seats, available_seats, price, created_at, updated_at, occupancy) = row
+    return {
+        'id': pk,
+        'start_location': f'{start_city}, {start_area}',
+        'destination': f'{destination_city}, {destination_area}',
+        'bus_type': bus_type,
+        'departure_date': format_datetime(departure, tz),
+        'arrival_date': format_datetime(arrival, tz),
+        'total_seats': total_seats,
+        'available_seats': available_seats,
+        'price': format_decimal(price),
+        'created_at': format_datetime(created_at, tz),
+        'updated_at': format_datetime(updated_at, tz),
+        'formatted_departure': f'{departure:%Y-%m-%d}',
+        'formatted_arrival': f'{arrival:%Y-%m-%d}',
+    }, bytes(occupancy or b'')
+
+
+@lru_cache(maxsize=4096)
+def _seat_statuses_json(total_seats, occupancy):
+    return render(seat_statuses(total_seats, occupancy)).decode('utf-8')
+
+
+def render_trip_rows(rows):
+    """
+    Rendered TripSerializer(many=True).data for TRIP_FIELDS rows. Each trip's seat list is spliced in
+    from a per-bitmap cache of its rendered JSON rather than encoded again for every row.
+    """
+    tz = timezone.get_current_timezone()
+    parts = []
+    for row in rows:
+        trip, occupancy = _trip(row, tz)
+        body = render(trip).decode('utf-8')
+        parts.append(f'{body[:-1]},"seat_statuses":{_seat_statuses_json(trip["total_seats"], occupancy)}}}')
+    return f'[{",".join(parts)}]'.encode('utf-8')
+
+
+def booking_list_rows(rows):
+    """LightweightBookingSerializer(many=True).data for BOOKING_LIST_FIELDS rows."""
+    tz = timezone.get_current_timezone()
+    return [{
+        'id': pk,
+        'trip': {
+            'id': trip_id,
+            'start_location': {'name': start_area},
+            'destination': {'name': destination_area},
+            'bus_type': bus_type,
+            'departure_date': format_datetime(departure, tz),
+            'price': format_decimal(price),
+        },
+        'seats_booked': seats_booked,
+        'selected_seats': selected_seats,
+        'payment_status': payment_status,
+        'status': status,
+        'booking_date': format_datetime(booking_date, tz),
+        'total_price': format_decimal(total_price),
+        'payment_type': payment_type,
+    } for (pk, booking_date, trip_id, start_area, destination_area, bus_type, departure, price, seats_booked,
+           selected_seats, payment_status, status, total_price, payment_type) in rows]
@@ -0,0 +1,118 @@
+import csv
+import itertools
+import json
+from django.db import connection
+from django.utils.timezone import localtime
+from .models import Booking
+from .archive import archived_export_queryset
+
+# Streaming exports: bookings are read in chunks with one fixed join plan and turned into
+# rows one at a time, so memory stays flat however many rows are exported.
+EXPORT_CHUNK_SIZE = 2000
+
+MANIFEST_COLUMNS = ['booking_id', 'seats', 'customer_name', 'customer_phone', 'status', 'payment_status', 'payment_type', 'total_price']
+BOOKING_COLUMNS = [
+    'booking_id', 'booking_date', 'trip_id', 'from', 'to', 'departure_date', 'bus_type', 'user_email',
+    'customer_name', 'customer_phone', 'seats_booked', 'seats', 'status', 'payment_status', 'payment_type',
+    'payment_order_id', 'payment_reference', 'total_price',
+]
+
+
+def export_queryset(**filters):
+    return (Booking.objects.filter(**filters)
+            .select_related('user', 'trip__start_location__city', 'trip__destination__city')
+            .only('id', 'booking_date', 'customer_name', 'customer_phone', 'seats_booked', 'selected_seats', 'status',
+                  'payment_status', 'payment_type', 'payment_order_id', 'payment_reference', 'total_price',
+                  'user__email', 'trip__id', 'trip__bus_type', 'trip__departure_date',
+                  'trip__start_location__name', 'trip__start_location__city__name',
+                  'trip__destination__name', 'trip__destination__city__name'))
+
+
+def iterate(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the rows of an id-ordered queryset chunk by chunk. mysqlclient buffers whole result sets
+    client-side even under .iterator(), so on MySQL the chunks are fetched by keyset (id > last id).
+    """
+    if connection.vendor != 'mysql':
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        last_id = chunk[-1].id
+
+
+def manifest_rows(trip_id, chunk_size=EXPORT_CHUNK_SIZE):
+    # A trip's bookings are all live or all archived; reading both keeps manifests of past trips working
+    querysets = (export_queryset(trip_id=trip_id), archived_export_queryset(trip_id=trip_id))
+    bookings = (iterate(queryset.exclude(status='CANCELLED').order_by('id'), chunk_size) for queryset in querysets)
+    for booking in itertools.chain.from_iterable(bookings):
+        yield {
+            'booking_id': booking.id,
+            'seats': ' '.join(map(str, booking.selected_seats)),
+            'customer_name': booking.customer_name,
+            'customer_phone': booking.customer_phone,
+            'status': booking.status,
+            'payment_status': booking.payment_status,
+            'payment_type': booking.payment_type,
+            'total_price': str(booking.total_price),
+        }
+
+
+def booking_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    for booking in iterate(queryset.order_by('id'), chunk_size):
+        trip = booking.trip
+        yield {
+            'booking_id': booking.id,
+            'booking_date': localtime(booking.booking_date).isoformat(),
+            'trip_id': trip.id,
+            'from': str(trip.start_location),
+            'to': str(trip.destination),
+            'departure_date': localtime(trip.departure_date).isoformat(),
+            'bus_type': trip.bus_type,
+            'user_email': booking.user.email,
+            'customer_name': booking.customer_name,
+            'customer_phone': booking.customer_phone,
+            'seats_booked': booking.seats_booked,
+            'seats': ' '.join(map(str, booking.selected_seats)),
+            'status': booking.status,
+            'payment_status': booking.payment_status,
+            'payment_type': booking.payment_type,
+            'payment_order_id': booking.payment_order_id or '',
+            'payment_reference': booking.payment_reference or '',
+            'total_price': str(booking.total_price),
+        }
+
+
+def booking_history_rows(chunk_size=EXPORT_CHUNK_SIZE, **filters):
+    """booking_rows over the archive and then the live table, for the same filters."""
+    return itertools.chain(booking_rows(archived_export_queryset(**filters), chunk_size),
+                           booking_rows(export_queryset(**filters), chunk_size))
+
+
+class _Echo:
+    """File-like object whose write() just hands the line back, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(rows, columns):
+    writer = csv.DictWriter(_Echo(), fieldnames=columns)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def render_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'jsonl': (lambda rows, columns: render_jsonl(rows), 'application/x-ndjson; charset=utf-8'),
+}
@@ -0,0 +1,140 @@
+import logging
+from itertools import groupby
+from django.conf import settings
+from django.db import transaction
+from . import metrics, search_cache, seat_events
+from .models import Booking, Trip
+from .signals import seats_released
+
+logger = logging.getLogger(__name__)
+
+# Statuses whose bookings hold seats
+LIVE_STATUSES = ('PENDING', 'CONFIRMED')
+
+
+def expected_inventory(total_seats, bookings):
+    """
+    What a trip's seat columns should say given its live bookings [(seats_booked, selected_seats)]:
+    (occupancy bitmap, seats booked, seats claimed twice, seat values that aren't seats of this trip).
+    """
+    bitmap = booked = conflicts = 0
+    invalid = []
+    for seats_booked, selected_seats in bookings:
+        booked += seats_booked
+        for seat in selected_seats or ():
+            if not str(seat).isdigit() or not 0 < int(seat) <= total_seats:
+                invalid.append(seat)
+                continue
+            bit = 1 << (int(seat) - 1)
+            if bitmap & bit:
+                conflicts |= bit
+            bitmap |= bit
+    return bitmap, booked, conflicts, invalid
+
+
+def seats_of(bitmap):
+    seats, seat = [], 1
+    while bitmap:
+        if bitmap & 1:
+            seats.append(seat)
+        bitmap >>= 1
+        seat += 1
+    return seats
+
+
+def compare(trip_id, total_seats, available_seats, occupancy, bookings):
+    """The drift of one trip as a dict, or None when its columns match its bookings."""
+    stored = int.from_bytes(bytes(occupancy or b''), 'little')
+    expected, booked, conflicts, invalid = expected_inventory(total_seats, bookings)
+    expected_available = max(total_seats - booked, 0)
+    if stored == expected and available_seats == expected_available and not conflicts and not invalid:
+        return None
+    return {
+        'trip_id': trip_id,
+        'available_seats': available_seats,
+        'expected_available_seats': expected_available,
+        'missing': seats_of(expected & ~stored),  # Booked by someone but free on the trip
+        'stray': seats_of(stored & ~expected),  # Marked booked with no live booking behind them
+        'conflicts': seats_of(conflicts),  # Held by more than one live booking: needs a human
+        'invalid': invalid,
+    }
+
+
+def check_inventory(chunk_size=None):
+    """
+    Compare every trip's available_seats and occupancy bitmap with its live bookings, chunk_size
+    trips at a time: each chunk is fetched by keyset (id > last id) and its bookings with one
+    trip_id IN query, both as plain tuples. mysqlclient buffers whole result sets client-side even
+    under .iterator(), so this is what keeps memory at one chunk however many bookings there are.
+    Returns the drifted trips (see compare()). Rows can change while the scan runs, so repair
+    re-checks under lock.
+    """
+    chunk_size = chunk_size or settings.INVENTORY_CHUNK_SIZE
+    trips = Trip.objects.order_by('id').values_list('id', 'total_seats', 'available_seats', 'occupancy')
+    live = Booking.objects.filter(status__in=LIVE_STATUSES).order_by('trip_id')
+    drift = []
+    checked = last_id = 0
+    with metrics.timed('inventory_check'):
+        while True:
+            chunk = list(trips.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            rows = live.filter(trip_id__in=[row[0] for row in chunk]).values_list('trip_id', 'seats_booked', 'selected_seats')
+            by_trip = {trip_id: [(seats_booked, selected) for _, seats_booked, selected in group]
+                       for trip_id, group in groupby(rows, key=lambda row: row[0])}
+            for trip_id, total_seats, available_seats, occupancy in chunk:
+                result = compare(trip_id, total_seats, available_seats, occupancy, by_trip.get(trip_id, []))
+                if result:
+                    drift.append(result)
+            checked += len(chunk)
+            last_id = chunk[-1][0]
+    metrics.set_value('inventory_trips_checked', checked)
+    metrics.set_value('inventory_drift', len(drift))
+    return drift
+
+
+def repair_inventory(trip_ids, batch_size=None):
+    """
+    Rewrite available_seats and occupancy from the live bookings, batch_size trips per
+    transaction with their rows locked in id order (the order every other multi-trip lock uses).
+    Double-booked seats stay booked and are only reported. Returns the number of trips changed.
+    """
+    batch_size = batch_size or settings.INVENTORY_REPAIR_BATCH
+    trip_ids = sorted(trip_ids)
+    repaired = 0
+    for start in range(0, len(trip_ids), batch_size):
+        batch = trip_ids[start:start + batch_size]
+        with transaction.atomic():
+            trips = list(Trip.objects.select_for_update().filter(id__in=batch).order_by('id')
+                         .only('id', 'total_seats', 'available_seats', 'occupancy',
+                               'start_location', 'destination', 'departure_date'))
+            rows = (Booking.objects.filter(trip_id__in=batch, status__in=LIVE_STATUSES).order_by('trip_id')
+                    .values_list('trip_id', 'seats_booked', 'selected_seats'))
+            by_trip = {trip_id: [(seats_booked, selected) for _, seats_booked, selected in group]
+                       for trip_id, group in groupby(rows, key=lambda row: row[0])}
+            changed = []
+            for trip in trips:
+                result = compare(trip.id, trip.total_seats, trip.available_seats, trip.occupancy, by_trip.get(trip.id, []))
+                if result is None:
+                    continue
+                if result['conflicts'] or result['invalid']:
+                    logger.error(f"Trip {trip.id} has double-booked seats {result['conflicts']} "
+                                 f"or invalid seats {result['invalid']}; these need manual attention")
+                if not (result['missing'] or result['stray'] or
+                        result['available_seats'] != result['expected_available_seats']):
+                    continue
+                trip.booked_bitmap = expected_inventory(trip.total_seats, by_trip.get(trip.id, []))[0]
+                trip.available_seats = result['expected_available_seats']
+                changed.append(trip)
+                logger.warning(f"Repaired trip {trip.id}: available {result['available_seats']} -> "
+                               f"{trip.available_seats}, missing {result['missing']}, stray {result['stray']}")
+                if result['missing']:
+                    seat_events.publish_on_commit(trip.id, seat_events.BOOKED, result['missing'])
+                if result['stray']:
+                    seat_events.publish_on_commit(trip.id, seat_events.RELEASED, result['stray'])
+                    transaction.on_commit(lambda trip_id=trip.id: seats_released.send(sender=Trip, trip_id=trip_id))
+            Trip.objects.bulk_update(changed, ['available_seats', 'occupancy'])
+            search_cache.invalidate_trips(changed)
+        repaired += len(changed)
+    metrics.incr('inventory_repaired', repaired)
+    return repaired
@@ -0,0 +1,97 @@
+import logging
+from collections import defaultdict
+from django.conf import settings
+from django.utils import timezone
+from .archive import archive_departed_trips
+from .inventory import check_inventory, repair_inventory
+from .models import Booking
+from .payment_events import consume
+from .reconcile import held_at_gateway, reconcile_bookings
+from .tokens import prune_expired_tokens
+from .waitlist import match_all
+
+logger = logging.getLogger(__name__)
+
+# Maintenance jobs run by booking/scheduler.py, by name; how often each runs is SCHEDULER_JOB_INTERVALS[name].
+# A job returns the number of rows it handled.
+JOBS = {}
+
+
+def job(name):
+    def register(func):
+        JOBS[name] = func
+        return func
+    return register
+
+
+@job('expire_bookings')
+def expire_pending_bookings(batch_size=None):
+    """
+    Cancel PENDING bookings whose hold has run out and give their seats back. Bookings are
+    grouped by trip so each trip row is locked once per batch instead of once per booking.
+    """
+    batch_size = batch_size or settings.SCHEDULER_EXPIRY_BATCH
+    now = timezone.now()
+    expired = Booking.objects.filter(status='PENDING', expires_at__lt=now)
+
+    # Lost callbacks are settled by the reconcile_payments job, which has asked the gateway about
+    # these bookings since RECONCILE_AFTER_MINUTES. Payments it found still in progress are held
+    # back for up to RECONCILE_EXPIRY_GRACE_MINUTES; everything else expires now.
+    grace = now - timezone.timedelta(minutes=settings.RECONCILE_EXPIRY_GRACE_MINUTES)
+    online = expired.filter(payment_order_id__isnull=False, expires_at__gte=grace).exclude(payment_type='CASH')
+    held = held_at_gateway(online, limit=batch_size) if online.exists() else []
+    expired = expired.exclude(id__in=held)
+    cancelled = 0
+    failed = set()
+    while True:
+        by_trip = defaultdict(list)
+        rows = list(expired.exclude(trip_id__in=failed).order_by('expires_at').values_list('id', 'trip_id')[:batch_size])
+        for booking_id, trip_id in rows:
+            by_trip[trip_id].append(booking_id)
+        for trip_id in sorted(by_trip):
+            # One trip that fails validation mustn't keep every other trip's seats held
+            try:
+                count = Booking.cancel_pending(trip_id, by_trip[trip_id], expires_at__lt=now)
+            except Exception:
+                logger.exception(f"Could not expire pending bookings on trip {trip_id}")
+                failed.add(trip_id)
+                continue
+            if count:
+                logger.info(f"Expired {count} pending bookings on trip {trip_id}")
+            cancelled += count
+        if len(rows) < batch_size:
+            return cancelled
+
+
+@job('match_waitlists')
+def match_waitlists():
+    return match_all()
+
+
+@job('prune_tokens')
+def prune_tokens():
+    return prune_expired_tokens()
+
+
+@job('archive_trips')
+def archive_trips():
+    return archive_departed_trips()
+
+
+@job('reconcile_payments')
+def reconcile_payments():
+    result = reconcile_bookings()
+    return result['confirmed'] + result['cancelled']
+
+
+@job('payment_events')
+def payment_events():
+    return consume()
+
+
+@job('check_inventory')
+def check_and_repair_inventory():
+    drift = check_inventory()
+    if drift and settings.INVENTORY_AUTO_REPAIR:
+        return repair_inventory([trip['trip_id'] for trip in drift])
+    return len(drift)
@@ -0,0 +1,140 @@
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.core.mail import get_connection
+from django.template.loader import get_template
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def render_template(name, context):
+    """Render an email template; Django's cached template loader compiles it once per process."""
+    return get_template(name).render(context)
+
+
+class MailDispatcher:
+    """
+    Queues outgoing mail and sends it from a small pool of worker threads. Each worker
+    keeps one SMTP connection open and sends everything that is queued over it in
+    batches, closing it only after MAIL_DISPATCH_IDLE_TIMEOUT seconds without mail.
+    Messages are split per recipient so a failing address is retried on its own.
+    Workers together send at most MAIL_DISPATCH_RATE messages per second (0 for no limit),
+    so a fan-out to a whole coach doesn't trip the SMTP provider's rate limit.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._pace_lock = threading.Lock()
+        self._next_send_at = 0.0
+
+    @property
+    def is_async(self):
+        return getattr(settings, 'MAIL_DISPATCH_ASYNC', True)
+
+    def enqueue(self, message):
+        for single in self._split(message):
+            metrics.incr('mail_queued')
+            if self.is_async:
+                self._ensure_workers()
+                self._queue.put((single, time.monotonic()))
+            else:
+                connection = get_connection(fail_silently=False)
+                try:
+                    self._send_batch(connection, [(single, time.monotonic())])
+                finally:
+                    connection.close()
+        metrics.set_value('mail_queue_depth', self._queue.qsize())
+
+    def flush(self):
+        """Block until everything queued so far has been sent (or given up on)."""
+        if self._workers:
+            self._queue.join()
+
+    def _split(self, message):
+        recipients = message.to + message.cc + message.bcc
+        if len(recipients) <= 1:
+            return [message]
+        messages = []
+        for recipient in recipients:
+            copy = type(message)(
+                subject=message.subject, body=message.body, from_email=message.from_email,
+                to=[recipient], headers=message.extra_headers, reply_to=message.reply_to,
+            )
+            copy.attachments = list(message.attachments)
+            copy.content_subtype = message.content_subtype
+            copy.alternatives = list(getattr(message, 'alternatives', []))
+            messages.append(copy)
+        return messages
+
+    def _ensure_workers(self):
+        if len(self._workers) >= settings.MAIL_DISPATCH_WORKERS:
+            return
+        with self._lock:
+            while len(self._workers) < settings.MAIL_DISPATCH_WORKERS:
+                worker = threading.Thread(target=self._run, name=f'mail-dispatcher-{len(self._workers)}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _run(self):
+        connection = get_connection(fail_silently=False)
+        while True:
+            try:
+                first = self._queue.get(timeout=settings.MAIL_DISPATCH_IDLE_TIMEOUT)
+            except queue.Empty:
+                connection.close()
+                continue
+            batch = [first]
+            while len(batch) < settings.MAIL_DISPATCH_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._send_batch(connection, batch, paced=True)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                metrics.set_value('mail_queue_depth', self._queue.qsize())
+
+    def _pace(self):
+        rate = settings.MAIL_DISPATCH_RATE
+        if rate <= 0:
+            return
+        with self._pace_lock:  # Shared by all workers: each claims the next free send slot
+            now = time.monotonic()
+            send_at = max(now, self._next_send_at)
+            self._next_send_at = send_at + 1 / rate
+        if send_at > now:
+            time.sleep(send_at - now)
+
+    def _send_batch(self, connection, batch, paced=False):
+        for message, queued_at in batch:
+            message.connection = connection
+            if paced:
+                self._pace()
+            for attempt in range(1, settings.MAIL_DISPATCH_MAX_RETRIES + 1):
+                try:
+                    with metrics.timed('mail_send'):
+                        connection.open()
+                        connection.send_messages([message])
+                    metrics.incr('mail_sent')
+                    metrics.observe('mail_delivery', time.monotonic() - queued_at)
+                    break
+                except Exception as e:
+                    # Drop the (possibly broken) connection; open() reconnects on the next attempt.
+                    connection.close()
+                    if attempt == settings.MAIL_DISPATCH_MAX_RETRIES:
+                        metrics.incr('mail_failed')
+                        logger.error(f"Failed to send email to {message.to}: {str(e)}")
+                    else:
+                        metrics.incr('mail_retries')
+                        time.sleep(settings.MAIL_DISPATCH_RETRY_DELAY * attempt)
+
+
+dispatcher = MailDispatcher()
+
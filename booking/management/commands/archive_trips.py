@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from booking.archive import archive_departed_trips
+
+
+class Command(BaseCommand):
+    help = 'Moves departed trips and their bookings into the archive tables in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Archive trips that departed more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many trips')
+
+    def handle(self, *args, **options):
+        archived = archive_departed_trips(options['days'], options['batch_size'], options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} trips.'))
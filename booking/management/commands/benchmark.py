@@ -0,0 +1,209 @@
+import random
+import statistics
+import threading
+import time
+import uuid
+from decimal import Decimal
+from unittest.mock import patch
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from booking import admission, encoders
+from booking.autocomplete import LocationIndex
+from booking.models import User, City, Area, Trip, Booking
+from booking.seating import pick_seats
+from booking.serializers import TripSerializer, LightweightBookingSerializer
+
+
+class Command(BaseCommand):
+    help = 'Runs in-process micro-benchmarks of hot booking code paths'
+
+    SCENARIOS = ['seating', 'autocomplete', 'encoders', 'contention']
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.SCENARIOS)
+        parser.add_argument('--iterations', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        getattr(self, f"bench_{options['scenario']}")(options['iterations'], random.Random(options['seed']))
+
+    def report(self, name, samples):
+        samples = sorted(samples)
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        self.stdout.write(f'{name:<40} mean {statistics.fmean(samples) * 1e6:9.2f} us   '
+                          f'p50 {samples[len(samples) // 2] * 1e6:9.2f} us   p99 {p99 * 1e6:9.2f} us')
+
+    def bench_seating(self, iterations, rng):
+        # Full-size coaches at different occupancy levels, picking 1-6 seats with random preferences
+        for total_seats in (49, 60):
+            for occupancy in (0.2, 0.6, 0.9):
+                samples = []
+                for _ in range(iterations):
+                    free = 0
+                    for index in range(total_seats):
+                        if rng.random() > occupancy:
+                            free |= 1 << index
+                    count = rng.randint(1, 6)
+                    preferences = {'together': rng.random() < 0.8, 'window': rng.random() < 0.5, 'front': rng.random() < 0.5}
+                    start = time.perf_counter()
+                    pick_seats(free, total_seats, count, **preferences)
+                    samples.append(time.perf_counter() - start)
+                self.report(f'pick_seats {total_seats} seats {int(occupancy * 100)}% full', samples)
+
+    def bench_autocomplete(self, iterations, rng):
+        # A synthetic country: 300 cities of 40 areas each, half the names in Arabic
+        letters, arabic = 'abcdefghiklmnoprstuz', 'ابتجدرزسشصطعفقكلمنهوي'
+        def name(alphabet):
+            return ' '.join(''.join(rng.choice(alphabet) for _ in range(rng.randint(3, 9))) for _ in range(rng.randint(1, 3)))
+        cities = {pk: name(letters if pk % 2 else arabic) for pk in range(1, 301)}
+        areas = {pk: (name(letters if pk % 2 else arabic), rng.randint(1, 300)) for pk in range(1, 12001)}
+        start = time.perf_counter()
+        index = LocationIndex(cities, areas)
+        self.stdout.write(f'build {len(index.keys)} keys in {(time.perf_counter() - start) * 1000:.1f} ms')
+        names = list(cities.values()) + [area for area, _ in areas.values()]
+        for length in (1, 3, 5):
+            samples = []
+            for _ in range(iterations):
+                query = rng.choice(names)[:length]
+                start = time.perf_counter()
+                index.search(query)
+                samples.append(time.perf_counter() - start)
+            self.report(f'autocomplete {length}-letter prefix', samples)
+
+    def bench_encoders(self, iterations, rng):
+        # One 50-row page of search results and of the profile booking list, built in memory
+        # (no database): DRF serializers + JSONRenderer against the values() row encoders.
+        now = timezone.now()
+        trips, trip_rows, bookings, booking_rows = [], [], [], []
+        for pk in range(1, 51):
+            start = Area(id=pk, name=f'Area {pk}', city=City(id=pk, name='Cairo'))
+            destination = Area(id=pk + 100, name=f'منطقة {pk}', city=City(id=pk + 100, name='الإسكندرية'))
+            departure = now + timezone.timedelta(hours=rng.randint(1, 500))
+            occupancy = rng.getrandbits(49).to_bytes(7, 'little')
+            trip = Trip(id=pk, start_location=start, destination=destination, bus_type='STANDARD',
+                        departure_date=departure, arrival_date=departure + timezone.timedelta(hours=3),
+                        total_seats=49, available_seats=20, price=Decimal('150.00'),
+                        created_at=now, updated_at=now, occupancy=occupancy)
+            trips.append(trip)
+            trip_rows.append((pk, 'Cairo', start.name, 'الإسكندرية', destination.name, 'STANDARD', departure,
+                              trip.arrival_date, 49, 20, trip.price, now, now, occupancy))
+            booking = Booking(id=pk, trip=trip, seats_booked=2, selected_seats=[1, 2], payment_status='PAID',
+                              status='CONFIRMED', booking_date=now, total_price=Decimal('300.00'), payment_type='ONLINE')
+            bookings.append(booking)
+            booking_rows.append((pk, now, pk, start.name, destination.name, 'STANDARD', departure, trip.price, 2, [1, 2],
+                                 'PAID', 'CONFIRMED', booking.total_price, 'ONLINE'))
+        renderer = JSONRenderer()
+        cases = [
+            ('search page', lambda: renderer.render(TripSerializer(trips, many=True).data),
+             lambda: encoders.render_trip_rows(trip_rows)),
+            ('profile page', lambda: renderer.render(LightweightBookingSerializer(bookings, many=True).data),
+             lambda: encoders.render(encoders.booking_list_rows(booking_rows))),
+        ]
+        iterations = max(iterations // 100, 10)
+        for name, serializer, encoder in cases:
+            assert serializer() == encoder()
+            for label, func in (('serializer', serializer), ('encoder', encoder)):
+                samples = []
+                for _ in range(iterations):
+                    start = time.perf_counter()
+                    func()
+                    samples.append(time.perf_counter() - start)
+                self.report(f'{name} (50 rows) {label}', samples)
+
+    def bench_contention(self, iterations, rng):
+        # A flash sale: iterations // 20 clients rush one 49-seat trip at once, each booking one
+        # auto-assigned seat through Booking.save (SELECT ... FOR UPDATE on the trip row), with admission
+        # control off and on. It writes to the configured database and deletes its rows afterwards; run it
+        # against the deployment's database engine (SQLite serializes all writers, so it shows little).
+        # The clients are threads of this process, so admission runs on the local cache here.
+        clients = max(iterations // 20, 50)
+        tag = uuid.uuid4().hex[:8]
+        start = Area.objects.create(city=City.objects.create(name=f'Benchmark {tag} A'), name='Station')
+        destination = Area.objects.create(city=City.objects.create(name=f'Benchmark {tag} B'), name='Station')
+        user = User.objects.create_user(username=f'benchmark-{tag}', email=f'benchmark-{tag}@example.com',
+                                        phone_number=f'01{rng.randint(0, 10 ** 9 - 1):09d}', name='Benchmark')
+        departure = timezone.now() + timezone.timedelta(days=30)
+        try:
+            for limit in (0, settings.ADMISSION_CONCURRENCY or 8):
+                trip = Trip.objects.create(start_location=start, destination=destination, bus_type='STANDARD',
+                                           departure_date=departure, arrival_date=departure + timezone.timedelta(hours=3),
+                                           total_seats=49, price=Decimal('150.00'))
+                self.contend(trip, user, clients, limit)
+        finally:
+            Trip.objects.filter(start_location=start).delete()
+            User.objects.filter(id=user.id).delete()
+            City.objects.filter(id__in=[start.city_id, destination.city_id]).delete()
+
+    def contend(self, trip, user, clients, limit):
+        state_lock = threading.Lock()
+        state = {'booked': 0, 'sold_out': 0, 'errors': 0, 'saving': 0, 'max_saving': 0, 'queued': 0}
+        saves, attempts, totals = [], [], []
+        go = threading.Event()
+
+        def client():
+            go.wait()
+            first, ticket = time.perf_counter(), None
+            try:
+                while True:
+                    start = time.perf_counter()
+                    entry = admission.admit(trip.id, ticket)
+                    if not entry.admitted:
+                        attempts.append(time.perf_counter() - start)
+                        with state_lock:
+                            state['queued'] += 1
+                        ticket = entry.ticket
+                        time.sleep(min(max(entry.estimated_wait, 0.005), 0.25))
+                        continue
+                    try:
+                        booking = Booking(user=user, trip=trip, seats_booked=1, customer_name='Benchmark')
+                        booking.seat_preferences = {'together': True, 'window': False, 'front': False}
+                        with state_lock:
+                            state['saving'] += 1
+                            state['max_saving'] = max(state['max_saving'], state['saving'])
+                        saving = time.perf_counter()
+                        try:
+                            booking.save()
+                            outcome = 'booked'
+                        except ValidationError:
+                            outcome = 'sold_out'
+                        except DatabaseError:
+                            outcome = 'errors'
+                        saves.append(time.perf_counter() - saving)
+                        with state_lock:
+                            state['saving'] -= 1
+                            state[outcome] += 1
+                    finally:
+                        admission.release(entry)
+                    attempts.append(time.perf_counter() - start)
+                    totals.append(time.perf_counter() - first)
+                    return
+            finally:
+                connection.close()
+
+        with override_settings(ADMISSION_CONCURRENCY=limit), patch.object(admission, 'shared_cache', return_value=True):
+            admission.reset(trip.id)
+            threads = [threading.Thread(target=client) for _ in range(clients)]
+            for thread in threads:
+                thread.start()
+            started = time.perf_counter()
+            go.set()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            admission.reset(trip.id)
+        trip.refresh_from_db()
+        label = f'admission {limit} per trip' if limit else 'no admission control'
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{label}: {clients} clients in {elapsed:.2f} s, {state["booked"]} booked, {state["sold_out"]} sold out, '
+            f'{state["errors"]} database errors, {state["queued"]} queued responses, '
+            f'at most {state["max_saving"]} contending for the trip row'))
+        if trip.available_seats != trip.total_seats - state['booked']:
+            self.stdout.write(self.style.ERROR(f'  trip {trip.id} has {trip.available_seats} seats left after {state["booked"]} bookings'))
+        self.report('  booking save (row lock + write)', saves)
+        self.report('  booking request (incl. 429s)', attempts)
+        self.report('  client until served', totals)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from booking.inventory import check_inventory, repair_inventory
+
+
+class Command(BaseCommand):
+    help = 'Checks every trip\'s available seats and seat bitmap against its live bookings, optionally repairing drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Rewrite drifted trips from their bookings')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Rows fetched per round trip while scanning')
+        parser.add_argument('--batch-size', type=int, default=None, help='Trips locked per repair transaction')
+        parser.add_argument('--verbose-drift', action='store_true', help='Print every drifted trip')
+
+    def handle(self, *args, **options):
+        drift = check_inventory(options['chunk_size'])
+        conflicts = [trip for trip in drift if trip['conflicts'] or trip['invalid']]
+        self.stdout.write(f'{len(drift)} trip(s) drifted, {len(conflicts)} with double-booked or invalid seats.')
+        for trip in drift if options['verbose_drift'] else conflicts:
+            self.stdout.write(
+                f"  trip {trip['trip_id']}: available {trip['available_seats']} (expected {trip['expected_available_seats']}), "
+                f"missing {trip['missing']}, stray {trip['stray']}, conflicts {trip['conflicts']}, invalid {trip['invalid']}")
+        if options['repair'] and drift:
+            repaired = repair_inventory([trip['trip_id'] for trip in drift], options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Repaired {repaired} trip(s).'))
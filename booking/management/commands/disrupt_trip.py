@@ -0,0 +1,30 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from booking.disruption import cancel_trip, move_trip
+from booking.models import Trip
+
+
+class Command(BaseCommand):
+    help = 'Cancels every booking of a trip, or moves them all to a replacement trip, and notifies the passengers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('trip_id', type=int)
+        parser.add_argument('--move-to', type=int, default=None, help='Replacement trip id (cancels when omitted)')
+        parser.add_argument('--seat', action='append', default=[], metavar='OLD:NEW',
+                            help='Seat mapping onto the replacement trip, repeatable')
+        parser.add_argument('--keep-open', action='store_true', help='Keep selling the original trip after a move')
+        parser.add_argument('--reason', default='')
+        parser.add_argument('--no-notify', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            seat_map = dict(pair.split(':', 1) for pair in options['seat'])
+            if options['move_to']:
+                plan = move_trip(options['trip_id'], options['move_to'], seat_map=seat_map, reason=options['reason'],
+                                 notify=not options['no_notify'], close=not options['keep_open'])
+                self.stdout.write(self.style.SUCCESS(f"Moved {len(plan)} bookings to trip {options['move_to']}."))
+            else:
+                bookings = cancel_trip(options['trip_id'], reason=options['reason'], notify=not options['no_notify'])
+                self.stdout.write(self.style.SUCCESS(f'Cancelled {len(bookings)} bookings.'))
+        except (Trip.DoesNotExist, ValidationError, ValueError) as e:
+            raise CommandError(e.messages[0] if isinstance(e, ValidationError) else str(e))
@@ -0,0 +1,46 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from booking.exports import (EXPORT_CHUNK_SIZE, EXPORT_FORMATS, MANIFEST_COLUMNS, BOOKING_COLUMNS,
+                             manifest_rows, booking_history_rows)
+
+
+class Command(BaseCommand):
+    help = 'Streams bookings (or a trip passenger manifest) as CSV or JSON lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--manifest', type=int, metavar='TRIP_ID', help='Export the passenger manifest of one trip')
+        parser.add_argument('--output', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--file', help='Write to this path instead of stdout')
+        parser.add_argument('--status')
+        parser.add_argument('--trip', type=int)
+        parser.add_argument('--since', help='Booking date, YYYY-MM-DD')
+        parser.add_argument('--until', help='Booking date, YYYY-MM-DD')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if options['manifest']:
+            rows, columns = manifest_rows(options['manifest'], chunk_size), MANIFEST_COLUMNS
+        else:
+            filters = {}
+            if options['status']:
+                filters['status'] = options['status'].upper()
+            if options['trip']:
+                filters['trip_id'] = options['trip']
+            try:
+                if options['since']:
+                    filters['booking_date__date__gte'] = datetime.strptime(options['since'], '%Y-%m-%d').date()
+                if options['until']:
+                    filters['booking_date__date__lte'] = datetime.strptime(options['until'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Dates must be YYYY-MM-DD')
+            rows, columns = booking_history_rows(chunk_size, **filters), BOOKING_COLUMNS
+
+        render, _ = EXPORT_FORMATS[options['output']]
+        if not options['file']:
+            for chunk in render(rows, columns):
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['file'], 'w', encoding='utf-8', newline='') as out:
+            for chunk in render(rows, columns):
+                out.write(chunk)
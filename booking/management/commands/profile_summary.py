@@ -0,0 +1,49 @@
+from collections import Counter
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from booking.profiling import FILE_SUFFIX, read_profiles
+
+
+class Command(BaseCommand):
+    help = 'Summarizes the hottest frames in the sampling profiler output, per URL name'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='Profile directory (defaults to PROFILING_DIR)')
+        parser.add_argument('--url-name', default=None, help='Only this URL name')
+        parser.add_argument('--top', type=int, default=15, help='Frames to list per URL name')
+        parser.add_argument('--merge', default=None, metavar='FILE',
+                            help='Also write the merged collapsed stacks of --url-name to FILE, for flamegraph tools')
+        parser.add_argument('--clear', action='store_true', help='Delete the profile files after summarizing')
+
+    def handle(self, *args, **options):
+        directory = Path(options['dir'] or settings.PROFILING_DIR)
+        profiles = read_profiles(directory, options['url_name'])
+        if not profiles:
+            self.stdout.write(f'No profiles in {directory}.')
+            return
+
+        for url_name, stacks in sorted(profiles.items(), key=lambda item: -sum(item[1].values())):
+            samples = sum(stacks.values())
+            own, inclusive = Counter(), Counter()
+            for stack, count in stacks.items():
+                frames = stack.split(';')
+                own[frames[-1]] += count
+                for frame in set(frames):  # Recursion counts a frame once per sample
+                    inclusive[frame] += count
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{url_name}: {samples} samples'))
+            self.stdout.write('    self%   total%  frame')
+            for frame, count in own.most_common(options['top']):
+                self.stdout.write(f'  {100 * count / samples:6.1f}  {100 * inclusive[frame] / samples:7.1f}  {frame}')
+
+        if options['merge']:
+            if not options['url_name']:
+                self.stderr.write('--merge needs --url-name.')
+            else:
+                stacks = profiles[options['url_name']]
+                Path(options['merge']).write_text(''.join(f'{stack} {count}\n' for stack, count in stacks.most_common()))
+                self.stdout.write(self.style.SUCCESS(f"Wrote {len(stacks)} stacks to {options['merge']}."))
+
+        if options['clear']:
+            for path in directory.glob(f'*{FILE_SUFFIX}'):
+                path.unlink()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from booking.tokens import prune_expired_tokens
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired outstanding (and blacklisted) JWT refresh tokens in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        deleted = prune_expired_tokens(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Pruned {deleted} expired tokens.'))
+
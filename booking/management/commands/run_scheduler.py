@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from booking.scheduler import Scheduler
+
+
+class Command(BaseCommand):
+    help = 'Runs the maintenance scheduler (booking expiry, waitlist matching, token pruning) in the foreground'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run every job once, if this process can lead, and exit')
+        parser.add_argument('--tick', type=float, default=None, help='Seconds between scheduler ticks')
+        parser.add_argument('--job', action='append', dest='jobs', help='Only run this job (repeatable)')
+
+    def handle(self, *args, **options):
+        scheduler = Scheduler(tick=options['tick'], jobs=options['jobs'])
+        if not options['once']:
+            self.stdout.write(f"Scheduler {scheduler.owner} running {', '.join(scheduler.jobs)}")
+            try:
+                scheduler.run_forever()
+            except KeyboardInterrupt:
+                pass
+            return
+        results = scheduler.step(force=True)
+        if not scheduler.is_leader:
+            self.stdout.write(self.style.WARNING('Another scheduler holds leadership; nothing was run.'))
+            return
+        scheduler.lock.release()
+        for name, rows in results.items():
+            self.stdout.write(f'{name}: {rows}')
+        self.stdout.write(self.style.SUCCESS(f'Ran {len(results)} of {len(scheduler.jobs)} jobs.'))
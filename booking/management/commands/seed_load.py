@@ -0,0 +1,263 @@
+import contextlib
+import csv
+import io
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.db.models import Max
+from django.utils import timezone
+from booking.autocomplete import invalidate as invalidate_autocomplete
+from booking.search_cache import invalidate_all as invalidate_search_cache
+from booking.models import User, City, Area, SeatLayout, Trip, Booking
+
+CITY_NAMES = [
+    'Cairo', 'Alexandria', 'Giza', 'Port Said', 'Suez', 'Luxor', 'Aswan', 'Mansoura', 'Tanta', 'Asyut',
+    'Ismailia', 'Faiyum', 'Zagazig', 'Damietta', 'Minya', 'Sohag', 'Hurghada', 'Qena', 'Beni Suef', 'Marsa Matruh',
+]
+AREA_NAMES = [
+    'Downtown', 'Station', 'University', 'Corniche', 'Airport', 'New City', 'Old Market', 'Stadium',
+    'Industrial Zone', 'Bus Terminal', 'Harbour', 'Hospital', 'Gardens', 'East', 'West', 'North',
+]
+BUSES = [('STANDARD', 49, Decimal('1.0')), ('DELUXE', 45, Decimal('1.4')), ('VIP', 33, Decimal('2.0')), ('MINI', 14, Decimal('0.8'))]
+PAYMENT_TYPES = [('ONLINE', 0.7), ('CASH', 0.25), ('E Wallet', 0.05)]
+COPY_NULL = '\\N'
+
+
+@contextlib.contextmanager
+def explicit_timestamps(*model_classes):
+    """Let bulk inserts keep the generated created/booking dates instead of auto_now(_add) stamping now()."""
+    fields = [field for model in model_classes for field in model._meta.concrete_fields
+              if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Writer:
+    """Inserts model instances in chunks: bulk_create everywhere, COPY ... FROM STDIN on PostgreSQL."""
+
+    def __init__(self, chunk_size, use_copy):
+        self.chunk_size = chunk_size
+        self.use_copy = use_copy
+        self.counts = {}
+
+    def write(self, model, objects):
+        for start in range(0, len(objects), self.chunk_size):
+            chunk = objects[start:start + self.chunk_size]
+            if self.use_copy:
+                self._copy(model, chunk)
+            else:
+                model.objects.bulk_create(chunk, batch_size=self.chunk_size)
+            self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(chunk)
+
+    def _copy(self, model, objects):
+        fields = model._meta.concrete_fields
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for obj in objects:
+            writer.writerow([self._copy_value(field, getattr(obj, field.attname)) for field in fields])
+        buffer.seek(0)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        # NULL gets its own marker: by default COPY csv also reads the empty string of a NOT NULL
+        # CharField (first_name, last_name...) as NULL
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) "
+                               f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')", buffer)
+
+    @staticmethod
+    def _copy_value(field, value):
+        if value is None:
+            return COPY_NULL
+        if isinstance(field, models.JSONField):
+            return json.dumps(value)
+        if isinstance(value, (bytes, memoryview)):
+            return '\\x' + bytes(value).hex()
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        return value
+
+
+class Command(BaseCommand):
+    help = ('Generates a deterministic synthetic dataset (cities, areas, routes, timetabled trips, users and bookings) '
+            'with chunked bulk inserts, or COPY on PostgreSQL, for load tests and EXPLAIN checks')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--cities', type=int, default=20)
+        parser.add_argument('--areas-per-city', type=int, default=6)
+        parser.add_argument('--routes', type=int, default=200, help='Area-to-area routes between different cities')
+        parser.add_argument('--departures-per-day', type=int, default=6, help='Timetabled departures per route per day')
+        parser.add_argument('--days', type=int, default=30, help='Days of upcoming departures')
+        parser.add_argument('--past-days', type=int, default=7, help='Days of already departed trips')
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--occupancy', type=float, default=0.6, help='Mean share of seats sold per trip')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--copy', choices=['auto', 'yes', 'no'], default='auto', help='Use COPY (PostgreSQL only)')
+
+    def handle(self, *args, **options):
+        use_copy = options['copy'] == 'yes' or (options['copy'] == 'auto' and connection.vendor == 'postgresql')
+        if use_copy and connection.vendor != 'postgresql':
+            raise CommandError('COPY is only available on PostgreSQL')
+        if not 0 <= options['occupancy'] <= 1:
+            raise CommandError('--occupancy must be between 0 and 1')
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.writer = Writer(options['chunk_size'], use_copy)
+        # Rows get explicit ids continuing from the current maximum, so nothing has to be read back
+        self.next_id = {model: (model.objects.aggregate(top=Max('id'))['top'] or 0) + 1
+                        for model in (User, City, Area, Trip, Booking)}
+
+        started = time.perf_counter()
+        with explicit_timestamps(City, Area, Trip, Booking):
+            with transaction.atomic():
+                users = self.seed_users()
+                areas = self.seed_locations()
+            routes = self.build_routes(areas)
+            self.seed_trips(routes, users)
+            self.reset_sequences()
+        invalidate_autocomplete()
+        invalidate_search_cache()
+
+        elapsed = time.perf_counter() - started
+        summary = ', '.join(f'{count} {name}' for name, count in self.writer.counts.items())
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {summary} in {elapsed:.1f}s ({'COPY' if use_copy else 'bulk_create'}, seed {options['seed']})"))
+
+    def take_ids(self, model, count):
+        first = self.next_id[model]
+        self.next_id[model] += count
+        return range(first, first + count)
+
+    def seed_users(self):
+        password = make_password('load-test-password')  # Hashed once: hashing per user would dominate
+        users = []
+        for pk in self.take_ids(User, self.options['users']):
+            email = f'load{pk}@example.com'
+            users.append(User(id=pk, username=email, email=email, name=f'Passenger {pk}', phone_number=f'09{pk:09d}',
+                              password=password, date_joined=timezone.now()))
+        self.writer.write(User, users)
+        return [(user.id, user.name, user.phone_number) for user in users]
+
+    def seed_locations(self):
+        now = timezone.now()
+        cities, areas = [], []
+        for pk in self.take_ids(City, self.options['cities']):
+            base = CITY_NAMES[(pk - 1) % len(CITY_NAMES)]
+            cities.append(City(id=pk, name=base if pk <= len(CITY_NAMES) else f'{base} {pk}', created_at=now, updated_at=now))
+        for city in cities:
+            names = self.rng.sample(AREA_NAMES, min(self.options['areas_per_city'], len(AREA_NAMES)))
+            areas.extend(Area(id=pk, city_id=city.id, name=name, created_at=now, updated_at=now)
+                         for pk, name in zip(self.take_ids(Area, len(names)), names))
+        self.writer.write(City, cities)
+        self.writer.write(Area, areas)
+        return [(area.id, area.city_id) for area in areas]
+
+    def build_routes(self, areas):
+        if len({city_id for _, city_id in areas}) < 2:
+            raise CommandError('At least two cities with areas are needed to build routes')
+        layouts = {(bus_type, seats): SeatLayout.for_bus(bus_type, seats) for bus_type, seats, _ in BUSES}
+        routes = []
+        while len(routes) < self.options['routes']:
+            (start, start_city), (destination, destination_city) = self.rng.sample(areas, 2)
+            if start_city == destination_city:
+                continue
+            bus_type, seats, fare = self.rng.choices(BUSES, weights=[60, 25, 10, 5])[0]
+            hours = self.rng.randint(1, 10)
+            slots = sorted(self.rng.sample(range(5 * 60, 24 * 60, 30), self.options['departures_per_day']))
+            routes.append({
+                'start': start, 'destination': destination, 'bus_type': bus_type, 'seats': seats,
+                'layout': layouts[(bus_type, seats)].id, 'duration': timedelta(hours=hours, minutes=self.rng.choice([0, 30])),
+                'price': (Decimal(40 + 25 * hours) * fare).quantize(Decimal('1.00')), 'slots': slots,
+            })
+        return routes
+
+    def seed_trips(self, routes, users):
+        today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        now = timezone.now()
+        trips, bookings = [], []
+        for day in range(-self.options['past_days'], self.options['days']):
+            for route in routes:
+                for minute in route['slots']:
+                    departure = today + timedelta(days=day, minutes=minute)
+                    trip = Trip(
+                        id=self.take_ids(Trip, 1)[0], bus_type=route['bus_type'],
+                        start_location_id=route['start'], destination_id=route['destination'],
+                        departure_date=departure, arrival_date=departure + route['duration'],
+                        total_seats=route['seats'], layout_id=route['layout'], price=route['price'],
+                        created_at=departure - timedelta(days=60), updated_at=now,
+                    )
+                    bookings.extend(self.book_trip(trip, users, now))
+                    trips.append(trip)
+                    if len(trips) >= self.options['chunk_size']:
+                        self.flush(trips, bookings)
+                        trips, bookings = [], []
+        self.flush(trips, bookings)
+
+    def book_trip(self, trip, users, now):
+        """Sell a random share of the trip's seats in groups of 1-4, with a realistic status and payment mix."""
+        rng = self.rng
+        departed = trip.departure_date <= now
+        free = list(range(1, trip.total_seats + 1))
+        rng.shuffle(free)
+        target = int(trip.total_seats * min(rng.betavariate(2, 2) * 2 * self.options['occupancy'], 1))
+        booked, bookings = 0, []
+        while free and trip.total_seats - len(free) < target:
+            group = min(rng.choice([1, 1, 1, 2, 2, 3, 4]), len(free))
+            seats = sorted(free[:group])
+            user_id, name, phone = rng.choice(users)
+            booking_date = min(trip.departure_date - timedelta(minutes=rng.randint(30, 30 * 24 * 60)), now)
+            roll = rng.random()
+            if roll < 0.2:
+                status = 'CANCELLED'
+            elif roll < 0.23 and not departed:
+                status = 'PENDING'
+                booking_date = now - timedelta(minutes=rng.randint(0, 4))
+            else:
+                status = 'CONFIRMED'
+            payment_type = rng.choices([kind for kind, _ in PAYMENT_TYPES], weights=[weight for _, weight in PAYMENT_TYPES])[0]
+            pk = self.take_ids(Booking, 1)[0]
+            bookings.append(Booking(
+                id=pk, user_id=user_id, trip_id=trip.id, customer_name=name, customer_phone=phone,
+                seats_booked=group, selected_seats=seats, status=status,
+                payment_status={'CONFIRMED': 'PAID', 'PENDING': 'PENDING', 'CANCELLED': rng.choice(['FAILED', 'PENDING'])}[status],
+                payment_type=payment_type,
+                payment_order_id=f'load-{pk}' if payment_type != 'CASH' and status != 'PENDING' else None,
+                payment_reference=f'load-txn-{pk}' if status == 'CONFIRMED' and payment_type != 'CASH' else None,
+                booking_date=booking_date, expires_at=booking_date + timedelta(minutes=5),
+                total_price=trip.price * group,
+            ))
+            if status == 'CANCELLED':  # Cancelled bookings gave their seats back
+                rng.shuffle(free)
+            else:
+                del free[:group]
+                booked += group
+        trip.available_seats = trip.total_seats - booked
+        trip.booked_bitmap = sum(1 << (seat - 1) for seat in set(range(1, trip.total_seats + 1)) - set(free))
+        return bookings
+
+    def flush(self, trips, bookings):
+        with transaction.atomic():
+            self.writer.write(Trip, trips)
+            self.writer.write(Booking, bookings)
+        self.stdout.write(f"  {self.writer.counts.get('Trip', 0)} trips, {self.writer.counts.get('Booking', 0)} bookings")
+
+    def reset_sequences(self):
+        # Explicit ids leave PostgreSQL sequences behind (MySQL and SQLite move on by themselves)
+        statements = connection.ops.sequence_reset_sql(no_style(), [User, City, Area, Trip, Booking])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
@@ -0,0 +1,39 @@
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from booking.slow_queries import read_captures
+
+
+class Command(BaseCommand):
+    help = 'Ranks captured slow query fingerprints by total time, with their call sites and EXPLAIN plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='Capture directory (defaults to SLOW_QUERY_DIR)')
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument('--order', choices=['total', 'max', 'count'], default='total')
+        parser.add_argument('--plans', action='store_true', help='Print the EXPLAIN plan of each fingerprint')
+        parser.add_argument('--clear', action='store_true', help='Delete the capture files afterwards')
+
+    def handle(self, *args, **options):
+        directory = Path(options['dir'] or settings.SLOW_QUERY_DIR)
+        entries = read_captures(directory)
+        if not entries:
+            self.stdout.write(f'No slow queries captured in {directory}.')
+        key = {'total': 'total_ms', 'max': 'max_ms', 'count': 'count'}[options['order']]
+        for entry in sorted(entries, key=lambda entry: -entry[key])[:options['top']]:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{entry['fingerprint']}  total {entry['total_ms']:.0f} ms  max {entry['max_ms']:.1f} ms  "
+                f"calls {entry['count']}  avg {entry['total_ms'] / entry['count']:.1f} ms"))
+            self.stdout.write(f"  {entry['sql'][:500]}")
+            for view, count in entry['views'].most_common(3):
+                self.stdout.write(f'  view: {view} ({count})')
+            for site, count in entry['sites'].most_common(3):
+                self.stdout.write(f'  site: {site} ({count})')
+            if options['plans'] and entry['plan']:
+                self.stdout.write('  plan:')
+                for line in entry['plan']:
+                    self.stdout.write(f'    {line}')
+
+        if options['clear']:
+            for path in directory.glob('*.json'):
+                path.unlink()
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.test import RequestFactory
+from django.utils import timezone
+from booking import search_cache
+from booking.models import Trip
+from booking.views.trip import TripSearchView
+
+
+class Command(BaseCommand):
+    help = 'Pre-populates the trip search cache for the busiest upcoming route/day combinations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=100, help='Number of route/day combinations to warm')
+        parser.add_argument('--days', type=int, default=None, help='How many days ahead to consider (defaults to SEARCH_WARM_DAYS)')
+
+    def handle(self, *args, **options):
+        # A per-process cache would be filled here and dropped when this command exits
+        if not search_cache.enabled():
+            raise CommandError('The search cache is off: it needs SEARCH_CACHE_TIMEOUT > 0 and a cache shared '
+                               'by every process (Redis/Memcached), not LocMemCache')
+        today = timezone.localdate()
+        until = today + timezone.timedelta(days=options['days'] or settings.SEARCH_WARM_DAYS)
+        # Busiest by bookings so far; ties go to the routes with more departures
+        routes = (Trip.objects.annotate(day=TruncDate('departure_date'))
+                  .filter(day__gte=today, day__lt=until)
+                  .values('start_location__city_id', 'destination__city_id', 'day')
+                  .annotate(bookings=Count('bookings'), trips=Count('id', distinct=True))
+                  .order_by('-bookings', '-trips')[:options['top']])
+
+        # Each search goes through the view itself, so the cached key and bytes are exactly what users get
+        factory, view = RequestFactory(), TripSearchView.as_view()
+        warmed = 0
+        for route in routes:
+            request = factory.get('/api/trips/search/', {
+                'start_city': route['start_location__city_id'],
+                'destination_city': route['destination__city_id'],
+                'departure_date': route['day'].isoformat(),
+            }, HTTP_ACCEPT='application/json')
+            response = view(request)
+            if response.status_code == 200:
+                warmed += 1
+        self.stdout.write(self.style.SUCCESS(f'Warmed {warmed} route/day searches.'))
@@ -0,0 +1,62 @@
+import time
+from django.core.cache import cache
+
+# Lightweight counters kept in the shared cache so every worker reports into the same numbers.
+METRICS_KEY_PREFIX = 'metrics_'
+METRICS_INDEX_KEY = 'metrics_index'
+
+
+def _register(name):
+    names = cache.get(METRICS_INDEX_KEY, [])
+    if name not in names:
+        names.append(name)
+        cache.set(METRICS_INDEX_KEY, names, timeout=None)
+
+
+def incr(name, amount=1):
+    key = f'{METRICS_KEY_PREFIX}{name}'
+    if not cache.add(key, amount, timeout=None):
+        try:
+            cache.incr(key, amount)
+        except ValueError:  # Key evicted between add() and incr()
+            cache.set(key, amount, timeout=None)
+    _register(name)
+
+
+def set_value(name, value):
+    cache.set(f'{METRICS_KEY_PREFIX}{name}', value, timeout=None)
+    _register(name)
+
+
+def get_value(name, default=None):
+    return cache.get(f'{METRICS_KEY_PREFIX}{name}', default)
+
+
+def observe(name, seconds):
+    """Record a duration: count, total and max are kept under `<name>_count`, `<name>_total_ms`, `<name>_max_ms`."""
+    ms = int(seconds * 1000)
+    incr(f'{name}_count')
+    incr(f'{name}_total_ms', ms)
+    if ms > get_value(f'{name}_max_ms', 0):
+        set_value(f'{name}_max_ms', ms)
+
+
+class timed:
+    """Context manager that observes the wall time of its block."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.monotonic() - self.start)
+        return False
+
+
+def snapshot():
+    names = sorted(cache.get(METRICS_INDEX_KEY, []))
+    values = cache.get_many([f'{METRICS_KEY_PREFIX}{name}' for name in names])
+    return {name: values.get(f'{METRICS_KEY_PREFIX}{name}') for name in names}
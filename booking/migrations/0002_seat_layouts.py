@@ -0,0 +1,96 @@
+# Generated by Django 5.0.2 on 2026-10-19 11:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def seats_to_layouts(apps, schema_editor):
+    """Point every trip at a shared layout and fold its seats dict into the occupancy bitmap."""
+    SeatLayout = apps.get_model('booking', 'SeatLayout')
+    Trip = apps.get_model('booking', 'Trip')
+    layouts = {}
+    batch = []
+    for trip in Trip.objects.only('id', 'bus_type', 'total_seats', 'seats').iterator(chunk_size=2000):
+        key = (trip.bus_type, trip.total_seats)
+        if key not in layouts:
+            seat_count, per_row = trip.total_seats, 4
+            layouts[key], _ = SeatLayout.objects.get_or_create(bus_type=key[0], seat_count=seat_count, defaults={
+                'seats_per_row': per_row,
+                'rows': -(-seat_count // per_row),
+                'labels': [str(n) for n in range(1, seat_count + 1)],
+                'attributes': {
+                    'window': [n for n in range(1, seat_count + 1) if (n - 1) % per_row in (0, per_row - 1)],
+                    'aisle': [n for n in range(1, seat_count + 1) if (n - 1) % per_row in (per_row // 2 - 1, per_row // 2)],
+                },
+            })
+        booked = 0
+        for seat, status in (trip.seats or {}).items():
+            if status != 'available' and str(seat).isdigit() and 0 < int(seat) <= trip.total_seats:
+                booked |= 1 << (int(seat) - 1)
+        trip.layout = layouts[key]
+        trip.occupancy = booked.to_bytes((trip.total_seats + 7) // 8, 'little')
+        batch.append(trip)
+        if len(batch) >= 2000:
+            Trip.objects.bulk_update(batch, ['layout', 'occupancy'])
+            batch = []
+    if batch:
+        Trip.objects.bulk_update(batch, ['layout', 'occupancy'])
+
+
+def layouts_to_seats(apps, schema_editor):
+    Trip = apps.get_model('booking', 'Trip')
+    batch = []
+    for trip in Trip.objects.only('id', 'total_seats', 'occupancy').iterator(chunk_size=2000):
+        booked = int.from_bytes(bytes(trip.occupancy or b''), 'little')
+        trip.seats = {str(n): 'booked' if booked >> (n - 1) & 1 else 'available' for n in range(1, trip.total_seats + 1)}
+        batch.append(trip)
+        if len(batch) >= 2000:
+            Trip.objects.bulk_update(batch, ['seats'])
+            batch = []
+    if batch:
+        Trip.objects.bulk_update(batch, ['seats'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatLayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bus_type', models.CharField(choices=[('STANDARD', 'Standard'), ('DELUXE', 'Deluxe'), ('VIP', 'Vip'), ('MINI', 'Mini')], max_length=20)),
+                ('seat_count', models.PositiveIntegerField()),
+                ('seats_per_row', models.PositiveIntegerField(default=4)),
+                ('rows', models.PositiveIntegerField(blank=True)),
+                ('labels', models.JSONField(blank=True, default=list)),
+                ('attributes', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'unique_together': {('bus_type', 'seat_count')},
+            },
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='layout',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='trips', to='booking.seatlayout'),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='occupancy',
+            field=models.BinaryField(blank=True, default=bytes),
+        ),
+        migrations.RunPython(seats_to_layouts, layouts_to_seats),
+        migrations.RemoveField(
+            model_name='trip',
+            name='seats',
+        ),
+        migrations.AlterField(
+            model_name='trip',
+            name='layout',
+            field=models.ForeignKey(blank=True, on_delete=django.db.models.deletion.PROTECT, related_name='trips', to='booking.seatlayout'),
+        ),
+    ]
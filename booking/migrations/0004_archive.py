@@ -0,0 +1,62 @@
+# Generated by Django 5.0.2 on 2026-10-19 12:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0003_waitlist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTrip',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('bus_type', models.CharField(choices=[('STANDARD', 'Standard'), ('DELUXE', 'Deluxe'), ('VIP', 'Vip'), ('MINI', 'Mini')], max_length=20)),
+                ('start_city', models.CharField(max_length=100)),
+                ('start_area', models.CharField(max_length=100)),
+                ('destination_city', models.CharField(max_length=100)),
+                ('destination_area', models.CharField(max_length=100)),
+                ('departure_date', models.DateTimeField()),
+                ('arrival_date', models.DateTimeField()),
+                ('total_seats', models.PositiveIntegerField()),
+                ('available_seats', models.PositiveIntegerField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['departure_date'], name='booking_arc_departu_8783e6_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedBooking',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('customer_name', models.CharField(max_length=50)),
+                ('customer_phone', models.CharField(max_length=11)),
+                ('seats_booked', models.PositiveIntegerField()),
+                ('selected_seats', models.JSONField(default=list)),
+                ('seat_labels', models.JSONField(default=list)),
+                ('payment_status', models.CharField(choices=[('PENDING', 'Pending'), ('PAID', 'Paid'), ('FAILED', 'Failed')], max_length=10)),
+                ('payment_order_id', models.CharField(blank=True, db_index=True, max_length=100, null=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('CONFIRMED', 'Confirmed'), ('CANCELLED', 'Cancelled')], max_length=10)),
+                ('payment_reference', models.CharField(blank=True, max_length=100, null=True)),
+                ('payment_type', models.CharField(choices=[('CASH', 'Cash'), ('ONLINE', 'Online'), ('E Wallet', 'e wallet')], max_length=10)),
+                ('booking_date', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to=settings.AUTH_USER_MODEL)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bookings', to='booking.archivedtrip')),
+            ],
+            options={
+                'ordering': ['-booking_date'],
+                'indexes': [models.Index(fields=['user', 'booking_date'], name='booking_arc_user_id_c9cb4e_idx')],
+            },
+        ),
+    ]
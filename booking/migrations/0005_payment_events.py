@@ -0,0 +1,31 @@
+# Generated by Django 5.0.2 on 2026-10-19 12:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0004_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('PROCESSED', 'Processed callback'), ('RESPONSE', 'Response callback')], max_length=10)),
+                ('order_id', models.CharField(db_index=True, max_length=100)),
+                ('transaction_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('success', models.BooleanField()),
+                ('payload', models.JSONField(default=dict)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('outcome', models.CharField(blank=True, choices=[('APPLIED', 'Applied'), ('IGNORED', 'Ignored'), ('UNKNOWN', 'Unknown order')], max_length=10, null=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['processed_at', 'id'], name='booking_pay_process_10862e_idx')],
+            },
+        ),
+    ]
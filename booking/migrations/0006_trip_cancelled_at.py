@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-19 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0005_payment_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='cancelled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -3,6 +3,9 @@ from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, RegexValidator
 from django.core.exceptions import ValidationError
 from django.utils import timezone 
+from . import seat_events
+from .signals import seats_released
+from .seating import SEATS_PER_ROW, pick_seats
 
 
 PHONE_REGEX = RegexValidator(regex=r'^\d{11}$', message="Phone number must be exactly 11 digits.")
@@ -61,9 +64,49 @@ class Area(models.Model):
         return f'{self.city.name}, {self.name}'
 
 
+BUS_TYPE_CHOICES = [('STANDARD','Standard'),('DELUXE','Deluxe'),('VIP','Vip'),('MINI','Mini'),]
+
+
+# Model for a seat layout, shared by every trip of the same bus type and size
+class SeatLayout(models.Model):
+    bus_type = models.CharField(max_length=20, choices=BUS_TYPE_CHOICES)
+    seat_count = models.PositiveIntegerField()
+    seats_per_row = models.PositiveIntegerField(default=SEATS_PER_ROW)
+    rows = models.PositiveIntegerField(blank=True)
+    labels = models.JSONField(default=list, blank=True)  # labels[n - 1] is printed for seat n
+    attributes = models.JSONField(default=dict, blank=True)  # {"window": [seat numbers], "aisle": [seat numbers]}
+
+    class Meta:
+        unique_together = ['bus_type', 'seat_count']
+
+    def save(self, *args, **kwargs):
+        self.rows = -(-self.seat_count // self.seats_per_row)
+        if not self.labels:
+            self.labels = [str(n) for n in range(1, self.seat_count + 1)]
+        if not self.attributes:
+            last, aisle = self.seats_per_row - 1, {self.seats_per_row // 2 - 1, self.seats_per_row // 2}
+            self.attributes = {
+                'window': [n for n in range(1, self.seat_count + 1) if (n - 1) % self.seats_per_row in (0, last)],
+                'aisle': [n for n in range(1, self.seat_count + 1) if (n - 1) % self.seats_per_row in aisle],
+            }
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def for_bus(cls, bus_type, seat_count):
+        layout, _ = cls.objects.get_or_create(bus_type=bus_type, seat_count=seat_count)
+        return layout
+
+    def label(self, seat_number):
+        seat_number = int(seat_number)
+        return self.labels[seat_number - 1] if 0 < seat_number <= len(self.labels) else str(seat_number)
+
+    def __str__(self):
+        return f"{self.bus_type} - {self.seat_count} seats"
+
+
 # Model for a trip, representing a journey between locations
 class Trip(models.Model):
-    Bus_TYBE_CHOICES = [('STANDARD','Standard'),('DELUXE','Deluxe'),('VIP','Vip'),('MINI','Mini'),]
+    Bus_TYBE_CHOICES = BUS_TYPE_CHOICES
     bus_type = models.CharField(max_length=20, choices=Bus_TYBE_CHOICES,default='Standard')
     start_location = models.ForeignKey(Area, on_delete=models.CASCADE, related_name='start_trips')
     destination = models.ForeignKey(Area, on_delete=models.CASCADE, related_name='destination_trips')
@@ -72,7 +115,9 @@ class Trip(models.Model):
 
     total_seats = models.PositiveIntegerField()
     available_seats = models.PositiveIntegerField(blank=True, null=True)
-    seats = models.JSONField(default=dict) 
+    layout = models.ForeignKey(SeatLayout, on_delete=models.PROTECT, related_name='trips', blank=True)
+    occupancy = models.BinaryField(default=bytes, blank=True)  # Bitmap of booked seats, bit n - 1 for seat n
+    cancelled_at = models.DateTimeField(null=True, blank=True)  # Set when the trip is called off (booking/disruption.py)
 
     price = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -85,16 +130,70 @@ class Trip(models.Model):
             self.available_seats = self.total_seats
         elif self.available_seats > self.total_seats:
             raise ValidationError("Available seats can't exceed total seats.")
-        
-        if not self.seats:
-            self.seats = {str(i): 'available' for i in range(1, self.total_seats + 1)}
+        if self.booked_bitmap >> self.total_seats:
+            raise ValidationError("Seats above the new total are booked; move or cancel those bookings first.")
+
+        # Only a loaded layout is checked, so saving a trip doesn't cost an extra query
+        if not self.layout_id or (Trip.layout.is_cached(self) and
+                                  (self.layout.bus_type, self.layout.seat_count) != (self.bus_type, self.total_seats)):
+            self.layout = SeatLayout.for_bus(self.bus_type, self.total_seats)
 
     def save(self, *args, **kwargs):
         self.full_clean()  # Automatically calls `clean()`
         super().save(*args, **kwargs)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        trip = super().from_db(db, field_names, values)
+        # Remembered so a save that moves the trip also invalidates its old search listing (booking/search_cache.py)
+        if {'start_location_id', 'destination_id', 'departure_date'} <= trip.__dict__.keys():
+            trip._loaded_route = (trip.start_location_id, trip.destination_id, trip.departure_date)
+        return trip
+
+    @property
+    def booked_bitmap(self):
+        return int.from_bytes(bytes(self.occupancy or b''), 'little')
+
+    @booked_bitmap.setter
+    def booked_bitmap(self, bitmap):
+        # Sized to fit the bitmap too: seats past a lowered total_seats are rejected by clean(), not here
+        self.occupancy = bitmap.to_bytes(max(self.total_seats + 7, bitmap.bit_length() + 7) // 8, 'little')
+
+    @property
+    def free_bitmap(self):
+        return ((1 << self.total_seats) - 1) & ~self.booked_bitmap
+
+    @property
+    def seats(self):
+        """Read-only {"1": "available" | "booked", ...} view of the occupancy bitmap."""
+        booked = self.booked_bitmap
+        return {str(n): 'booked' if booked >> (n - 1) & 1 else 'available' for n in range(1, self.total_seats + 1)}
+
+    @property
+    def unavailable_seats(self):
+        booked = self.booked_bitmap
+        return [n for n in range(1, self.total_seats + 1) if booked >> (n - 1) & 1]
+
     def is_seat_available(self, seat_number):
-        return self.seats.get(str(seat_number)) == 'available'
+        seat_number = int(seat_number)
+        return 0 < seat_number <= self.total_seats and not self.booked_bitmap >> (seat_number - 1) & 1
+
+    def book_seats(self, seat_numbers):
+        booked = self.booked_bitmap
+        for seat in seat_numbers:
+            if not str(seat).isdigit() or not 0 < int(seat) <= self.total_seats or booked >> (int(seat) - 1) & 1:
+                raise ValidationError(f"Seat {seat} is not available.")
+            booked |= 1 << (int(seat) - 1)
+        self.booked_bitmap = booked
+
+    def release_seats(self, seat_numbers):
+        booked = self.booked_bitmap
+        for seat in seat_numbers:
+            booked &= ~(1 << (int(seat) - 1))
+        self.booked_bitmap = booked
+
+    def seat_label(self, seat_number):
+        return self.layout.label(seat_number)
 
     def __str__(self):
         return f"{self.start_location} → {self.destination} ({self.bus_type}) on {self.departure_date:%Y-%m-%d %H:%M}"
@@ -102,6 +201,7 @@ class Trip(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['start_location', 'destination', 'departure_date']),  # Composite index for trip search
+            models.Index(fields=['departure_date']),  # Admin date hierarchy
         ]
 
 
@@ -129,6 +229,8 @@ class Booking(models.Model):
     expires_at = models.DateTimeField(null=True, blank=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    # Set (not stored) to let _book_seats pick the seats itself: {'together': bool, 'window': bool, 'front': bool}
+    seat_preferences = None
 
     class Meta:
         ordering = ['-booking_date']
@@ -136,6 +238,9 @@ class Booking(models.Model):
             models.Index(fields=['status', 'expires_at']),  # Existing index
             models.Index(fields=['trip', 'user']),  # Composite index for trip and user
             models.Index(fields=['payment_status', 'payment_type']),  # Composite index for payment fields
+            models.Index(fields=['booking_date']),  # Default ordering and admin date hierarchy
+            models.Index(fields=['customer_phone']),  # Admin search by phone
+            models.Index(fields=['payment_reference']),  # Admin search by payment reference
         ]
 
     def save(self, *args, **kwargs):
@@ -150,6 +255,15 @@ class Booking(models.Model):
             super().save(*args, **kwargs)
 
     def _book_seats(self, trip):
+        if trip.cancelled_at:
+            raise ValidationError("This trip has been cancelled.")
+        if not self.selected_seats and self.seat_preferences is not None:
+            # Auto-assign: choose from the locked trip row so the pick and the reservation are one step
+            picked = pick_seats(trip.free_bitmap, trip.total_seats, self.seats_booked,
+                                seats_per_row=trip.layout.seats_per_row, **self.seat_preferences)
+            if not picked:
+                raise ValidationError("Not enough available seats.")
+            self.selected_seats = picked
         selected = set(map(str, self.selected_seats))
         if len(selected) != self.seats_booked:
             raise ValidationError("Number of selected seats must match seats booked.")
@@ -157,28 +271,184 @@ class Booking(models.Model):
         if trip.available_seats < self.seats_booked:
             raise ValidationError("Not enough available seats.")
         
-        for seat in selected:
-            if trip.seats.get(seat) != 'available':
-                raise ValidationError(f"Seat {seat} is not available.")
-            trip.seats[seat] = 'booked'
-
+        trip.book_seats(selected)
         trip.available_seats -= self.seats_booked
         trip.save()
+        seat_events.publish_on_commit(trip.pk, seat_events.BOOKED, selected)
 
     def cancel(self):
         if self.status != 'CANCELLED':
             with transaction.atomic():
                 trip = Trip.objects.select_for_update().get(pk=self.trip.pk)
-                for seat in map(str, self.selected_seats):
-                    trip.seats[seat] = 'available'
+                trip.release_seats(self.selected_seats)
                 trip.available_seats += self.seats_booked
                 trip.save()
+                if self.status == 'PENDING':
+                    WaitlistEntry.requeue_unclaimed([self.pk])
                 self.status = 'CANCELLED'
                 self.save()
+                seat_events.publish_on_commit(trip.pk, seat_events.RELEASED, self.selected_seats)
+                transaction.on_commit(lambda: seats_released.send(sender=Trip, trip_id=trip.pk))
+
+    @classmethod
+    def cancel_pending(cls, trip_id, booking_ids, payment_status=None, **filters):
+        """
+        Cancel many PENDING bookings of one trip and give their seats back, locking the trip row once.
+        The bookings are re-checked under the lock (status and `filters`), so any that were paid or
+        cancelled meanwhile are left alone. Returns the number cancelled.
+        """
+        with transaction.atomic():
+            trip = Trip.objects.select_for_update().get(pk=trip_id)
+            bookings = list(cls.objects.select_for_update()
+                            .filter(id__in=booking_ids, trip_id=trip_id, status='PENDING', **filters)
+                            .only('id', 'selected_seats', 'seats_booked'))
+            if not bookings:
+                return 0
+            seats = [seat for booking in bookings for seat in booking.selected_seats]
+            trip.release_seats(seats)
+            trip.available_seats += sum(booking.seats_booked for booking in bookings)
+            trip.save()
+            changes = {'status': 'CANCELLED'}
+            if payment_status:
+                changes['payment_status'] = payment_status
+            cls.objects.filter(id__in=[booking.id for booking in bookings]).update(**changes)
+            WaitlistEntry.requeue_unclaimed([booking.id for booking in bookings])
+            seat_events.publish_on_commit(trip_id, seat_events.RELEASED, seats)
+            transaction.on_commit(lambda: seats_released.send(sender=Trip, trip_id=trip_id))
+        return len(bookings)
+
+    @property
+    def seat_labels(self):
+        return [self.trip.seat_label(seat) for seat in self.selected_seats]
 
     def __str__(self):
         return f"{self.user.username} booking: {self.trip}"
 
 
+# Model for a waitlist entry: a user waiting for seats on a sold-out trip, served first come first served
+class WaitlistEntry(models.Model):
+    STATUS_CHOICES = [('WAITING', 'Waiting'), ('OFFERED', 'Offered'), ('LEFT', 'Left')]
+
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='waitlist')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='waitlist_entries')
+    seats_requested = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='WAITING')
+    booking = models.OneToOneField(Booking, on_delete=models.SET_NULL, null=True, blank=True, related_name='waitlist_entry')
+    created_at = models.DateTimeField(auto_now_add=True)
+    offered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'Waitlist'
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['trip', 'status', 'created_at']),  # FIFO scan per trip
+        ]
+
+    @classmethod
+    def requeue_unclaimed(cls, booking_ids):
+        """
+        Offers whose bookings are cancelled unpaid go back to WAITING, at the back of the queue so
+        the freed seats reach the next user first; the seats_released signal re-runs the matching.
+        """
+        return (cls.objects.filter(booking_id__in=booking_ids, status='OFFERED')
+                .update(status='WAITING', booking=None, offered_at=None, created_at=timezone.now()))
+
+    def __str__(self):
+        return f"{self.user.username} waiting for {self.seats_requested} seat(s) on trip {self.trip_id}"
+
+
+# Last run of each maintenance job (booking/scheduler.py), so a newly elected leader keeps to the schedule
+class JobRun(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    last_run_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} at {self.last_run_at:%Y-%m-%d %H:%M:%S}"
+
+
+# Model for a raw payment gateway callback: stored as received and applied later by booking/payment_events.py
+class PaymentEvent(models.Model):
+    SOURCE_CHOICES = [('PROCESSED', 'Processed callback'), ('RESPONSE', 'Response callback')]
+    OUTCOME_CHOICES = [('APPLIED', 'Applied'), ('IGNORED', 'Ignored'), ('UNKNOWN', 'Unknown order')]
+
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    order_id = models.CharField(max_length=100, db_index=True)
+    transaction_id = models.CharField(max_length=100, blank=True, null=True)
+    success = models.BooleanField()
+    payload = models.JSONField(default=dict)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    outcome = models.CharField(max_length=10, choices=OUTCOME_CHOICES, blank=True, null=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['processed_at', 'id']),  # Backlog scan in arrival order
+        ]
+
+    def __str__(self):
+        return f"{self.get_source_display()} for order {self.order_id}"
+
+
+# Archive ("cold") tables: departed trips and their bookings are moved here by booking/archive.py so the
+# live tables only hold upcoming departures. Rows keep their original ids and a denormalised copy of
+# everything history screens print, so they never join back to live locations or layouts.
+class ArchivedTrip(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    bus_type = models.CharField(max_length=20, choices=BUS_TYPE_CHOICES)
+    start_city = models.CharField(max_length=100)
+    start_area = models.CharField(max_length=100)
+    destination_city = models.CharField(max_length=100)
+    destination_area = models.CharField(max_length=100)
+    departure_date = models.DateTimeField()
+    arrival_date = models.DateTimeField()
+    total_seats = models.PositiveIntegerField()
+    available_seats = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['departure_date']),
+        ]
+
+    @property
+    def start_location(self):
+        return f'{self.start_city}, {self.start_area}'
 
+    @property
+    def destination(self):
+        return f'{self.destination_city}, {self.destination_area}'
 
+    def __str__(self):
+        return f"{self.start_location} → {self.destination} ({self.bus_type}) on {self.departure_date:%Y-%m-%d %H:%M}"
+
+
+class ArchivedBooking(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_bookings')
+    trip = models.ForeignKey(ArchivedTrip, on_delete=models.CASCADE, related_name='bookings')
+    customer_name = models.CharField(max_length=50)
+    customer_phone = models.CharField(max_length=11)
+    seats_booked = models.PositiveIntegerField()
+    selected_seats = models.JSONField(default=list)
+    seat_labels = models.JSONField(default=list)
+    payment_status = models.CharField(max_length=10, choices=Booking.PAYMENT_CHOICES)
+    payment_order_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    status = models.CharField(max_length=10, choices=Booking.STATUS_CHOICES)
+    payment_reference = models.CharField(max_length=100, blank=True, null=True)
+    payment_type = models.CharField(max_length=10, choices=Booking.PAYMENT_TYPE_CHOICES)
+    booking_date = models.DateTimeField()
+    expires_at = models.DateTimeField(null=True, blank=True)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        ordering = ['-booking_date']
+        indexes = [
+            models.Index(fields=['user', 'booking_date']),  # Profile history
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} booking: {self.trip}"
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Planner row estimates by backend: (SQL, takes the table name). SQLite keeps none, so it always counts.
+ESTIMATE_SQL = {
+    'postgresql': "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)",
+    'mysql': "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+}
+
+
+def estimated_count(model, using='default'):
+    """The database's own estimate of a table's row count, or None when the backend keeps none."""
+    connection = connections[using]
+    sql = ESTIMATE_SQL.get(connection.vendor)
+    if sql is None:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [model._meta.db_table])
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for a table that was never analyzed
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin paginator for tables too big to COUNT(*). An unfiltered changelist of a table the planner
+    thinks holds more than ADMIN_ESTIMATE_COUNT_ABOVE rows uses that estimate. A filtered one counts
+    at most ADMIN_COUNT_LIMIT rows (COUNT over a LIMITed subquery), so an unselective filter doesn't
+    scan the table either; later pages are then reached by narrowing the filter instead.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > settings.ADMIN_ESTIMATE_COUNT_ABOVE:
+                return estimate
+        return queryset.order_by()[:settings.ADMIN_COUNT_LIMIT].count()
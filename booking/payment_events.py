@@ -0,0 +1,140 @@
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.utils import timezone
+from . import metrics
+from .models import Booking, PaymentEvent
+from .reconcile import confirm_paid
+
+logger = logging.getLogger(__name__)
+
+# Callbacks wake one consumer thread per process; a burst of callbacks coalesces into one pending wake-up.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='payment-events')
+_wake_pending = threading.Event()
+
+
+def parse_callback(params):
+    """Cheap validation of a gateway callback: the order it is about, its transaction and whether it succeeded."""
+    if not isinstance(params, dict):
+        raise ValueError("Callback body must be an object")
+    if isinstance(params.get('obj'), dict):
+        params = params['obj']
+    order_id = params.get('order')
+    if isinstance(order_id, dict):  # The processed callback nests the whole order
+        order_id = order_id.get('id')
+    if order_id in (None, ''):
+        raise ValueError("Callback has no order")
+    transaction_id = params.get('id')
+    return {
+        'order_id': str(order_id),
+        'transaction_id': str(transaction_id) if transaction_id not in (None, '') else None,
+        'success': str(params.get('success')).lower() == 'true',
+    }
+
+
+def record(source, params):
+    """Store a callback as received; it is applied by consume(). Raises ValueError for malformed bodies."""
+    event = PaymentEvent.objects.create(source=source, payload=params, **parse_callback(params))
+    metrics.incr('payment_events_received')
+    if settings.PAYMENT_EVENTS_CONSUME_ON_RECEIVE:
+        transaction.on_commit(wake)
+    return event
+
+
+def wake():
+    if not _wake_pending.is_set():
+        _wake_pending.set()
+        _executor.submit(_consume_in_background)
+
+
+def _consume_in_background():
+    _wake_pending.clear()
+    try:
+        consume()
+    except Exception:
+        logger.exception("Consuming payment events failed")
+    finally:
+        connections.close_all()
+
+
+def process_batch(batch_size=None):
+    """
+    Apply the oldest unprocessed events. The batch is locked in arrival order, so concurrent
+    consumers take turns and every booking sees its callbacks in the order they came in: the
+    first one settles a PENDING booking (paid: confirmed and ticketed, failed: cancelled and its
+    seats released) and later ones for the same order are only marked IGNORED.
+    Returns the number of events processed.
+    """
+    batch_size = batch_size or settings.PAYMENT_EVENTS_BATCH
+    with transaction.atomic():
+        events = list(PaymentEvent.objects.select_for_update()
+                      .filter(processed_at__isnull=True).order_by('id')[:batch_size])
+        if not events:
+            return 0
+        bookings = {booking.payment_order_id: booking for booking in Booking.objects
+                    .filter(payment_order_id__in={event.order_id for event in events})
+                    .only('id', 'trip_id', 'status', 'payment_order_id')}
+        paid, failed, settled, cancelled = {}, defaultdict(list), set(), set()
+        for event in events:
+            booking = bookings.get(event.order_id)
+            if booking is None:
+                event.outcome = 'UNKNOWN'
+                logger.warning(f"Payment event {event.id} is for unknown order {event.order_id}")
+            elif booking.status != 'PENDING' or event.order_id in settled:
+                event.outcome = 'IGNORED'
+                if event.success and (booking.status == 'CANCELLED' or booking.id in cancelled):
+                    # Money taken for a booking that was already let go: needs a refund
+                    metrics.incr('payment_events_paid_after_cancel')
+                    logger.error(f"Order {event.order_id} was paid after booking {booking.id} was cancelled; refund it")
+            else:
+                settled.add(event.order_id)
+                if event.success:
+                    paid[booking.id] = event.transaction_id or ''
+                else:
+                    failed[booking.trip_id].append(booking.id)
+                    cancelled.add(booking.id)
+                event.outcome = 'APPLIED'
+
+        confirm_paid(paid)
+        for trip_id in sorted(failed):
+            Booking.cancel_pending(trip_id, failed[trip_id], payment_status='FAILED')
+
+        processed_at = timezone.now()
+        for event in events:
+            event.processed_at = processed_at
+        PaymentEvent.objects.bulk_update(events, ['processed_at', 'outcome'])
+
+    # Settled orders can't be paid again, so their cached payment keys are dead
+    from .views.payment import payment_key_cache_key
+    cache.delete_many([payment_key_cache_key(order_id) for order_id in settled])
+    metrics.incr('payment_events_processed', len(events))
+    metrics.set_value('payment_events_lag_ms', round(max(
+        (processed_at - event.received_at).total_seconds() for event in events) * 1000))
+    return len(events)
+
+
+def consume(batch_size=None, max_batches=None):
+    """Process batches until the backlog is empty (or max_batches ran). Returns the number of events processed."""
+    processed = batches = 0
+    with metrics.timed('payment_events'):
+        while max_batches is None or batches < max_batches:
+            count = process_batch(batch_size)
+            processed += count
+            batches += 1
+            if count < (batch_size or settings.PAYMENT_EVENTS_BATCH):
+                break
+    record_backlog()
+    return processed
+
+
+def record_backlog():
+    """Publish how many events are waiting and how old the oldest one is."""
+    pending = PaymentEvent.objects.filter(processed_at__isnull=True)
+    oldest = pending.order_by('id').values_list('received_at', flat=True).first()
+    metrics.set_value('payment_events_backlog', pending.count())
+    metrics.set_value('payment_events_oldest_ms',
+                      round((timezone.now() - oldest).total_seconds() * 1000) if oldest else 0)
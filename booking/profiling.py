@@ -0,0 +1,167 @@
+import atexit
+import hmac
+import logging
+import os
+import random
+import socket
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+logger = logging.getLogger(__name__)
+
+# Collapsed stack files (flamegraph.pl / speedscope / inferno format): one "frame;frame;frame count" per line
+FILE_SUFFIX = '.collapsed'
+UNRESOLVED = 'unresolved'
+STDLIB = sysconfig.get_paths()['stdlib']
+
+
+def frame_label(code):
+    path = code.co_filename
+    if 'site-packages' in path:
+        path = path.split('site-packages', 1)[1].lstrip(os.sep)
+    elif path.startswith(str(settings.BASE_DIR)):
+        path = os.path.relpath(path, settings.BASE_DIR)
+    elif path.startswith(STDLIB):
+        path = os.path.relpath(path, STDLIB)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Samples one thread's stack every `interval` seconds from a helper thread, keeping only the
+    frames above `root` (the caller's frame), so server and middleware plumbing stay out.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+
+    def start(self, root):
+        self.root = root
+        self.ident = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        labels = {}  # Code object -> label, so each distinct function is formatted once per request
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            if self._stop.is_set():  # The request finished while we slept; this stack is stop() itself
+                break
+            stack = []
+            while frame is not None and frame is not self.root:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+class ProfileStore:
+    """
+    Per-process stack counts by URL name. Flushed to `<dir>/<url name>.<host>-<pid>.collapsed` at most
+    every PROFILING_FLUSH_SECONDS (and at exit); each file holds the process's running totals.
+    """
+
+    def __init__(self, directory, flush_seconds):
+        self.directory = Path(directory)
+        self.flush_seconds = flush_seconds
+        self.process = f"{socket.gethostname()}-{os.getpid()}"
+        self.stacks = defaultdict(Counter)
+        self.dirty = set()
+        self.flushed_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, url_name, stacks):
+        with self.lock:
+            self.stacks[url_name].update(stacks)
+            self.dirty.add(url_name)
+            due = time.monotonic() - self.flushed_at >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            snapshot = {url_name: dict(self.stacks[url_name]) for url_name in dirty}
+            self.flushed_at = time.monotonic()
+        if not snapshot:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for url_name, stacks in snapshot.items():
+            path = self.directory / f"{url_name}.{self.process}{FILE_SUFFIX}"
+            tmp = path.with_suffix('.tmp')
+            tmp.write_text(''.join(f"{stack} {count}\n" for stack, count in stacks.items()))
+            tmp.replace(path)
+
+
+def read_profiles(directory, url_name=None):
+    """Merge every process's files: {url name: Counter(stack -> samples)}."""
+    profiles = defaultdict(Counter)
+    for path in sorted(Path(directory).glob(f'*{FILE_SUFFIX}')):
+        name = path.name.split('.', 1)[0]  # <url name>.<host>-<pid>: URL names have no dots, hostnames may
+        if url_name and name != url_name:
+            continue
+        for line in path.read_text().splitlines():
+            stack, _, count = line.rpartition(' ')
+            if stack and count.isdigit():
+                profiles[name][stack] += int(count)
+    return profiles
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in sampling profiler. Removed from the stack at startup unless PROFILING_ENABLED, so it
+    costs nothing when off. When on, it profiles PROFILING_SAMPLE_RATE of requests plus any
+    request whose X-Profile header matches PROFILING_TOKEN, and aggregates the stacks per URL name.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self.token = settings.PROFILING_TOKEN
+        self.interval = settings.PROFILING_INTERVAL_MS / 1000
+        self.store = ProfileStore(settings.PROFILING_DIR, settings.PROFILING_FLUSH_SECONDS)
+        atexit.register(self.store.flush)
+
+    def wants_profile(self, request):
+        header = request.headers.get('X-Profile')
+        if header is not None and self.token:
+            return hmac.compare_digest(header, self.token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if not self.wants_profile(request):
+            return self.get_response(request)
+        sampler = StackSampler(self.interval)
+        sampler.start(sys._getframe())
+        try:
+            response = self.get_response(request)
+        finally:
+            stacks = sampler.stop()
+        match = getattr(request, 'resolver_match', None)
+        url_name = (match.url_name if match else None) or UNRESOLVED
+        if stacks:
+            try:
+                self.store.add(url_name, stacks)
+            except OSError:
+                logger.exception("Writing profiles failed")
+        response['X-Profile-Samples'] = str(sum(stacks.values()))
+        return response
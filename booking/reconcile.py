@@ -0,0 +1,150 @@
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, When, Value, CharField
+from django.utils import timezone
+from . import metrics
+from .models import Booking
+from .tickets import ticket_store
+from .utils import send_ticket_email
+from .views import payment
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of a gateway lookup
+PAID, FAILED, PENDING, UNRESOLVED = 'PAID', 'FAILED', 'PENDING', 'UNRESOLVED'
+# Set for a booking whose payment the gateway reported still in progress, until the next reconcile run
+PENDING_KEY = 'reconcile_pending_{}'
+
+
+def stuck_bookings():
+    """Online bookings with a gateway order that are still PENDING RECONCILE_AFTER_MINUTES after booking."""
+    cutoff = timezone.now() - timezone.timedelta(minutes=settings.RECONCILE_AFTER_MINUTES)
+    return (Booking.objects.filter(status='PENDING', payment_order_id__isnull=False, booking_date__lt=cutoff)
+            .exclude(payment_type='CASH'))
+
+
+def query_order(order_id, token):
+    """Ask the gateway how the order's latest transaction ended: (outcome, transaction id)."""
+    res = requests.post(payment.PAYMOB_INQUIRY_URL, json={"order_id": order_id}, headers={
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }, timeout=settings.RECONCILE_TIMEOUT)
+    if res.status_code == 404:  # No transaction yet: the customer never got as far as paying
+        return UNRESOLVED, None
+    res.raise_for_status()
+    data = res.json()
+    if data.get('pending'):
+        return PENDING, data.get('id')
+    return (PAID if str(data.get('success')).lower() == 'true' else FAILED), data.get('id')
+
+
+def reconcile_bookings(queryset=None, limit=None):
+    """
+    Look the orders of stuck bookings up at the gateway, RECONCILE_WORKERS at a time, and apply
+    what comes back in bulk: paid bookings are confirmed (and get their ticket), failed ones are
+    cancelled and release their seats. Returns {'confirmed', 'cancelled', 'unresolved': [ids], 'pending': [ids],
+    'errors'}; `pending` are the unresolved ones whose payment the gateway reports still in progress.
+    """
+    queryset = stuck_bookings() if queryset is None else queryset
+    limit = limit or settings.RECONCILE_BATCH_SIZE
+    rows = list(queryset.order_by('booking_date').values_list('id', 'trip_id', 'payment_order_id')[:limit])
+    result = {'confirmed': 0, 'cancelled': 0, 'unresolved': [], 'pending': [], 'errors': 0}
+    if not rows:
+        return result
+    token = payment.PaymentHelper.get_auth_token()
+    if not token:
+        metrics.incr('reconcile_errors', len(rows))
+        result.update(unresolved=[booking_id for booking_id, _, _ in rows], errors=len(rows))
+        return result
+
+    started = time.perf_counter()
+    paid, failed = {}, defaultdict(list)
+    with ThreadPoolExecutor(max_workers=settings.RECONCILE_WORKERS, thread_name_prefix='reconcile') as pool:
+        lookups = {pool.submit(query_order, order_id, token): (booking_id, trip_id)
+                   for booking_id, trip_id, order_id in rows}
+        for lookup in as_completed(lookups):
+            booking_id, trip_id = lookups[lookup]
+            try:
+                outcome, transaction_id = lookup.result()
+            except (requests.RequestException, ValueError) as e:
+                logger.warning(f"Reconciling booking {booking_id} failed: {e}")
+                result['errors'] += 1
+                result['unresolved'].append(booking_id)
+                continue
+            if outcome == PAID:
+                paid[booking_id] = str(transaction_id or '')
+            elif outcome == FAILED:
+                failed[trip_id].append(booking_id)
+            else:
+                if outcome == PENDING:
+                    result['pending'].append(booking_id)
+                result['unresolved'].append(booking_id)
+    elapsed = time.perf_counter() - started
+    # Outlives the next run, so expiry holds these back until the gateway has been asked again
+    cache.set_many({PENDING_KEY.format(booking_id): True for booking_id in result['pending']},
+                   timeout=settings.SCHEDULER_JOB_INTERVALS['reconcile_payments'] * 2)
+    cache.delete_many([PENDING_KEY.format(booking_id) for booking_id, _, _ in rows if booking_id not in result['pending']])
+
+    result['confirmed'] = confirm_paid(paid)
+    for trip_id in sorted(failed):
+        result['cancelled'] += Booking.cancel_pending(trip_id, failed[trip_id], payment_status='FAILED')
+
+    metrics.observe('reconcile', elapsed)
+    metrics.incr('reconcile_checked', len(rows))
+    metrics.incr('reconcile_confirmed', result['confirmed'])
+    metrics.incr('reconcile_cancelled', result['cancelled'])
+    metrics.incr('reconcile_errors', result['errors'])
+    metrics.set_value('reconcile_throughput_per_s', round(len(rows) / elapsed, 1) if elapsed else len(rows))
+    metrics.set_value('reconcile_error_rate', round(result['errors'] / len(rows), 3))
+    logger.info(f"Reconciled {len(rows)} orders in {elapsed:.2f}s: {result['confirmed']} confirmed, "
+                f"{result['cancelled']} cancelled, {len(result['unresolved'])} unresolved, {result['errors']} errors")
+    return result
+
+
+def held_at_gateway(queryset, limit=None):
+    """
+    Ids among expired online bookings that expiry should leave alone for now: those whose payment
+    the gateway reported still in progress at the last reconcile run. Only the cache is read: the
+    gateway is asked by the reconcile_payments job, never from the expiry tick.
+    """
+    ids = list(queryset.order_by('expires_at').values_list('id', flat=True)[:limit or settings.RECONCILE_BATCH_SIZE])
+    pending = cache.get_many([PENDING_KEY.format(booking_id) for booking_id in ids])
+    return [booking_id for booking_id in ids if PENDING_KEY.format(booking_id) in pending]
+
+
+def confirm_paid(paid):
+    """Confirm the still-PENDING bookings among {booking id: transaction id} in one conditional UPDATE."""
+    if not paid:
+        return 0
+    with transaction.atomic():
+        ids = list(Booking.objects.select_for_update().filter(id__in=paid, status='PENDING').values_list('id', flat=True))
+        if ids:
+            Booking.objects.filter(id__in=ids, status='PENDING').update(
+                status='CONFIRMED', payment_status='PAID',
+                payment_reference=Case(*[When(id=booking_id, then=Value(paid[booking_id])) for booking_id in ids],
+                                       output_field=CharField()),
+            )
+            transaction.on_commit(lambda: send_tickets(ids))
+    late = list(Booking.objects.filter(id__in=set(paid) - set(ids), status='CANCELLED').values_list('id', flat=True))
+    if late:
+        # Paid at the gateway but already cancelled here (expired before the money came in): needs a refund
+        metrics.incr('reconcile_paid_after_cancel', len(late))
+        logger.error(f"Bookings {sorted(late)} were paid after being cancelled; refund them")
+    return len(ids)
+
+
+def send_tickets(booking_ids):
+    bookings = Booking.objects.filter(id__in=booking_ids).select_related(
+        'user', 'trip__start_location__city', 'trip__destination__city', 'trip__layout')
+    for booking in bookings:
+        try:
+            _, pdf_content = ticket_store.get_or_render(booking)
+            send_ticket_email(booking, pdf_content)
+        except Exception:
+            logger.exception(f"Sending the ticket of reconciled booking {booking.id} failed")
@@ -0,0 +1,189 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+from django.utils import timezone
+from . import metrics
+from .jobs import JOBS
+from .models import JobRun
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = 'booking_scheduler'
+
+
+class CacheLease:
+    """
+    Leadership as a cache key that expires unless renewed. Only meaningful with a cache shared
+    by every process (Redis/Memcached); with the default locmem cache each process leads itself.
+    """
+
+    def __init__(self, owner, ttl):
+        self.key = f'{LOCK_NAME}_leader'
+        self.owner = owner
+        self.ttl = ttl
+
+    def acquire(self):
+        if cache.add(self.key, self.owner, self.ttl):
+            return True
+        if cache.get(self.key) == self.owner:
+            cache.set(self.key, self.owner, self.ttl)  # Renew our own lease
+            return True
+        return False
+
+    def release(self):
+        if cache.get(self.key) == self.owner:
+            cache.delete(self.key)
+
+
+class AdvisoryLock:
+    """
+    Leadership as a session-level database lock (MySQL GET_LOCK, PostgreSQL advisory lock) held
+    on the scheduler thread's own connection: it is released by the server as soon as the
+    process or its connection dies, so a crashed leader never blocks the others.
+    """
+
+    def __init__(self):
+        self.held_on = None  # The connection object the lock was taken on
+
+    def acquire(self):
+        if self.held_on is not None and self.held_on is connection.connection and connection.is_usable():
+            return True
+        self.held_on = None
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                cursor.execute('SELECT GET_LOCK(%s, 0)', [LOCK_NAME])
+            else:
+                cursor.execute('SELECT pg_try_advisory_lock(%s)', [zlib.crc32(LOCK_NAME.encode())])
+            acquired = bool(cursor.fetchone()[0])
+        if acquired:
+            self.held_on = connection.connection
+        return acquired
+
+    def release(self):
+        if self.held_on is None:
+            return
+        self.held_on = None
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                cursor.execute('SELECT RELEASE_LOCK(%s)', [LOCK_NAME])
+            else:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [zlib.crc32(LOCK_NAME.encode())])
+
+
+def leader_lock(owner):
+    kind = settings.SCHEDULER_LEADER_LOCK
+    if kind == 'auto':
+        kind = 'db' if connection.vendor in ('mysql', 'postgresql') else 'cache'
+    if kind == 'db':
+        return AdvisoryLock()
+    return CacheLease(owner, settings.SCHEDULER_LEASE_SECONDS)
+
+
+class Scheduler:
+    """
+    Runs the jobs in booking/jobs.py at their SCHEDULER_JOB_INTERVALS while this process holds
+    leadership; followers keep trying every tick and take over when the leader goes away. Each
+    run is recorded in JobRun, so a new leader carries on from the old one's schedule instead of
+    running the nightly jobs again.
+    Per job it records `scheduler_<job>` timings, `scheduler_<job>_last_run` (epoch seconds),
+    `scheduler_<job>_lag_ms` (how late the run started) and `scheduler_<job>_errors`.
+    """
+
+    def __init__(self, tick=None, jobs=None):
+        self.tick = tick or settings.SCHEDULER_TICK_SECONDS
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.jobs = {name: JOBS[name] for name in (jobs or settings.SCHEDULER_JOB_INTERVALS) if name in JOBS}
+        self.lock = None
+        self.is_leader = False
+        self._next_run = {}
+        self._stop = threading.Event()
+
+    def run_pending(self, force=False):
+        """Run every job that is due (all of them with force). Returns {job: rows handled}."""
+        results = {}
+        for name, func in self.jobs.items():
+            now = time.time()
+            due = self._next_run.get(name, now)
+            if not force and now < due:
+                continue
+            metrics.set_value(f'scheduler_{name}_lag_ms', int(max(now - due, 0) * 1000))
+            try:
+                with metrics.timed(f'scheduler_{name}'):
+                    results[name] = func()
+            except Exception:
+                metrics.incr(f'scheduler_{name}_errors')
+                logger.exception(f"Scheduled job {name} failed")
+            metrics.set_value(f'scheduler_{name}_last_run', int(time.time()))
+            self._next_run[name] = now + self.interval(name)
+            JobRun.objects.update_or_create(name=name, defaults={'last_run_at': timezone.now()})
+        return results
+
+    def interval(self, name):
+        return settings.SCHEDULER_JOB_INTERVALS.get(name, self.tick)
+
+    def load_schedule(self):
+        """When each job is next due, from its last recorded run; jobs that never ran are due now."""
+        runs = JobRun.objects.filter(name__in=self.jobs).values_list('name', 'last_run_at')
+        self._next_run = {name: last_run_at.timestamp() + self.interval(name) for name, last_run_at in runs}
+
+    def step(self, force=False):
+        """One tick: take or keep leadership, then run what is due (everything with force)."""
+        self.lock = self.lock or leader_lock(self.owner)
+        try:
+            leader = self.lock.acquire()
+        except Exception:
+            logger.exception("Scheduler leader election failed")
+            connection.close()
+            leader = False
+        if leader != self.is_leader:
+            logger.info(f"Scheduler {self.owner} {'is now' if leader else 'is no longer'} the leader")
+            self.is_leader = leader
+            if leader:
+                self.load_schedule()
+        if leader:
+            metrics.set_value('scheduler_leader', self.owner)
+            return self.run_pending(force)
+        return {}
+
+    def run_forever(self):
+        try:
+            while not self._stop.is_set():
+                self.step()
+                self._stop.wait(self.tick)
+        finally:
+            if self.lock is not None:
+                try:
+                    self.lock.release()
+                except Exception:
+                    logger.exception("Releasing scheduler leadership failed")
+            connections.close_all()
+
+    def stop(self):
+        self._stop.set()
+
+
+_background = None
+_background_lock = threading.Lock()
+
+
+def start_in_background():
+    """
+    Start the scheduler thread for this process (once) when SCHEDULER_AUTOSTART is on. Called by
+    wsgi.py and asgi.py only, so management commands, tests and scripts that run django.setup()
+    never start one.
+    """
+    global _background
+    if not settings.SCHEDULER_AUTOSTART:
+        return None
+    with _background_lock:
+        if _background is None:
+            _background = Scheduler()
+            threading.Thread(target=_background.run_forever, name='booking-scheduler', daemon=True).start()
+    return _background
@@ -0,0 +1,109 @@
+import hashlib
+from itertools import product
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from . import metrics
+from .autocomplete import get_index
+from .models import Area, Trip
+from .utils import shared_cache
+
+# Trip search results by normalized query (resolved city/area ids, day, sold-out flag). Each cached
+# body is stored under the current versions of the (start city, destination city, day) routes it
+# covers; any change to a trip on one of them bumps the version, which orphans the old entries.
+# Only meaningful with a cache shared by every process (Redis/Memcached): with the default locmem
+# cache a booking handled by one worker (or the scheduler) would only bump that process's versions
+# and every other worker would keep serving stale seat counts, so searches then go uncached.
+ROUTE_VERSION_KEY = 'search_version_{}_{}_{}'
+GENERATION_KEY = 'search_generation'  # Bumped to drop everything at once (bulk loads)
+
+
+def enabled():
+    return settings.SEARCH_CACHE_TIMEOUT > 0 and shared_cache()
+
+
+def route_version_keys(routes):
+    return [ROUTE_VERSION_KEY.format(start_city_id, destination_city_id, day.isoformat())
+            for start_city_id, destination_city_id, day in routes]
+
+
+def cache_key(start_city_ids, start_area_ids, destination_city_ids, destination_area_ids, day, include_sold_out):
+    """
+    The cache key of a search, or None when it can't be cached: the cache must be enabled, both
+    cities and the day must be known, and the query may span at most SEARCH_CACHE_MAX_ROUTES city pairs.
+    """
+    if not enabled() or not start_city_ids or not destination_city_ids or day is None:
+        return None
+    pairs = list(product(sorted(set(start_city_ids)), sorted(set(destination_city_ids))))
+    if len(pairs) > settings.SEARCH_CACHE_MAX_ROUTES:
+        return None
+    version_keys = route_version_keys([(start, destination, day) for start, destination in pairs])
+    versions = cache.get_many(version_keys + [GENERATION_KEY])
+    normalized = '|'.join(map(str, (
+        pairs, sorted(start_area_ids or ()), sorted(destination_area_ids or ()), day.isoformat(),
+        include_sold_out, timezone.get_current_timezone_name(),
+        [versions.get(key, 0) for key in version_keys], versions.get(GENERATION_KEY, 0),
+    )))
+    return f"search_{hashlib.sha1(normalized.encode()).hexdigest()}"
+
+
+def get(key):
+    body = cache.get(key)
+    metrics.incr('search_cache_hits' if body is not None else 'search_cache_misses')
+    return body
+
+
+def put(key, body):
+    cache.set(key, body, timeout=settings.SEARCH_CACHE_TIMEOUT)
+
+
+def _bump(key):
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:  # Evicted in between
+            cache.set(key, 1, timeout=None)
+
+
+def invalidate_routes(routes):
+    """Bump the versions of (start city, destination city, day) routes once the transaction commits."""
+    keys = set(route_version_keys(routes))
+    transaction.on_commit(lambda: [_bump(key) for key in keys])
+
+
+def invalidate_all():
+    _bump(GENERATION_KEY)
+
+
+def trip_routes(trips):
+    """(start city, destination city, local day) of (start area id, destination area id, departure) triples."""
+    area_cities = get_index().areas
+    area_ids = {area_id for start, destination, _ in trips for area_id in (start, destination)}
+    missing = area_ids - set(area_cities)
+    cities = {area_id: area_cities[area_id][1] for area_id in area_ids - missing}
+    if missing:  # Areas created since the index was built
+        cities.update(Area.objects.filter(id__in=missing).values_list('id', 'city_id'))
+    return {(cities[start], cities[destination], timezone.localdate(departure))
+            for start, destination, departure in trips if start in cities and destination in cities}
+
+
+def invalidate_trips(trips):
+    invalidate_routes(trip_routes([(trip.start_location_id, trip.destination_id, trip.departure_date)
+                                   for trip in trips]))
+
+
+def on_trip_changed(sender, instance, **kwargs):
+    # A trip that moved to another route or day also leaves its old listing stale
+    trips = [(instance.start_location_id, instance.destination_id, instance.departure_date)]
+    loaded = getattr(instance, '_loaded_route', None)
+    if loaded and loaded != trips[0]:
+        trips.append(loaded)
+    invalidate_routes(trip_routes(trips))
+    instance._loaded_route = trips[0]
+
+
+def connect_signals():
+    post_save.connect(on_trip_changed, sender=Trip, dispatch_uid='search_cache_trip_saved')
+    post_delete.connect(on_trip_changed, sender=Trip, dispatch_uid='search_cache_trip_deleted')
@@ -0,0 +1,172 @@
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Versioned seat deltas per trip. Every change bumps the trip's seat version in the shared
+# cache and stores the delta under that version, so any worker can replay what a client
+# missed. Subscribers in this process are also woken up immediately.
+SEAT_VERSION_KEY = 'seat_version_{}'
+SEAT_EVENT_KEY = 'seat_event_{}_{}'
+
+BOOKED, RELEASED, HELD = 'booked', 'released', 'held'
+
+_listeners = defaultdict(set)
+_listeners_lock = threading.Lock()
+
+
+def current_version(trip_id):
+    return cache.get(SEAT_VERSION_KEY.format(trip_id), 0)
+
+
+def _next_version(trip_id):
+    key = SEAT_VERSION_KEY.format(trip_id)
+    if cache.add(key, 1, timeout=None):
+        return 1
+    try:
+        return cache.incr(key)
+    except ValueError:  # Evicted in between; events before this point are unrecoverable anyway
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def publish(trip_id, change, seats, **extra):
+    version = _next_version(trip_id)
+    event = {'version': version, 'change': change, 'seats': sorted(map(str, seats), key=lambda seat: (len(seat), seat)),
+             'at': timezone.now().isoformat(), **extra}
+    cache.set(SEAT_EVENT_KEY.format(trip_id, version), event, timeout=settings.SEAT_EVENTS_TTL)
+    cache.delete(f"trip_seats_{trip_id}")  # The cached seat map is now stale
+    with _listeners_lock:
+        listeners = list(_listeners.get(trip_id, ()))
+    for loop, event_flag in listeners:
+        loop.call_soon_threadsafe(event_flag.set)
+    return version
+
+
+def publish_on_commit(trip_id, change, seats, **extra):
+    """Publish once the surrounding transaction commits (immediately outside one)."""
+    seats = list(seats)
+    transaction.on_commit(lambda: publish(trip_id, change, seats, **extra))
+
+
+def events_since(trip_id, version):
+    """
+    The deltas after `version` in order, or None when some of them are no longer
+    available and the client has to reload the full seat map.
+    """
+    latest = current_version(trip_id)
+    if version == latest:
+        return []
+    if version > latest or latest - version > settings.SEAT_EVENTS_MAX_REPLAY:
+        return None
+    keys = [SEAT_EVENT_KEY.format(trip_id, v) for v in range(version + 1, latest + 1)]
+    found = cache.get_many(keys)
+    if len(found) != len(keys):
+        return None
+    return [found[key] for key in keys]
+
+
+def subscribe(trip_id):
+    """Register the running event loop for wake-ups on `trip_id`; returns the asyncio.Event to wait on."""
+    entry = (asyncio.get_running_loop(), asyncio.Event())
+    with _listeners_lock:
+        _listeners[trip_id].add(entry)
+    return entry
+
+
+def unsubscribe(trip_id, entry):
+    with _listeners_lock:
+        _listeners[trip_id].discard(entry)
+        if not _listeners[trip_id]:
+            del _listeners[trip_id]
+
+
+# Temporary seat holds (the booking initiation step) publish HELD, and a RELEASED delta for the seats
+# still free when the hold lapses or is confirmed; otherwise subscribers would show them held forever.
+# Holds are tracked by the process that created them, ordered by lapse time.
+_holds = {}  # Hold reference -> (trip id, seats)
+_hold_heap = []  # (monotonic lapse time, hold reference)
+_holds_changed = threading.Condition()
+_hold_thread = None
+
+
+def hold(trip_id, reference, seats, seconds):
+    """Publish a HELD delta for `seats` that lapses after `seconds`. Returns the ISO expiry time."""
+    global _hold_thread
+    expires_at = (timezone.now() + timezone.timedelta(seconds=seconds)).isoformat()
+    publish(trip_id, HELD, seats, expires_at=expires_at)
+    with _holds_changed:
+        _holds[reference] = (trip_id, list(seats))
+        heapq.heappush(_hold_heap, (time.monotonic() + seconds, reference))
+        if _hold_thread is None or not _hold_thread.is_alive():
+            _hold_thread = threading.Thread(target=_run_holds, name='seat-holds', daemon=True)
+            _hold_thread.start()
+        _holds_changed.notify()
+    return expires_at
+
+
+def end_hold(reference):
+    """The hold was used (or dropped) before it lapsed: release what is still free right away."""
+    with _holds_changed:
+        if reference in _holds:
+            heapq.heappush(_hold_heap, (0, reference))
+            _holds_changed.notify()
+
+
+def _due_holds(now):
+    due = []
+    while _hold_heap and _hold_heap[0][0] <= now:
+        _, reference = heapq.heappop(_hold_heap)
+        if reference in _holds:
+            due.append(_holds.pop(reference))
+    return due
+
+
+def release_lapsed_holds(now=None):
+    """
+    Publish RELEASED for the seats of lapsed holds that are neither booked nor held by another
+    hold of this process. Returns the number of seats released.
+    """
+    from .models import Trip
+
+    with _holds_changed:
+        due = _due_holds(time.monotonic() if now is None else now)
+        still_held = defaultdict(set)
+        for trip_id, seats in _holds.values():
+            still_held[trip_id].update(map(str, seats))
+    if not due:
+        return 0
+    by_trip = defaultdict(set)
+    for trip_id, seats in due:
+        by_trip[trip_id].update(map(str, seats))
+    released = 0
+    for trip_id, occupancy in Trip.objects.filter(id__in=by_trip).values_list('id', 'occupancy'):
+        booked = int.from_bytes(bytes(occupancy or b''), 'little')
+        free = [seat for seat in by_trip[trip_id] - still_held[trip_id]
+                if not (seat.isdigit() and booked >> (int(seat) - 1) & 1)]
+        if free:
+            publish(trip_id, RELEASED, free, reason='hold_lapsed')
+            released += len(free)
+    return released
+
+
+def _run_holds():
+    while True:
+        with _holds_changed:
+            while not _hold_heap:
+                _holds_changed.wait()
+            _holds_changed.wait(timeout=max(_hold_heap[0][0] - time.monotonic(), 0))
+        try:
+            release_lapsed_holds()
+        except Exception:
+            logger.exception("Publishing lapsed seat holds failed")
+        finally:
+            connections.close_all()
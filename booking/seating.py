@@ -0,0 +1,70 @@
+"""
+Best-available seat selection over a bitmap of free seats (bit n-1 set = seat n free).
+
+Seats are numbered row by row, SEATS_PER_ROW to a row with the aisle in the middle, so the
+first and last seat of every row are window seats.
+"""
+
+SEATS_PER_ROW = 4
+
+
+def _window_mask(total_seats, seats_per_row):
+    mask = 0
+    for row_start in range(0, total_seats, seats_per_row):
+        mask |= 1 << row_start
+        if row_start + seats_per_row - 1 < total_seats:
+            mask |= 1 << (row_start + seats_per_row - 1)
+    return mask
+
+
+def pick_seats(free, total_seats, count, together=True, window=False, front=False, seats_per_row=SEATS_PER_ROW):
+    """
+    Return the best `count` seat numbers from the `free` bitmap, or None if there aren't enough.
+
+    Contiguous blocks are found in one pass of shifts: after and-ing `free` with itself shifted
+    by 1..count-1, every remaining bit marks the first seat of a free block. Blocks are ranked by
+    how many rows they span (with `together`), whether they include a window seat (with
+    `window`), then by row: from the front with `front`, otherwise from the middle of the coach
+    outwards (the smoothest ride), then seat number. When no block exists at all, the best
+    individual seats are taken instead.
+    """
+    if count < 1 or bin(free).count('1') < count:
+        return None
+
+    starts = free
+    for shift in range(1, count):
+        starts &= free >> shift
+
+    windows = _window_mask(total_seats, seats_per_row) if window else 0
+    back_row = (total_seats - 1) // seats_per_row
+
+    def row_rank(row):
+        return row if front else abs(2 * row - back_row)  # Doubled distance from the middle row
+
+    block = (1 << count) - 1
+    best, best_score = None, None
+    while starts:
+        low = starts & -starts
+        start = low.bit_length() - 1
+        starts ^= low
+        first_row, last_row = start // seats_per_row, (start + count - 1) // seats_per_row
+        score = (
+            last_row - first_row if together else 0,
+            0 if not window or (block << start) & windows else 1,
+            row_rank(first_row),
+            start,
+        )
+        if best_score is None or score < best_score:
+            best, best_score = start, score
+    if best is not None:
+        return list(range(best + 1, best + count + 1))
+
+    # Scattered fallback: rank single seats the same way and take the best `count`.
+    singles = []
+    remaining = free
+    while remaining:
+        low = remaining & -remaining
+        index = low.bit_length() - 1
+        remaining ^= low
+        singles.append((0 if not window or low & windows else 1, row_rank(index // seats_per_row), index))
+    return sorted(index + 1 for *_, index in sorted(singles)[:count])
@@ -1,5 +1,5 @@
 from rest_framework import serializers, viewsets
-from .models import User, Trip, Booking, City, Area
+from .models import User, Trip, Booking, City, Area, ArchivedTrip, ArchivedBooking
 from django.db import transaction
 from django.utils import timezone
 
@@ -107,8 +107,40 @@ class BookingSerializer(serializers.ModelSerializer):
                 customer_phone=validated_data.get('customer_phone', request.user.phone_number),
                 payment_type=validated_data.get('payment_type', 'ONLINE')
             )
+            booking.seat_preferences = self.context.get('seat_preferences')
             booking.save()
         return booking
+
+
+# Booking detail with caller-controlled payload. Without ?fields= the response keeps the full
+# BookingSerializer shape. Asking for ?fields= makes it sparse: the listed top-level fields, the user
+# as an id and the trip without its seat map; ?expand= adds back 'user' (the full user) and 'seats'.
+class BookingDetailTripSerializer(TripSerializer):
+    class Meta(TripSerializer.Meta):
+        fields = [field for field in TripSerializer.Meta.fields if field != 'seat_statuses']
+
+
+class BookingDetailSerializer(serializers.ModelSerializer):
+    EXPANDABLE = ('user', 'seats')
+
+    user = UserSerializer(read_only=True)
+    trip = TripSerializer(read_only=True)
+    slim_trip_serializer = BookingDetailTripSerializer
+
+    class Meta:
+        model = Booking
+        fields = BookingSerializer.Meta.fields
+        read_only_fields = BookingSerializer.Meta.fields
+
+    def __init__(self, *args, fields=None, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            if 'user' not in expand:
+                self.fields['user'] = serializers.PrimaryKeyRelatedField(read_only=True)
+            if 'seats' not in expand and self.slim_trip_serializer:
+                self.fields['trip'] = self.slim_trip_serializer(read_only=True)
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
     
     
 # serializers for lightweight data transfer
@@ -135,3 +167,48 @@ class LightweightBookingSerializer(serializers.ModelSerializer):
         fields = ['id', 'trip', 'seats_booked', 'selected_seats', 'payment_status', 'status', 'booking_date', 'total_price','payment_type']  # Reduced fields
 
 
+# Archived bookings, rendered in the same shapes as their live counterparts
+class ArchivedTripSerializer(serializers.ModelSerializer):
+    formatted_departure = serializers.SerializerMethodField()
+    formatted_arrival = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedTrip
+        fields = BookingDetailTripSerializer.Meta.fields
+
+    def get_formatted_departure(self, obj):
+        return obj.departure_date.strftime('%Y-%m-%d')
+
+    def get_formatted_arrival(self, obj):
+        return obj.arrival_date.strftime('%Y-%m-%d')
+
+
+class ArchivedBookingDetailSerializer(BookingDetailSerializer):
+    trip = ArchivedTripSerializer(read_only=True)
+    slim_trip_serializer = None  # Seat maps are not archived
+
+    class Meta(BookingDetailSerializer.Meta):
+        model = ArchivedBooking
+
+
+class LightweightArchivedTripSerializer(serializers.ModelSerializer):
+    start_location = serializers.SerializerMethodField()
+    destination = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedTrip
+        fields = LightweightTripSerializer.Meta.fields
+
+    def get_start_location(self, obj):
+        return {'name': obj.start_area}
+
+    def get_destination(self, obj):
+        return {'name': obj.destination_area}
+
+
+class LightweightArchivedBookingSerializer(serializers.ModelSerializer):
+    trip = LightweightArchivedTripSerializer()
+
+    class Meta:
+        model = ArchivedBooking
+        fields = LightweightBookingSerializer.Meta.fields
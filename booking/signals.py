@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent (after commit) whenever seats of a trip go back on sale: cancellations, expiry, admin deletes.
+# Receivers get `trip_id`.
+seats_released = Signal()
@@ -0,0 +1,201 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# EXPLAIN runs on its own thread and connection, after the slow query has returned
+_explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-query-explain')
+_local = threading.local()
+
+EXPLAIN_PREFIX = {'sqlite': 'EXPLAIN QUERY PLAN ', 'mysql': 'EXPLAIN ', 'postgresql': 'EXPLAIN '}
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE')  # Plain EXPLAIN plans these without running them
+THIS_FILE = os.path.abspath(__file__)
+APP_DIR = os.path.dirname(THIS_FILE)
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+VALUES = re.compile(r'\bVALUES\s*(?:\((?:[^()]|\([^()]*\))*\)\s*,?\s*)+', re.IGNORECASE)
+WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Normalize away literals, placeholder lists and spacing: (fingerprint id, normalized SQL)."""
+    normalized = STRING.sub('?', sql)
+    normalized = NUMBER.sub('?', normalized).replace('%s', '?')
+    normalized = IN_LIST.sub('IN (...)', normalized)
+    normalized = VALUES.sub('VALUES (...) ', normalized)
+    normalized = WHITESPACE.sub(' ', normalized).strip()
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized
+
+
+def call_site():
+    """
+    The innermost app frame that issued the query ("booking/models.py:250 in save") and the view
+    (or job, command) it ran under: the first frame under booking/views, else the outermost app frame.
+    """
+    site = view = outermost = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        path = frame.f_code.co_filename
+        if path.startswith(APP_DIR) and path != THIS_FILE:
+            label = f"{os.path.relpath(path, settings.BASE_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}"
+            if site is None:
+                site = label
+            if view is None and f'{os.sep}views{os.sep}' in path:
+                view = label
+            outermost = label
+        frame = frame.f_back
+    return site, view or outermost
+
+
+class SlowQueryStore:
+    """
+    Slow queries aggregated by fingerprint, at most SLOW_QUERY_MAX_FINGERPRINTS of them: a new
+    fingerprint evicts the one with the least total time. Flushed to `<dir>/<host>-<pid>.json`
+    at most every SLOW_QUERY_FLUSH_SECONDS and at exit.
+    """
+
+    def __init__(self, directory, max_fingerprints, flush_seconds):
+        self.path = Path(directory) / f"{socket.gethostname()}-{os.getpid()}.json"
+        self.max_fingerprints = max_fingerprints
+        self.flush_seconds = flush_seconds
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.flushed_at = time.monotonic()
+        self.dirty = False
+
+    def add(self, alias, sql, params, elapsed_ms):
+        fid, normalized = fingerprint(sql)
+        site, view = call_site()
+        with self.lock:
+            entry = self.entries.get(fid)
+            if entry is None:
+                if len(self.entries) >= self.max_fingerprints:
+                    del self.entries[min(self.entries, key=lambda key: self.entries[key]['total_ms'])]
+                entry = self.entries[fid] = {
+                    'fingerprint': fid, 'sql': normalized, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'example': None, 'sites': Counter(), 'views': Counter(), 'plan': None,
+                }
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['last_seen'] = time.time()
+            if elapsed_ms >= entry['max_ms']:
+                entry['max_ms'] = elapsed_ms
+                entry['example'] = sql
+            entry['sites'][site] += 1
+            entry['views'][view] += 1
+            explain = entry['plan'] is None and sql.lstrip()[:6].upper() in EXPLAINABLE
+            if explain:
+                entry['plan'] = []  # Claimed: one EXPLAIN per fingerprint
+            self.dirty = True
+            due = time.monotonic() - self.flushed_at >= self.flush_seconds
+        if explain and settings.SLOW_QUERY_EXPLAIN:
+            _explainer.submit(self._explain, fid, alias, sql, params)
+        if due:
+            self.flush()
+
+    def _explain(self, fid, alias, sql, params):
+        connection = connections[alias]
+        _local.explaining = True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(EXPLAIN_PREFIX.get(connection.vendor, 'EXPLAIN ') + sql, params)
+                plan = [' | '.join('' if value is None else str(value) for value in row) for row in cursor.fetchall()]
+        except Exception as e:
+            plan = [f'EXPLAIN failed: {e}']
+        finally:
+            _local.explaining = False
+            connection.close()
+        with self.lock:
+            if fid in self.entries:
+                self.entries[fid]['plan'] = plan
+                self.dirty = True
+
+    def flush(self):
+        with self.lock:
+            self.flushed_at = time.monotonic()
+            if not self.dirty:
+                return
+            self.dirty = False
+            data = json.dumps([{**entry, 'sites': dict(entry['sites'].most_common(5)),
+                                'views': dict(entry['views'].most_common(5))} for entry in self.entries.values()])
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            tmp.write_text(data)
+            tmp.replace(self.path)
+        except OSError:
+            logger.exception("Writing slow queries failed")
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = SlowQueryStore(settings.SLOW_QUERY_DIR, settings.SLOW_QUERY_MAX_FINGERPRINTS,
+                                settings.SLOW_QUERY_FLUSH_SECONDS)
+        atexit.register(_store.flush)
+    return _store
+
+
+def capture(execute, sql, params, many, context):
+    """Execute wrapper: times every query and hands the slow ones to the store."""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms >= settings.SLOW_QUERY_THRESHOLD_MS and not getattr(_local, 'explaining', False):
+            metrics.incr('slow_queries')
+            get_store().add(context['connection'].alias, sql, params[0] if many and params else params, elapsed_ms)
+
+
+def install(sender=None, connection=None, **kwargs):
+    if capture not in connection.execute_wrappers:
+        connection.execute_wrappers.append(capture)
+
+
+def connect_signals():
+    if settings.SLOW_QUERY_ENABLED:
+        connection_created.connect(install, dispatch_uid='booking_slow_queries')
+
+
+def read_captures(directory):
+    """Merge every process's file by fingerprint."""
+    merged = {}
+    for path in sorted(Path(directory).glob('*.json')):
+        try:
+            entries = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        for entry in entries:
+            current = merged.get(entry['fingerprint'])
+            if current is None:
+                merged[entry['fingerprint']] = {**entry, 'sites': Counter(entry['sites']), 'views': Counter(entry['views'])}
+                continue
+            current['count'] += entry['count']
+            current['total_ms'] += entry['total_ms']
+            current['sites'].update(entry['sites'])
+            current['views'].update(entry['views'])
+            if entry['max_ms'] > current['max_ms']:
+                current['max_ms'], current['example'] = entry['max_ms'], entry['example']
+            current['plan'] = current['plan'] or entry['plan']
+    return list(merged.values())
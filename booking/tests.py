@@ -1,3 +1,1181 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from .models import User, City, Area, Trip, Booking, JobRun, PaymentEvent, SeatLayout, WaitlistEntry
+from .archive import archive_departed_trips
+from .autocomplete import LocationIndex, get_index
+from .inventory import check_inventory, compare, repair_inventory
+from .disruption import move_trip, plan_move
+from .jobs import JOBS, expire_pending_bookings, prune_tokens
+from .mail import MailDispatcher
+from .management.commands import warm_search_cache
+from .profiling import read_profiles
+from .reconcile import reconcile_bookings
+from .scheduler import Scheduler, start_in_background
+from .seating import pick_seats
+from .slow_queries import SlowQueryStore, fingerprint
+from .throttling import SheddingRateThrottle
+from .tokens import REVOKED_JTI_CACHE_KEY, FilteredRefreshToken, revocation_filter
+from .waitlist import match_all, match_trip
+from .views import payment
+from . import admission, metrics, payment_events, search_cache, seat_events, waitlist
 
-# Create your tests here.
+
+def create_trip(total_seats=40):
+    start = Area.objects.create(city=City.objects.create(name='Cairo'), name='Ramses')
+    destination = Area.objects.create(city=City.objects.create(name='Alexandria'), name='Sidi Gaber')
+    departure = timezone.now() + timezone.timedelta(days=1)
+    return Trip.objects.create(
+        start_location=start, destination=destination, bus_type='STANDARD',
+        departure_date=departure, arrival_date=departure + timezone.timedelta(hours=3),
+        total_seats=total_seats, price='150.00',
+    )
+
+
+def create_user(email='passenger@example.com', phone_number='01000000000', **kwargs):
+    return User.objects.create_user(username=email, email=email, phone_number=phone_number, password='secret-pass-123', **kwargs)
+
+
+def create_booking(user, trip, seats):
+    booking = Booking(user=user, trip=trip, seats_booked=len(seats), selected_seats=seats,
+                      customer_name=user.name, customer_phone=user.phone_number)
+    booking.save()
+    return booking
+
+
+# Credential endpoint throttles (booking/throttling.py)
+@patch.object(SheddingRateThrottle, 'THROTTLE_RATES', {
+    'login_ip': '100/m', 'login_account': '2/m', 'password_reset_ip': '2/h', 'password_reset_account': '100/h'})
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+
+    def login(self, email):
+        return self.client.post('/api/login/', {'email': email, 'password': 'wrong'}, content_type='application/json')
+
+    def test_login_attempts_are_limited_per_account(self):
+        self.assertEqual([self.login(self.user.email).status_code for _ in range(2)], [401, 401])
+        with self.assertNumQueries(0):  # Rejected before the view looks the user up
+            response = self.login(f' {self.user.email.upper()} ')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.login('someone.else@example.com').status_code, 401)
+        self.assertEqual(metrics.get_value('throttle_shed_login_account'), 1)
+        self.assertIsNone(metrics.get_value('throttle_shed_login_ip'))
+
+    def test_password_resets_are_limited_per_address(self):
+        url = '/api/password_reset/'
+        codes = [self.client.post(url, {'email': f'nobody{n}@example.com'}, content_type='application/json').status_code
+                 for n in range(4)]
+        self.assertNotIn(429, codes[:2])
+        self.assertEqual(codes[2:], [429, 429])
+        self.assertEqual(metrics.get_value('throttle_shed_password_reset_ip'), 2)
+
+
+# Refresh-token revocation (booking/tokens.py)
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.refresh = FilteredRefreshToken.for_user(self.user)
+        self.client = APIClient()
+        revocation_filter.rebuild()
+
+    def refresh_with(self, token):
+        return self.client.post('/api/token/refresh/', {'refresh': str(token)}, format='json')
+
+    def blacklist_elsewhere(self, token):
+        """What another process's logout leaves behind: the row, and nothing in this process."""
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=token['jti']))
+
+    def test_blacklist_from_another_process_is_seen(self):
+        self.blacklist_elsewhere(self.refresh)
+        self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
+
+    def test_shared_cache_carries_revocations_past_the_filter(self):
+        with patch('booking.tokens.shared_cache', return_value=True):
+            self.blacklist_elsewhere(self.refresh)
+            cache.set(REVOKED_JTI_CACHE_KEY.format(self.refresh['jti']), True)
+            self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
+            unrevoked = str(FilteredRefreshToken.for_user(self.user))
+            with self.assertNumQueries(0):
+                FilteredRefreshToken(unrevoked).check_blacklist()
+
+    def test_rotated_token_cannot_be_replayed(self):
+        response = self.refresh_with(self.refresh)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
+        self.assertEqual(self.refresh_with(response.json()['refresh']).status_code, 200)
+
+    def test_logged_out_token_cannot_be_refreshed(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.post('/api/logout/', {'refresh': str(self.refresh)}, format='json').status_code, 200)
+        self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
+
+    def test_prune_tokens_drops_expired_ones(self):
+        self.blacklist_elsewhere(self.refresh)
+        OutstandingToken.objects.update(expires_at=timezone.now() - timezone.timedelta(minutes=1))
+        live = FilteredRefreshToken.for_user(self.user)
+        self.assertEqual(prune_tokens(), 1)
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), [live['jti']])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+
+# Booking Detail View
+class BookingDetailViewTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.booking = create_booking(self.user, create_trip(), [1, 2])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/bookings/detail/{self.booking.id}/'
+
+    def test_query_count_is_constant(self):
+        for params in ['', '?expand=user', '?expand=user,seats', '?fields=id,status,trip']:
+            with self.assertNumQueries(1):
+                response = self.client.get(self.url + params)
+            self.assertEqual(response.status_code, 200)
+
+    def test_default_payload_keeps_full_shape(self):
+        booking = self.client.get(self.url).json()['booking']
+        self.assertEqual(booking['user']['email'], self.user.email)
+        self.assertEqual(booking['trip']['start_location'], 'Cairo, Ramses')
+        self.assertEqual(len(booking['trip']['seat_statuses']), 40)
+
+    def test_fields_are_sparse(self):
+        booking = self.client.get(self.url + '?fields=id,user,trip').json()['booking']
+        self.assertEqual(set(booking), {'id', 'user', 'trip'})
+        self.assertEqual(booking['user'], self.user.id)
+        self.assertNotIn('seat_statuses', booking['trip'])
+
+    def test_fields_and_expand(self):
+        booking = self.client.get(self.url + '?fields=id,user,trip&expand=user,seats').json()['booking']
+        self.assertEqual(set(booking), {'id', 'user', 'trip'})
+        self.assertEqual(booking['user']['email'], self.user.email)
+        self.assertEqual(len(booking['trip']['seat_statuses']), 40)
+
+    def test_other_users_booking_is_forbidden(self):
+        self.client.force_authenticate(create_user('other@example.com', '01000000001'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+# Ticket download, including bookings moved to the archive (booking/archive.py)
+class TicketDownloadTests(TestCase):
+    def setUp(self):
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+        tickets = {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': storage.name}}
+        overridden = override_settings(STORAGES={**settings.STORAGES, 'tickets': tickets})
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        self.user = create_user()
+        self.trip = create_trip()
+        self.booking = create_booking(self.user, self.trip, [1, 2])
+        Booking.objects.filter(id=self.booking.id).update(status='CONFIRMED', payment_status='PAID')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/bookings/{self.booking.id}/ticket/'
+
+    def test_archived_booking_ticket_downloads(self):
+        live = self.client.get(self.url)
+        self.assertEqual(live.status_code, 200)
+        Trip.objects.filter(id=self.trip.id).update(departure_date=timezone.now() - timezone.timedelta(days=2))
+        self.assertEqual(archive_departed_trips(days=1), 1)
+        archived = self.client.get(self.url)
+        self.assertEqual(archived.status_code, 200)
+        self.assertEqual(archived['Content-Type'], 'application/pdf')
+
+    def test_unknown_booking_is_not_found(self):
+        self.assertEqual(self.client.get(f'/api/bookings/{self.booking.id + 1}/ticket/').status_code, 404)
+
+    def test_etag_revalidation_skips_rendering(self):
+        full = self.client.get(self.url)
+        self.assertEqual(full.status_code, 200)
+        with patch('booking.views.booking.ticket_store.get_or_render') as get_or_render:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"stale", {full["ETag"]}')
+        self.assertEqual((response.status_code, response['ETag']), (304, full['ETag']))
+        get_or_render.assert_not_called()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_ranges(self):
+        content = self.client.get(self.url).content
+        size = len(content)
+        for header, status, body in [
+            ('bytes=0-99', 206, content[:100]),
+            ('bytes=100-', 206, content[100:]),
+            ('bytes=-50', 206, content[-50:]),
+            (f'bytes=10-{size + 100}', 206, content[10:]),
+            ('bytes=500-100', 200, content),  # Malformed: ignored
+            ('bytes=abc', 200, content),
+            ('bytes=0-1,5-9', 200, content),  # Multiple ranges aren't served
+        ]:
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual((response.status_code, response.content), (status, body), header)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-99').get('Content-Range'), f'bytes 0-99/{size}')
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{size}'))
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-99', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, response.content), (200, content))
+
+
+# Location name index (booking/autocomplete.py)
+class LocationIndexTests(TestCase):
+    def setUp(self):
+        self.index = LocationIndex({1: 'Minya', 2: 'Mansoura', 3: 'Alexandria', 4: 'Luxor'}, {})
+
+    def test_resolve_uses_direct_matches_only(self):
+        self.assertEqual(self.index.resolve('Minya', 'city'), [1])
+        self.assertEqual(self.index.resolve('Alex', 'city'), [3])
+        self.assertEqual(self.index.resolve('Lux', 'city'), [4])
+
+    def test_suggestions_include_spelling_variants(self):
+        self.assertEqual(self.index.search('Alex', 'city'), [('city', 3), ('city', 4)])
+
+    def test_search_by_name_sees_areas_added_by_other_processes(self):
+        trip = create_trip()
+        get_index()
+        # Inserted without signals, as this process sees an area another process added
+        Area.objects.bulk_create([Area(city=trip.start_location.city, name='Ramses Station')])
+        Trip.objects.filter(id=trip.id).update(start_location=Area.objects.get(name='Ramses Station'))
+        response = self.client.get('/api/trips/search/', {'start_city': 'Cairo', 'start_area': 'Ramses'},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual([row['id'] for row in response.json()], [trip.id])
+
+
+class ExportBookingsCommandTests(TestCase):
+    def test_writes_to_command_stdout(self):
+        user = create_user()
+        trip = create_trip()
+        create_booking(user, trip, [1, 2])
+        out = io.StringIO()
+        call_command('export_bookings', '--manifest', str(trip.id), stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        out = io.StringIO()
+        call_command('export_bookings', '--output', 'jsonl', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['customer_name'], user.name)
+
+
+# Serializer-free encoders (booking/encoders.py): the fast JSON path must produce the serializer bytes.
+# `Accept: application/json; indent=0` takes the serializer path while rendering just as compactly.
+class FastEncoderCompatibilityTests(TestCase):
+    SERIALIZER_PATH = {'HTTP_ACCEPT': 'application/json; indent=0'}
+
+    def setUp(self):
+        self.user = create_user()
+        self.trip = create_trip()
+        self.trip.start_location.name = 'رمسيس "Ramses"'
+        self.trip.start_location.save()
+        create_booking(self.user, self.trip, [1, 2])
+        second = create_trip(total_seats=12)
+        second.departure_date = timezone.now().replace(month=1, day=15) + timezone.timedelta(days=365)
+        second.price = '99.90'
+        second.save()
+        create_booking(self.user, second, [12])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertSameBytes(self, url):
+        fast = self.client.get(url)
+        slow = self.client.get(url, **self.SERIALIZER_PATH)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast['Content-Type'], 'application/json')
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_trip_search(self):
+        response = self.assertSameBytes('/api/trips/search/?include_sold_out=1')
+        self.assertEqual(len(response.json()), 2)
+
+    def test_profile_booking_list(self):
+        self.assertSameBytes('/api/profile/?limit=10')
+        self.assertSameBytes('/api/profile/?limit=1&page=2')
+
+    def test_profile_includes_archived_bookings(self):
+        from .archive import archive_departed_trips
+        Trip.objects.filter(id=self.trip.id).update(departure_date=timezone.now() - timezone.timedelta(days=90))
+        archive_departed_trips(days=30)
+        response = self.assertSameBytes('/api/profile/?limit=10')
+        self.assertEqual(response.json()['pagination']['total'], 2)
+
+    def test_seat_map(self):
+        self.assertSameBytes(f'/api/trips/{self.trip.id}/book/')
+        self.assertSameBytes(f'/api/trips/{self.trip.id}/book/?expand=seat_status')
+        self.trip.layout.labels = [f'A{n}' for n in range(1, 41)]
+        self.trip.layout.save()
+        cache.clear()
+        self.assertSameBytes(f'/api/trips/{self.trip.id}/book/')
+
+
+# Trip search result cache (booking/search_cache.py)
+@override_settings(WAITLIST_MATCH_ASYNC=False)
+class SearchCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.trip = create_trip(total_seats=10)
+        self.url = (f'/api/trips/search/?start_city={self.trip.start_location.city_id}'
+                    f'&destination_city={self.trip.destination.city_id}'
+                    f'&departure_date={timezone.localdate(self.trip.departure_date).isoformat()}')
+
+    def available(self):
+        return self.client.get(self.url, HTTP_ACCEPT='application/json').json()[0]['available_seats']
+
+    def test_off_with_a_per_process_cache(self):
+        self.assertFalse(search_cache.enabled())
+        self.available()
+        self.assertIsNone(metrics.get_value('search_cache_misses'))
+        with self.assertRaises(CommandError):
+            call_command(warm_search_cache.Command(), stdout=io.StringIO())
+
+    def test_booking_invalidates_cached_search(self):
+        with patch('booking.search_cache.shared_cache', return_value=True):
+            self.assertEqual(self.available(), 10)
+            self.assertEqual(self.available(), 10)
+            self.assertEqual(metrics.get_value('search_cache_hits'), 1)
+            with self.captureOnCommitCallbacks(execute=True):
+                create_booking(create_user(), self.trip, [1, 2])
+            self.assertEqual(self.available(), 8)
+
+
+# Sampling profiler output (booking/profiling.py)
+class ProfileReadingTests(TestCase):
+    def test_profiles_merge_across_hosts_with_dotted_names(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for process, count in [('ip-10-0-0-1.ec2.internal-41', 3), ('web-2', 4)]:
+                with open(f'{directory}/trip_search.{process}.collapsed', 'w') as f:
+                    f.write(f'get (booking/views/trip.py:10);search (booking/views/trip.py:40) {count}\n')
+            profiles = read_profiles(directory)
+            self.assertEqual(set(profiles), {'trip_search'})
+            self.assertEqual(sum(profiles['trip_search'].values()), 7)
+            self.assertEqual(read_profiles(directory, 'trip_search'), profiles)
+
+
+# Slow-query capture (booking/slow_queries.py)
+@override_settings(SLOW_QUERY_EXPLAIN=False)
+class SlowQueryTests(TestCase):
+    def test_fingerprint_ignores_literals_lists_and_spacing(self):
+        fid, normalized = fingerprint("SELECT *  FROM trip WHERE id IN (%s, %s, %s) AND price > 150.5 AND name = 'O''Hara'")
+        self.assertEqual(normalized, 'SELECT * FROM trip WHERE id IN (...) AND price > ? AND name = ?')
+        self.assertEqual(fingerprint("SELECT * FROM trip\nWHERE id IN (%s) AND price > 7 AND name = 'x'")[0], fid)
+        self.assertEqual(fingerprint('INSERT INTO seat VALUES (1, 2), (3, 4)')[1], 'INSERT INTO seat VALUES (...)')
+        self.assertNotEqual(fingerprint('SELECT * FROM booking WHERE id = 1')[0], fid)
+
+    def test_store_evicts_the_cheapest_fingerprint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SlowQueryStore(directory, max_fingerprints=2, flush_seconds=3600)
+            store.add('default', 'SELECT * FROM trip WHERE id = 1', (), 500)
+            store.add('default', 'SELECT * FROM booking WHERE id = 1', (), 300)
+            store.add('default', 'SELECT * FROM booking WHERE id = 2', (), 300)  # Same fingerprint: now 600 ms
+            store.add('default', 'SELECT * FROM area WHERE id = 1', (), 250)
+            self.assertEqual(sorted(entry['sql'] for entry in store.entries.values()),
+                             ['SELECT * FROM area WHERE id = ?', 'SELECT * FROM booking WHERE id = ?'])
+            booking = store.entries[fingerprint('SELECT * FROM booking WHERE id = 1')[0]]
+            self.assertEqual((booking['count'], booking['total_ms']), (2, 600))
+            self.assertTrue(next(iter(booking['sites'])).startswith('booking/tests.py:'))
+
+    def test_command_ranks_captures_of_all_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, queries in [('web-1', [('SELECT * FROM trip WHERE id = 1', 100)] * 3),
+                                  ('web-2', [('SELECT * FROM trip WHERE id = 9', 100), ('SELECT * FROM area', 350)])]:
+                store = SlowQueryStore(directory, max_fingerprints=10, flush_seconds=3600)
+                store.path = store.path.with_name(f'{name}.json')
+                for sql, elapsed_ms in queries:
+                    store.add('default', sql, (), elapsed_ms)
+                store.flush()
+            out = io.StringIO()
+            call_command('slow_queries', dir=directory, top=1, clear=True, stdout=out)
+            self.assertIn('total 400 ms  max 100.0 ms  calls 4', out.getvalue())
+            self.assertNotIn('FROM area', out.getvalue())
+            out = io.StringIO()
+            call_command('slow_queries', dir=directory, stdout=out)
+            self.assertIn('No slow queries captured', out.getvalue())
+
+
+# Shared seat layouts and the occupancy bitmap
+class SeatLayoutTests(TestCase):
+    def test_book_and_release_on_the_bitmap(self):
+        trip = create_trip(total_seats=12)
+        trip.book_seats([1, 9, '12'])
+        self.assertEqual(trip.unavailable_seats, [1, 9, 12])
+        self.assertEqual(len(bytes(trip.occupancy)), 2)
+        for seat in (1, 13, 'A'):
+            with self.subTest(seat=seat), self.assertRaises(ValidationError):
+                trip.book_seats([seat])
+        trip.release_seats([9, 12])
+        trip.save()
+        trip.refresh_from_db()
+        self.assertEqual(trip.unavailable_seats, [1])
+        self.assertFalse(trip.is_seat_available(1))
+        self.assertTrue(trip.is_seat_available(12))
+
+    def test_total_seats_cannot_drop_below_a_booked_seat(self):
+        trip = create_trip(total_seats=12)
+        trip.book_seats([11])
+        trip.save()
+        trip.total_seats = 10
+        trip.available_seats = 10
+        with self.assertRaises(ValidationError):
+            trip.save()
+        trip.release_seats([11])  # Used to raise OverflowError
+        trip.save()
+        self.assertEqual(Trip.objects.get(id=trip.id).layout.seat_count, 10)
+
+    def test_layout_in_use_cannot_be_resized(self):
+        admin_user = create_user('admin@example.com', '01000000009', is_staff=True, is_superuser=True)
+        layout = create_trip(total_seats=12).layout
+        self.client.force_login(admin_user)
+        response = self.client.get(f'/admin/booking/seatlayout/{layout.id}/change/')
+        self.assertNotIn('seat_count', response.context['adminform'].form.fields)
+        unused = SeatLayout.objects.create(bus_type='VIP', seat_count=20)
+        response = self.client.get(f'/admin/booking/seatlayout/{unused.id}/change/')
+        self.assertIn('seat_count', response.context['adminform'].form.fields)
+
+    def test_seat_map_sends_seat_status_on_request(self):
+        trip = create_trip(total_seats=4)
+        create_booking(create_user(), trip, [2])
+        client = APIClient()
+        client.force_authenticate(User.objects.get())
+        seat_map = client.get(f'/api/trips/{trip.id}/book/').json()
+        self.assertNotIn('seat_status', seat_map)
+        self.assertEqual(seat_map['unavailable_seats'], ['2'])
+        seat_map = client.get(f'/api/trips/{trip.id}/book/?expand=seat_status').json()
+        self.assertEqual(seat_map['seat_status'], {'1': 'available', '2': 'booked', '3': 'available', '4': 'available'})
+        self.assertEqual(seat_map['unavailable_seats'], ['2'])
+
+
+class SeatLayoutMigrationTests(TransactionTestCase):
+    def test_seats_fold_into_layouts_and_back(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('booking', '0001_initial')])
+        apps = executor.loader.project_state([('booking', '0001_initial')]).apps
+        City, Area, Trip = (apps.get_model('booking', name) for name in ('City', 'Area', 'Trip'))
+        start = Area.objects.create(city=City.objects.create(name='Cairo'), name='Ramses')
+        destination = Area.objects.create(city=City.objects.create(name='Alexandria'), name='Sidi Gaber')
+        common = {'start_location': start, 'destination': destination, 'price': '10', 'available_seats': 8}
+        first = Trip.objects.create(bus_type='STANDARD', total_seats=10, seats={'1': 'booked', '10': 'booked', '3': 'available'}, **common)
+        second = Trip.objects.create(bus_type='STANDARD', total_seats=10, seats={}, **common)
+        third = Trip.objects.create(bus_type='VIP', total_seats=12, seats={'12': 'booked', '13': 'booked'}, **common)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate([('booking', '0002_seat_layouts')])
+        apps = executor.loader.project_state([('booking', '0002_seat_layouts')]).apps
+        Trip, SeatLayout = apps.get_model('booking', 'Trip'), apps.get_model('booking', 'SeatLayout')
+        trips = {trip.id: trip for trip in Trip.objects.all()}
+        self.assertEqual(SeatLayout.objects.count(), 2)
+        self.assertEqual(trips[first.id].layout_id, trips[second.id].layout_id)
+        self.assertEqual(int.from_bytes(bytes(trips[first.id].occupancy), 'little'), 0b1000000001)
+        self.assertEqual(int.from_bytes(bytes(trips[second.id].occupancy), 'little'), 0)
+        self.assertEqual(int.from_bytes(bytes(trips[third.id].occupancy), 'little'), 1 << 11)  # Seat 13 doesn't exist
+
+        executor = MigrationExecutor(connection)
+        executor.migrate([('booking', '0001_initial')])
+        Trip = executor.loader.project_state([('booking', '0001_initial')]).apps.get_model('booking', 'Trip')
+        self.assertEqual(Trip.objects.get(id=first.id).seats['10'], 'booked')
+        self.assertEqual(Trip.objects.get(id=first.id).seats['3'], 'available')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+
+# Waitlist matching (booking/waitlist.py)
+@override_settings(WAITLIST_MATCH_ASYNC=False, MAIL_DISPATCH_ASYNC=False)
+class WaitlistMatchingTests(TestCase):
+    def setUp(self):
+        self.trip = create_trip(total_seats=4)
+        self.holder = create_user()
+        self.bookings = [create_booking(self.holder, self.trip, [1, 2]), create_booking(self.holder, self.trip, [3, 4])]
+        self.users = [create_user(f'wait{n}@example.com', f'0100000001{n}') for n in range(3)]
+
+    def join(self, user, seats):
+        return WaitlistEntry.objects.create(trip=self.trip, user=user, seats_requested=seats)
+
+    def test_offers_in_order_and_skips_requests_that_dont_fit(self):
+        first, big, small = self.join(self.users[0], 1), self.join(self.users[1], 3), self.join(self.users[2], 1)
+        self.assertEqual(match_trip(self.trip.id), 0)  # Sold out
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bookings[0].cancel()
+        statuses = dict(WaitlistEntry.objects.values_list('id', 'status'))
+        self.assertEqual((statuses[first.id], statuses[big.id], statuses[small.id]), ('OFFERED', 'WAITING', 'OFFERED'))
+        first.refresh_from_db()
+        self.assertEqual(first.booking.status, 'PENDING')
+        self.assertEqual(len(first.booking.selected_seats), 1)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.available_seats, 0)
+
+    def test_lapsed_offer_goes_back_to_the_queue(self):
+        first, second = self.join(self.users[0], 2), self.join(self.users[1], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bookings[0].cancel()
+        third = self.join(self.users[2], 3)
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'OFFERED')
+        offered = first.booking
+        Booking.objects.filter(id=offered.id).update(expires_at=timezone.now() - timezone.timedelta(minutes=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.cancel_pending(self.trip.id, [offered.id])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status, first.booking), ('WAITING', None))
+        self.assertEqual(second.status, 'OFFERED')  # The freed seats went to the next user
+        self.assertEqual(sorted(second.booking.selected_seats), sorted(offered.selected_seats))
+        self.assertEqual((waitlist.position(third), waitlist.position(first)), (1, 2))
+
+    def test_trips_that_no_longer_run_are_closed(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        url = f'/api/trips/{self.trip.id}/waitlist/'
+        self.assertEqual(client.post(url, {'seats': 1}, format='json').status_code, 201)
+        client.delete(url)
+        for update in [{'cancelled_at': timezone.now()}, {'cancelled_at': None, 'departure_date': timezone.now()}]:
+            Trip.objects.filter(id=self.trip.id).update(**update)
+            response = client.post(url, {'seats': 1}, format='json')
+            self.assertEqual((response.status_code, response.json()['error']), (400, 'This trip is no longer running'))
+
+    def test_sweep_skips_cancelled_trips(self):
+        self.join(self.users[0], 1)
+        Trip.objects.filter(id=self.trip.id).update(available_seats=1, cancelled_at=timezone.now())
+        with patch('booking.waitlist.match_trip') as match:
+            self.assertEqual(match_all(), 0)
+        match.assert_not_called()
+        Trip.objects.filter(id=self.trip.id).update(cancelled_at=None)
+        with patch('booking.waitlist.match_trip', return_value=1) as match:
+            self.assertEqual(match_all(), 1)
+        match.assert_called_once_with(self.trip.id)
+
+
+# Outbound mail dispatcher (booking/mail.py) over the locmem backend
+class FlakyBackend(LocmemBackend):
+    """Fails every send to an address in `failing`, and the next `flaky` sends to anyone else."""
+    failing = ()
+    flaky = 0
+
+    def send_messages(self, messages):
+        if any(address in FlakyBackend.failing for message in messages for address in message.to):
+            raise ConnectionError('mailbox unavailable')
+        if FlakyBackend.flaky:
+            FlakyBackend.flaky -= 1
+            raise ConnectionError('connection reset')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='booking.tests.FlakyBackend', MAIL_DISPATCH_WORKERS=1, MAIL_DISPATCH_BATCH_SIZE=50,
+                   MAIL_DISPATCH_MAX_RETRIES=3, MAIL_DISPATCH_RETRY_DELAY=0, MAIL_DISPATCH_RATE=0)
+class MailDispatcherTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        FlakyBackend.failing, FlakyBackend.flaky = (), 0
+        self.dispatcher = MailDispatcher()
+
+    def message(self, *to):
+        return EmailMessage(subject='Trip update', body='Your trip has moved', from_email='ops@example.com', to=list(to))
+
+    def test_fan_out_is_split_per_recipient_and_batched_over_one_connection(self):
+        self.dispatcher.enqueue(self.message(*[f'passenger{n}@example.com' for n in range(5)]))
+        self.dispatcher.flush()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [f'passenger{n}@example.com' for n in range(5)])
+        self.assertTrue(all(len(message.to) == 1 for message in mail.outbox))
+        self.assertEqual(len({id(message.connection) for message in mail.outbox}), 1)
+        self.assertEqual((metrics.get_value('mail_queued'), metrics.get_value('mail_sent')), (5, 5))
+        self.assertEqual(metrics.get_value('mail_queue_depth'), 0)
+
+    @override_settings(MAIL_DISPATCH_RATE=20)
+    def test_sends_are_paced(self):
+        start = time.monotonic()
+        self.dispatcher.enqueue(self.message(*[f'passenger{n}@example.com' for n in range(5)]))
+        self.dispatcher.flush()
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertGreaterEqual(time.monotonic() - start, 4 / 20)
+
+    @override_settings(MAIL_DISPATCH_ASYNC=False)
+    def test_a_failing_recipient_is_retried_on_its_own(self):
+        FlakyBackend.failing, FlakyBackend.flaky = ('bounce@example.com',), 1
+        with self.assertLogs('booking.mail', 'ERROR') as logs:
+            self.dispatcher.enqueue(self.message('first@example.com', 'bounce@example.com', 'last@example.com'))
+        self.assertEqual([message.to for message in mail.outbox], [['first@example.com'], ['last@example.com']])
+        self.assertIn('bounce@example.com', logs.output[0])
+        self.assertEqual(metrics.get_value('mail_sent'), 2)
+        self.assertEqual(metrics.get_value('mail_failed'), 1)
+        self.assertEqual(metrics.get_value('mail_retries'), 1 + 2)  # first@ once, bounce@ before giving up
+
+
+# Best-available seat selection (booking/seating.py)
+class SeatPickingTests(TestCase):
+    FREE = (1 << 40) - 1  # Empty 40-seat coach: rows 0-9 of four seats
+
+    def test_front_preference_changes_the_pick(self):
+        self.assertEqual(pick_seats(self.FREE, 40, 2, front=True), [1, 2])
+        self.assertEqual(pick_seats(self.FREE, 40, 2), [17, 18])  # Middle of the coach
+        self.assertEqual(pick_seats(self.FREE, 40, 1, window=True, front=True), [1])
+        alternate = int('01' * 20, 2)  # Only odd seats free: no block of three
+        self.assertEqual(pick_seats(alternate, 40, 3, front=True), [1, 3, 5])
+        self.assertEqual(pick_seats(alternate, 40, 3), [17, 19, 21])
+
+    def test_invalid_preferences_are_rejected(self):
+        user = create_user()
+        trip = create_trip()
+        client = APIClient()
+        client.force_authenticate(user)
+        for body in ({'seat_count': 2, 'preferences': ['window']}, {'seat_count': 'two'}, {'seat_count': -1, 'preferences': {}}):
+            with self.subTest(body=body), override_settings(ADMISSION_CONCURRENCY=0):
+                response = client.post(f'/api/trips/{trip.id}/book/', body, format='json')
+                self.assertEqual(response.status_code, 400)
+
+
+# Live seat stream (booking/seat_events.py)
+@override_settings(ADMISSION_CONCURRENCY=0)
+class SeatStreamTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.trip = create_trip(total_seats=12)
+
+    async def test_stream_requires_authentication(self):
+        url = f'/api/trips/{self.trip.id}/seats/stream/'
+        self.assertEqual((await self.async_client.get(url)).status_code, 401)
+        self.assertEqual((await self.async_client.get(url + '?token=invalid')).status_code, 401)
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.user).access_token))()
+        response = await self.async_client.get(f'{url}?token={token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+    def test_stream_is_refused_under_wsgi(self):
+        url = f'/api/trips/{self.trip.id}/seats/stream/?token={RefreshToken.for_user(self.user).access_token}'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 501)
+        self.assertFalse(response.streaming)
+
+    def test_lapsed_holds_are_released(self):
+        version = seat_events.current_version(self.trip.id)
+        seat_events.hold(self.trip.id, 'first', [1, 2], 600)
+        seat_events.hold(self.trip.id, 'second', [2, 3], 900)
+        create_booking(self.user, self.trip, [1])
+        self.assertEqual(seat_events.release_lapsed_holds(now=time.monotonic() + 700), 0)  # 1 booked, 2 still held
+        seat_events.end_hold('second')
+        self.assertEqual(seat_events.release_lapsed_holds(), 2)
+        changes = [(event['change'], event['seats']) for event in seat_events.events_since(self.trip.id, version)]
+        self.assertEqual(changes[-1], ('released', ['2', '3']))
+
+
+# Seat inventory check and repair (booking/inventory.py)
+@override_settings(WAITLIST_MATCH_ASYNC=False)
+class InventoryTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+
+    def drifted(self, seats=(), occupied=(), available=None):
+        trip = create_trip(total_seats=10)
+        if seats:
+            create_booking(self.user, trip, list(seats))
+        bitmap = sum(1 << (seat - 1) for seat in occupied)
+        Trip.objects.filter(id=trip.id).update(occupancy=bitmap.to_bytes(2, 'little'),
+                                               available_seats=10 - len(seats) if available is None else available)
+        return trip
+
+    def test_compare(self):
+        self.assertIsNone(compare(1, 4, 2, bytes([0b0011]), [(2, [1, 2])]))
+        drift = compare(1, 4, 4, bytes([0b1001]), [(1, [1]), (2, [2, 2])])
+        self.assertEqual((drift['missing'], drift['stray'], drift['conflicts']), ([2], [4], [2]))
+        self.assertEqual(drift['expected_available_seats'], 1)
+        self.assertEqual(compare(1, 4, 3, b'', [(1, [9])])['invalid'], [9])
+
+    def test_check_and_repair(self):
+        clean = self.drifted(seats=[1, 2], occupied=[1, 2])
+        missing = self.drifted(seats=[1, 2], occupied=[1], available=9)
+        stray = self.drifted(occupied=[5])
+        conflict = self.drifted(seats=[3], occupied=[3])
+        second = create_booking(self.user, conflict, [4])
+        Booking.objects.filter(id=second.id).update(selected_seats=[3])
+        Trip.objects.filter(id=conflict.id).update(occupancy=bytes([0b100, 0]), available_seats=8)
+
+        drift = {result['trip_id']: result for result in check_inventory(chunk_size=2)}
+        self.assertNotIn(clean.id, drift)
+        self.assertEqual(drift[missing.id]['missing'], [2])
+        self.assertEqual(drift[stray.id]['stray'], [5])
+        self.assertEqual(drift[conflict.id]['conflicts'], [3])
+
+        with self.assertLogs('booking.inventory', 'WARNING') as logs, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(repair_inventory(drift), 2)
+        self.assertTrue(any('double-booked seats [3]' in line for line in logs.output))
+        for trip, seats, available in [(missing, [1, 2], 8), (stray, [], 10), (conflict, [3], 8)]:
+            trip.refresh_from_db()
+            self.assertEqual((trip.unavailable_seats, trip.available_seats), (seats, available))
+        self.assertEqual([result['trip_id'] for result in check_inventory()], [conflict.id])
+
+    def test_admin_bulk_delete_releases_seats(self):
+        trip = create_trip(total_seats=10)
+        bookings = [create_booking(self.user, trip, [1, 2]), create_booking(self.user, trip, [3])]
+        bookings[1].cancel()
+        with self.captureOnCommitCallbacks(execute=True):
+            admin.site._registry[Booking].delete_queryset(None, Booking.objects.filter(trip=trip))
+        trip.refresh_from_db()
+        self.assertEqual((trip.unavailable_seats, trip.available_seats), ([], 10))
+        self.assertFalse(Booking.objects.filter(trip=trip).exists())
+        self.assertEqual(check_inventory(), [])
+
+
+# Moving the bookings of a disrupted trip (booking/disruption.py)
+@override_settings(WAITLIST_MATCH_ASYNC=False)
+class TripMoveTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.source, self.target = create_trip(total_seats=12), create_trip(total_seats=12)
+
+    def test_plan_places_mapped_same_number_then_together(self):
+        create_booking(self.user, self.target, [1, 2, 3])
+        mapped, kept, party = (create_booking(self.user, self.source, seats) for seats in ([5], [9], [1, 2]))
+        self.target.refresh_from_db()
+        plan = plan_move([mapped, kept, party], self.target, seat_map={'5': 12})
+        self.assertEqual((plan[mapped.id], plan[kept.id]), ([12], [9]))
+        first, second = sorted(plan[party.id])
+        seats_per_row = self.target.layout.seats_per_row
+        self.assertEqual((second - first, (first - 1) // seats_per_row), (1, (second - 1) // seats_per_row))
+
+    def test_move_is_all_or_nothing(self):
+        create_booking(self.user, self.target, list(range(1, 11)))
+        bookings = [create_booking(self.user, self.source, [1, 2]), create_booking(self.user, self.source, [3])]
+        with self.assertRaises(ValidationError):
+            move_trip(self.source.id, self.target.id, notify=False)
+        with self.assertRaises(ValidationError):
+            move_trip(self.source.id, self.target.id, seat_map={'1': 5}, notify=False)
+        self.assertEqual(set(Booking.objects.filter(id__in=[b.id for b in bookings]).values_list('trip_id', flat=True)),
+                         {self.source.id})
+        self.source.refresh_from_db()
+        self.target.refresh_from_db()
+        self.assertEqual((self.source.unavailable_seats, self.source.cancelled_at), ([1, 2, 3], None))
+        self.assertEqual(self.target.unavailable_seats, list(range(1, 11)))
+
+    def test_move_refuses_a_different_fare(self):
+        create_booking(self.user, self.source, [1])
+        Trip.objects.filter(id=self.target.id).update(price='180.00')
+        with self.assertRaisesMessage(ValidationError, 'costs 180.00'):
+            move_trip(self.source.id, self.target.id, notify=False)
+
+    def test_keep_open_false_string_closes_the_trip(self):
+        booking = create_booking(self.user, self.source, [4])
+        client = APIClient()
+        client.force_authenticate(create_user('admin@example.com', '01000000009', is_staff=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f'/api/trips/{self.source.id}/disruption/', {
+                'action': 'move', 'target_trip_id': self.target.id, 'keep_open': 'false', 'notify': 'false'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['moved'], {str(booking.id): [4]})
+        self.source.refresh_from_db()
+        self.assertIsNotNone(self.source.cancelled_at)
+
+
+# Admin changelists of the big tables (booking/admin.py)
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_login(create_user('admin@example.com', '01000000009', is_staff=True, is_superuser=True))
+
+    def add_rows(self, count):
+        for n in range(count):
+            user = create_user(f'user{n}-{Booking.objects.count()}@example.com', f'011{Booking.objects.count():08d}')
+            trip = create_trip(total_seats=10)
+            booking = create_booking(user, trip, [1])
+            WaitlistEntry.objects.create(trip=trip, user=user, seats_requested=1, status='OFFERED', booking=booking)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        urls = ['/admin/booking/booking/', '/admin/booking/trip/', '/admin/booking/waitlistentry/']
+        self.add_rows(3)
+        counts = {}
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            counts[url] = len(queries)
+        self.add_rows(17)
+        for url in urls:
+            with self.subTest(url=url), self.assertNumQueries(counts[url]):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_identifier_like_terms_also_match_names_and_emails(self):
+        user = create_user('ali99@gmail.com', '01000000001')
+        booking = create_booking(user, create_trip(), [1])
+        Booking.objects.filter(id=booking.id).update(payment_reference='ali99')
+        other = create_booking(create_user('ahmed2@example.com', '01000000002'), create_trip(), [1])
+        for term, expected in [('ali99@gmail.com', booking), ('ali99', booking), ('ahmed2', other),
+                               (str(other.id), other), ('01000000001', booking)]:
+            with self.subTest(term=term):
+                response = self.client.get('/admin/booking/booking/', {'q': term})
+                self.assertEqual([row.id for row in response.context['cl'].result_list], [expected.id])
+
+
+# Per-trip admission control of the booking path (booking/admission.py)
+@override_settings(ADMISSION_CONCURRENCY=1, ADMISSION_STALL_SECONDS=60)
+class AdmissionTests(TestCase):
+    trip_id = 7
+
+    def setUp(self):
+        cache.clear()
+        shared = patch.object(admission, 'shared_cache', return_value=True)
+        shared.start()
+        self.addCleanup(shared.stop)
+
+    def test_queue_is_served_in_ticket_order(self):
+        first = admission.admit(self.trip_id)
+        self.assertTrue(first.admitted)
+        queued = [admission.admit(self.trip_id) for _ in range(2)]
+        self.assertEqual([(entry.admitted, entry.ticket, entry.position) for entry in queued], [(False, 1, 1), (False, 2, 2)])
+        self.assertFalse(admission.admit(self.trip_id, 2).admitted)  # Not called yet
+        admission.release(first)
+        self.assertEqual(admission.status(self.trip_id, 2)['position'], 1)
+        second = admission.admit(self.trip_id, 1)
+        self.assertTrue(second.admitted)
+        admission.release(second)
+        self.assertTrue(admission.status(self.trip_id, 2)['ready'])
+
+    def test_ticket_is_used_once(self):
+        first = admission.admit(self.trip_id)
+        ticket, _ = admission.admit(self.trip_id).ticket, admission.admit(self.trip_id)
+        admission.release(first)
+        served = admission.admit(self.trip_id, ticket)
+        self.assertTrue(served.admitted)
+        self.assertEqual(admission.admit(self.trip_id).ticket, 3)
+        admission.release(served)
+        # Ticket 3 is still waiting: replaying ticket 1 queues behind it like a new arrival
+        replay = admission.admit(self.trip_id, ticket)
+        self.assertEqual((replay.admitted, replay.ticket), (False, 4))
+
+    @override_settings(ADMISSION_STALL_SECONDS=0)
+    def test_abandoned_queue_is_called_at_once(self):
+        first = admission.admit(self.trip_id)
+        abandoned = [admission.admit(self.trip_id).ticket for _ in range(50)]
+        self.assertEqual(abandoned[-1], 50)
+        admission.release(first)
+        late = admission.admit(self.trip_id)  # Nobody holds a slot and the queue has stalled
+        self.assertEqual((late.admitted, late.ticket, late.position), (False, 51, 0))
+        self.assertTrue(admission.admit(self.trip_id, late.ticket).admitted)
+
+    def test_release_ignores_a_lease_taken_over(self):
+        first = admission.admit(self.trip_id)
+        cache.set(admission.SLOT_KEY.format(self.trip_id, first.slot), 'someone-else')
+        admission.release(first)
+        self.assertEqual(cache.get(admission.SLOT_KEY.format(self.trip_id, first.slot)), 'someone-else')
+
+    def test_off_on_a_per_process_cache(self):
+        with patch.object(admission, 'shared_cache', return_value=False):
+            entries = [admission.admit(self.trip_id) for _ in range(3)]
+        self.assertTrue(all(entry.admitted and entry.lease is None for entry in entries))
+
+
+# Pending-booking expiry (booking/jobs.py)
+@override_settings(WAITLIST_MATCH_ASYNC=False)
+class PendingExpiryTests(TestCase):
+    def test_one_failing_trip_does_not_stop_the_others(self):
+        user = create_user()
+        broken, healthy = create_trip(total_seats=10), create_trip(total_seats=10)
+        for trip in (broken, healthy):
+            create_booking(user, trip, [1, 2])
+        Booking.objects.update(expires_at=timezone.now() - timezone.timedelta(minutes=1))
+        cancel_pending = Booking.cancel_pending.__func__
+
+        def fail_on_broken(cls, trip_id, *args, **kwargs):
+            if trip_id == broken.id:
+                raise ValidationError('bad trip')
+            return cancel_pending(cls, trip_id, *args, **kwargs)
+
+        with patch.object(Booking, 'cancel_pending', classmethod(fail_on_broken)), self.assertLogs('booking.jobs', 'ERROR'):
+            self.assertEqual(expire_pending_bookings(batch_size=1), 1)
+        statuses = dict(Booking.objects.values_list('trip_id', 'status'))
+        self.assertEqual((statuses[broken.id], statuses[healthy.id]), ('PENDING', 'CANCELLED'))
+
+
+# Maintenance scheduler (booking/scheduler.py)
+@override_settings(SCHEDULER_LEADER_LOCK='cache', SCHEDULER_JOB_INTERVALS={'nightly': 86400, 'often': 5})
+class SchedulerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.runs = []
+        jobs = patch.dict(JOBS, {'nightly': lambda: self.runs.append('nightly'), 'often': lambda: self.runs.append('often')})
+        jobs.start()
+        self.addCleanup(jobs.stop)
+
+    def test_new_leader_keeps_the_schedule(self):
+        JobRun.objects.create(name='nightly', last_run_at=timezone.now() - timezone.timedelta(hours=2))
+        scheduler = Scheduler(jobs=['nightly', 'often'])
+        scheduler.step()
+        self.assertEqual(self.runs, ['often'])
+        self.assertTrue(JobRun.objects.filter(name='often').exists())
+        scheduler.lock.release()
+        JobRun.objects.filter(name='nightly').update(last_run_at=timezone.now() - timezone.timedelta(days=2))
+        Scheduler(jobs=['nightly', 'often']).step()  # Took over from the first one
+        self.assertEqual(self.runs, ['often', 'nightly'])
+
+    def test_only_started_when_enabled(self):
+        with patch('booking.scheduler.threading.Thread') as thread:
+            self.assertIsNone(start_in_background())
+        thread.assert_not_called()
+
+
+class GatewayStub(BaseHTTPRequestHandler):
+    """Local stand-in for the Paymob transaction inquiry endpoint: answers from `orders` by order id."""
+    orders = {}
+    asked = []
+
+    def do_POST(self):
+        order_id = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['order_id']
+        self.asked.append(order_id)
+        answer = self.orders.get(order_id)
+        body = json.dumps(answer or {'detail': 'not found'}).encode()
+        self.send_response(200 if answer else 404)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# Payment reconciliation (booking/reconcile.py) against a local gateway stub
+@override_settings(RECONCILE_AFTER_MINUTES=3, RECONCILE_WORKERS=4, WAITLIST_MATCH_ASYNC=False)
+class PaymentReconciliationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), GatewayStub)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.inquiry_url = patch.object(payment, 'PAYMOB_INQUIRY_URL', f'http://127.0.0.1:{cls.server.server_port}/inquiry')
+        cls.inquiry_url.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.inquiry_url.stop()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        cache.set('paymob_auth_token', 'test-token')
+        self.user = create_user()
+        self.trip = create_trip(total_seats=10)
+        GatewayStub.orders = {}
+        GatewayStub.asked = []
+
+    def stuck_booking(self, seats, order_id, answer=None, minutes_ago=10):
+        booking = create_booking(self.user, self.trip, seats)
+        Booking.objects.filter(id=booking.id).update(
+            payment_order_id=order_id, booking_date=timezone.now() - timezone.timedelta(minutes=minutes_ago))
+        if answer is not None:
+            GatewayStub.orders[order_id] = answer
+        return booking
+
+    def test_applies_gateway_outcomes(self):
+        paid = self.stuck_booking([1, 2], '101', {'id': 9001, 'success': True, 'pending': False})
+        failed = self.stuck_booking([3], '102', {'id': 9002, 'success': False, 'pending': False})
+        pending = self.stuck_booking([4], '103', {'id': 9003, 'success': False, 'pending': True})
+        unknown = self.stuck_booking([5], '104')
+        recent = self.stuck_booking([6], '105', {'id': 9005, 'success': True, 'pending': False}, minutes_ago=1)
+
+        with patch('booking.reconcile.send_ticket_email') as send_ticket, self.captureOnCommitCallbacks(execute=True):
+            result = reconcile_bookings()
+
+        self.assertEqual((result['confirmed'], result['cancelled'], result['errors']), (1, 1, 0))
+        self.assertCountEqual(result['unresolved'], [pending.id, unknown.id])
+        statuses = dict(Booking.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[paid.id], 'CONFIRMED')
+        self.assertEqual(statuses[failed.id], 'CANCELLED')
+        self.assertEqual(statuses[pending.id], 'PENDING')
+        self.assertEqual(statuses[recent.id], 'PENDING')
+        self.assertEqual(Booking.objects.get(id=paid.id).payment_reference, '9001')
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.unavailable_seats, [1, 2, 4, 5, 6])
+        self.assertEqual(send_ticket.call_count, 1)
+
+    def test_update_is_conditional(self):
+        booking = self.stuck_booking([1], '201', {'id': 9101, 'success': True, 'pending': False})
+        booking.cancel()
+        with patch('booking.reconcile.send_ticket_email') as send_ticket:
+            result = reconcile_bookings(Booking.objects.filter(id=booking.id))
+        self.assertEqual(result['confirmed'], 0)
+        self.assertEqual(Booking.objects.get(id=booking.id).status, 'CANCELLED')
+        send_ticket.assert_not_called()
+
+    def test_expiry_holds_back_payments_in_progress(self):
+        paid = self.stuck_booking([1], '301', {'id': 9201, 'success': True, 'pending': False})
+        unpaid = self.stuck_booking([2], '302', {'id': 9202, 'success': False, 'pending': False})
+        paying = self.stuck_booking([3], '303', {'id': 9203, 'success': False, 'pending': True})
+        abandoned = self.stuck_booking([4], '304')
+        with patch('booking.reconcile.send_ticket_email'):
+            reconcile_bookings()
+        Booking.objects.update(expires_at=timezone.now() - timezone.timedelta(minutes=1))
+        expire_pending_bookings()
+        statuses = dict(Booking.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[booking.id] for booking in (paid, unpaid, paying, abandoned)],
+                         ['CONFIRMED', 'CANCELLED', 'PENDING', 'CANCELLED'])
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.unavailable_seats, [1, 3])
+
+    def test_expiry_never_calls_the_gateway(self):
+        self.stuck_booking([1], '501', {'id': 9401, 'success': False, 'pending': True})
+        Booking.objects.update(expires_at=timezone.now() - timezone.timedelta(minutes=1))
+        self.assertEqual(expire_pending_bookings(), 1)
+        self.assertEqual(GatewayStub.asked, [])
+
+    def test_gateway_errors_are_counted(self):
+        self.stuck_booking([1], '401', {'id': 9301, 'success': True, 'pending': False})
+        with patch.object(payment, 'PAYMOB_INQUIRY_URL', 'http://127.0.0.1:1/inquiry'):
+            result = reconcile_bookings()
+        self.assertEqual(result['errors'], 1)
+        self.assertEqual(metrics.get_value('reconcile_error_rate'), 1.0)
+
+
+# Payment callbacks are stored as events and applied in order (booking/payment_events.py)
+@override_settings(PAYMENT_EVENTS_CONSUME_ON_RECEIVE=False, WAITLIST_MATCH_ASYNC=False)
+class PaymentEventTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.trip = create_trip(total_seats=10)
+        self.booking = create_booking(self.user, self.trip, [1, 2])
+        Booking.objects.filter(id=self.booking.id).update(payment_order_id='701')
+        self.booking.refresh_from_db()
+        self.client = APIClient()
+
+    def event(self, order_id='701', success=True, transaction_id='9501'):
+        return payment_events.record('PROCESSED', {'order': order_id, 'id': transaction_id, 'success': success})
+
+    def process(self):
+        with patch('booking.reconcile.send_tickets') as send_tickets, self.captureOnCommitCallbacks(execute=True):
+            processed = payment_events.process_batch()
+        return processed, send_tickets
+
+    def test_first_event_settles_and_duplicates_are_ignored(self):
+        first, duplicate = self.event(), self.event()
+        processed, send_tickets = self.process()
+        self.assertEqual(processed, 2)
+        send_tickets.assert_called_once_with([self.booking.id])
+        booking = Booking.objects.get(id=self.booking.id)
+        self.assertEqual((booking.status, booking.payment_status, booking.payment_reference), ('CONFIRMED', 'PAID', '9501'))
+        outcomes = dict(PaymentEvent.objects.values_list('id', 'outcome'))
+        self.assertEqual((outcomes[first.id], outcomes[duplicate.id]), ('APPLIED', 'IGNORED'))
+
+    def test_unknown_order(self):
+        event = self.event(order_id='999')
+        self.process()
+        self.assertEqual(PaymentEvent.objects.get(id=event.id).outcome, 'UNKNOWN')
+        self.assertEqual(Booking.objects.get(id=self.booking.id).status, 'PENDING')
+
+    def test_failure_cancels_and_frees_seats(self):
+        self.event(success=False)
+        self.process()
+        booking = Booking.objects.get(id=self.booking.id)
+        self.assertEqual((booking.status, booking.payment_status), ('CANCELLED', 'FAILED'))
+        self.trip.refresh_from_db()
+        self.assertEqual((self.trip.unavailable_seats, self.trip.available_seats), ([], 10))
+
+    def test_paid_after_cancel_is_logged(self):
+        self.booking.cancel()
+        self.event()
+        with self.assertLogs('booking.payment_events', 'ERROR') as logs:
+            self.process()
+        self.assertIn('refund', logs.output[0])
+        self.assertEqual(Booking.objects.get(id=self.booking.id).status, 'CANCELLED')
+        self.assertEqual(metrics.get_value('payment_events_paid_after_cancel'), 1)
+
+    def signed(self, params):
+        return {**params, 'hmac': payment.callback_signature(params)}
+
+    def test_callbacks_only_store_the_event(self):
+        body = {'obj': {'order': {'id': 701}, 'id': 9502, 'success': True}}
+        url = f"/api/paymob/processed_callback/?hmac={payment.callback_signature(body)}"
+        response = self.client.post(url, body, format='json')
+        self.assertEqual((response.status_code, response.json()['transaction_id']), (200, '9502'))
+        response = self.client.get('/api/paymob/response_callback/', self.signed({'order': '701', 'id': '9503', 'success': 'true'}))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(f'order_id={self.booking.id}&success=True', response['Location'])
+        self.assertEqual(Booking.objects.get(id=self.booking.id).status, 'PENDING')
+        self.assertEqual(PaymentEvent.objects.filter(processed_at__isnull=True).count(), 2)
+
+    def test_response_callback_redirects_for_unknown_order(self):
+        response = self.client.get('/api/paymob/response_callback/', self.signed({'order': '999', 'id': '9504', 'success': 'false'}))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('order_id=&success=False', response['Location'])
+
+    def test_forged_callbacks_are_rejected(self):
+        body = {'obj': {'order': {'id': 701}, 'id': 9505, 'success': True}}
+        forged = payment.callback_signature({'obj': {**body['obj'], 'success': False}})
+        for url in ('/api/paymob/processed_callback/', f'/api/paymob/processed_callback/?hmac={forged}'):
+            self.assertEqual(self.client.post(url, body, format='json').status_code, 403)
+        params = {'order': '701', 'id': '9506', 'success': 'true'}
+        response = self.client.get('/api/paymob/response_callback/', {**params, 'hmac': forged})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(PaymentEvent.objects.exists())
+        self.assertEqual(metrics.get_value('payment_callbacks_forged'), 3)
+
+
+# Checkout payment keys (booking/views/payment.py get_payment_key)
+class PaymentKeyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        cache.set('paymob_auth_token', 'auth-token')
+        self.booking = create_booking(create_user(), create_trip(total_seats=10), [1, 2])
+        Booking.objects.filter(id=self.booking.id).update(payment_order_id='801')
+        self.url = '/api/get_payment_key/801/'
+
+    def gateway(self, order_amount=None):
+        order = MagicMock(status_code=200, **{'json.return_value': {'amount_cents': order_amount}})
+        key = MagicMock(**{'json.return_value': {'token': 'key-801'}})
+        return patch('booking.views.payment.requests.get', return_value=order), \
+            patch('booking.views.payment.requests.post', return_value=key)
+
+    def test_key_is_issued_for_the_local_amount_and_then_cached(self):
+        get, post = self.gateway()
+        with get as order, post as key:
+            response = self.client.get(self.url)
+        self.assertEqual(response.json(), {'payment_key': 'key-801'})
+        order.assert_not_called()  # PAY_VERIFY_ORDER is off: the amount comes from the booking
+        self.assertEqual(key.call_args.kwargs['json']['amount_cents'], '30000')  # 2 seats at 150.00
+
+        get, post = self.gateway()
+        with get as order, post as key:
+            response = self.client.get(self.url)
+        self.assertEqual(response.json(), {'payment_key': 'key-801'})
+        order.assert_not_called()
+        key.assert_not_called()
+        self.assertEqual(metrics.get_value('payment_key_cache_hits'), 1)
+
+    def test_verified_order_amount_must_match(self):
+        get, post = self.gateway(order_amount=25000)
+        with patch.object(payment, 'PAYMENT_VERIFY_ORDER', True), get as order, post as key, \
+                self.assertLogs('booking.views.payment', 'WARNING'):
+            response = self.client.get(self.url)
+        self.assertEqual((response.status_code, response.json()['error']), (400, 'Order amount does not match booking'))
+        order.assert_called_once()
+        key.assert_not_called()
+        self.assertIsNone(cache.get(payment.payment_key_cache_key(801)))
+
+        get, post = self.gateway(order_amount=30000)
+        with patch.object(payment, 'PAYMENT_VERIFY_ORDER', True), get, post:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_only_pending_bookings_get_a_key(self):
+        Booking.objects.filter(id=self.booking.id).update(status='CONFIRMED')
+        get, post = self.gateway()
+        with get as order, post as key:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 409)
+        order.assert_not_called()
+        key.assert_not_called()
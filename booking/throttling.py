@@ -0,0 +1,42 @@
+import hashlib
+from rest_framework.throttling import SimpleRateThrottle
+from . import metrics
+
+# Sliding-window throttles for the credential endpoints. They run in APIView.initial(),
+# before the view body, so a rejected request never touches the database or the password hasher.
+
+
+class SheddingRateThrottle(SimpleRateThrottle):
+    def throttle_failure(self):
+        metrics.incr(f'throttle_shed_{self.scope}')
+        return False
+
+
+class IPRateThrottle(SheddingRateThrottle):
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class AccountRateThrottle(SheddingRateThrottle):
+    def get_cache_key(self, request, view):
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if not email:
+            return None
+        ident = hashlib.sha256(str(email).strip().lower().encode()).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class LoginIPThrottle(IPRateThrottle):
+    scope = 'login_ip'
+
+
+class LoginAccountThrottle(AccountRateThrottle):
+    scope = 'login_account'
+
+
+class PasswordResetIPThrottle(IPRateThrottle):
+    scope = 'password_reset_ip'
+
+
+class PasswordResetAccountThrottle(AccountRateThrottle):
+    scope = 'password_reset_account'
@@ -0,0 +1,84 @@
+import hashlib
+import io
+import json
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from .utils import generate_ticket_pdf
+
+logger = logging.getLogger(__name__)
+
+
+def ticket_fingerprint(booking):
+    """Hash of every booking field printed on the ticket; it changes exactly when the ticket would."""
+    trip = booking.trip
+    fields = [
+        booking.id, booking.customer_name, booking.customer_phone,
+        str(trip.start_location), str(trip.destination), trip.bus_type, trip.departure_date.isoformat(),
+        booking.seat_labels, str(booking.total_price),
+        booking.payment_reference, booking.payment_type,
+        booking.booking_date.isoformat() if booking.booking_date else None,
+    ]
+    return hashlib.sha256(json.dumps(fields, default=str).encode()).hexdigest()
+
+
+class TicketStore:
+    """
+    Rendered ticket PDFs, stored once per fingerprint in the `tickets` storage backend
+    with a size-bounded in-process LRU cache in front of it.
+    """
+
+    def __init__(self):
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def storage(self):
+        return storages['tickets']
+
+    def _cache_get(self, fingerprint):
+        with self._lock:
+            content = self._cache.get(fingerprint)
+            if content is not None:
+                self._cache.move_to_end(fingerprint)
+            return content
+
+    def _cache_put(self, fingerprint, content):
+        limit = settings.TICKET_CACHE_MAX_BYTES
+        if len(content) > limit:
+            return
+        with self._lock:
+            if fingerprint in self._cache:
+                return
+            self._cache[fingerprint] = content
+            self._cache_bytes += len(content)
+            while self._cache_bytes > limit:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+
+    def get_or_render(self, booking):
+        """Return (fingerprint, pdf bytes), rendering and storing the ticket only if it is new."""
+        fingerprint = ticket_fingerprint(booking)
+        content = self._cache_get(fingerprint)
+        if content is not None:
+            return fingerprint, content
+
+        name = f'{fingerprint}.pdf'
+        if self.storage.exists(name):
+            with self.storage.open(name, 'rb') as stored:
+                content = stored.read()
+        else:
+            buffer = io.BytesIO()
+            generate_ticket_pdf(booking, buffer)
+            content = buffer.getvalue()
+            self.storage.save(name, ContentFile(content))
+            logger.info(f"Stored ticket {name} for booking {booking.id}")
+        self._cache_put(fingerprint, content)
+        return fingerprint, content
+
+
+ticket_store = TicketStore()
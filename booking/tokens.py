@@ -0,0 +1,116 @@
+import hashlib
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from django.utils import timezone
+from . import metrics
+from .utils import shared_cache
+
+REVOKED_JTI_CACHE_KEY = 'revoked_jti_{}'
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter: `in` may give false positives, never false negatives."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class RevocationFilter:
+    """
+    Negative filter in front of the blacklist table. The filter is rebuilt from the
+    database every TOKEN_FILTER_REBUILD_SECONDS; revocations made since the last rebuild
+    are also kept in the cache so they are caught before the next one. That only reaches
+    other processes through a cache shared by every process (Redis/Memcached): with locmem
+    a token revoked by one worker would still pass on the others, so the filter is skipped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._built_at = 0
+
+    @property
+    def rebuild_interval(self):
+        return getattr(settings, 'TOKEN_FILTER_REBUILD_SECONDS', 300)
+
+    def rebuild(self):
+        jtis = list(BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+                    .values_list('token__jti', flat=True).iterator(chunk_size=5000))
+        bloom = BloomFilter(len(jtis) * 2, getattr(settings, 'TOKEN_FILTER_ERROR_RATE', 0.01))
+        for jti in jtis:
+            bloom.add(jti)
+        self._filter = bloom
+        self._built_at = time.monotonic()
+        metrics.set_value('token_filter_size', len(jtis))
+
+    def _current(self):
+        if self._filter is None or time.monotonic() - self._built_at > self.rebuild_interval:
+            with self._lock:
+                if self._filter is None or time.monotonic() - self._built_at > self.rebuild_interval:
+                    self.rebuild()
+        return self._filter
+
+    def might_be_revoked(self, jti):
+        return jti in self._current() or cache.get(REVOKED_JTI_CACHE_KEY.format(jti)) is not None
+
+    def record(self, jti):
+        cache.set(REVOKED_JTI_CACHE_KEY.format(jti), True, timeout=self.rebuild_interval * 2)
+        if self._filter is not None:
+            self._filter.add(jti)
+
+
+revocation_filter = RevocationFilter()
+
+
+class FilteredRefreshToken(RefreshToken):
+    def check_blacklist(self):
+        if shared_cache() and not revocation_filter.might_be_revoked(self.payload[api_settings.JTI_CLAIM]):
+            metrics.incr('token_filter_skipped')
+            return
+        metrics.incr('token_filter_checked')
+        super().check_blacklist()
+
+    def blacklist(self):
+        result = super().blacklist()
+        revocation_filter.record(self.payload[api_settings.JTI_CLAIM])
+        return result
+
+
+class FilteredTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = FilteredRefreshToken
+
+
+def prune_expired_tokens(batch_size=5000):
+    # Deleting by primary key in small batches keeps each transaction (and its locks) short;
+    # blacklisted rows go with their outstanding token through the cascade.
+    expired = OutstandingToken.objects.filter(expires_at__lte=timezone.now()).order_by('pk')
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        OutstandingToken.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
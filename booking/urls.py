@@ -1,9 +1,13 @@
 #booking/urls.py
 from django.urls import path
 from .views.user import (RegisterView, LoginView, LogoutView, UserProfileView, PasswordResetRequestView, PasswordResetConfirmView)
-from .views.trip import LocationListView, TripSearchView
-from .views.booking import ( BookingDetailView, BookingCancelView , BookingCreateView, ConfirmBookingView, run_scheduled_job)
+from .views.trip import LocationListView, LocationAutocompleteView, TripSearchView
+from .views.booking import ( BookingDetailView, BookingCancelView , BookingCreateView, ConfirmBookingView, TicketDownloadView, AdmissionStatusView, seat_stream)
 from .views.payment import (get_payment_key, paymob_response_callback, paymob_processed_callback)
+from .views.metrics import MetricsView
+from .views.export import TripManifestView, BookingExportView
+from .views.waitlist import WaitlistView, WaitlistClaimView
+from .views.disruption import TripDisruptionView
 from rest_framework_simplejwt.views import TokenRefreshView
 app_name = 'bus_booking'
 
@@ -16,15 +20,26 @@ urlpatterns = [
 
     # Location List
     path('locations/', LocationListView.as_view(), name='location_list'),
+    path('locations/autocomplete/', LocationAutocompleteView.as_view(), name='location_autocomplete'),
 
     # Trip Search
     path('trips/search/', TripSearchView.as_view(), name='trip_search'),
 
     # Booking
     path('trips/<int:trip_id>/book/', BookingCreateView.as_view(), name='book_trip'),
+
+    # Booking queue position for requests turned away by admission control
+    path('trips/<int:trip_id>/queue/', AdmissionStatusView.as_view(), name='booking_queue'),
+
+    # Live seat changes (server-sent events, ASGI only)
+    path('trips/<int:trip_id>/seats/stream/', seat_stream, name='seat_stream'),
     
     path('trips/<int:trip_id>/confirm/<str:temp_booking_ref>/', ConfirmBookingView.as_view(), name='confirm_booking'),
 
+    # Waitlist for sold-out trips
+    path('trips/<int:trip_id>/waitlist/', WaitlistView.as_view(), name='trip_waitlist'),
+    path('trips/<int:trip_id>/waitlist/claim/', WaitlistClaimView.as_view(), name='trip_waitlist_claim'),
+
     # Payment
     path('get_payment_key/<int:order_id>/', get_payment_key, name='payment_key'),
 
@@ -35,15 +50,26 @@ urlpatterns = [
     # Booking Detail
     path('bookings/detail/<int:order_id>/', BookingDetailView.as_view(), name='booking_detail'),
 
+    # Ticket download
+    path('bookings/<int:booking_id>/ticket/', TicketDownloadView.as_view(), name='booking_ticket'),
+
     # Booking Cancellation
     path('bookings/<int:booking_id>/cancel/', BookingCancelView.as_view(), name='cancel_booking'),
 
+    # Exports (admins only)
+    path('trips/<int:trip_id>/manifest/', TripManifestView.as_view(), name='trip_manifest'),
+    path('bookings/export/', BookingExportView.as_view(), name='booking_export'),
+
+    # Trip disruption: cancel or move every booking of a trip (admins only)
+    path('trips/<int:trip_id>/disruption/', TripDisruptionView.as_view(), name='trip_disruption'),
+
     # User Profile
     path('profile/', UserProfileView.as_view(), name='user_profile'),
 
-    path("run-job/", run_scheduled_job, name="run_job"),
-
     path('password_reset/', PasswordResetRequestView.as_view(), name='password_reset'),
 
     path('password_reset/confirm/', PasswordResetConfirmView.as_view(), name='password_reset_confirm'),
+
+    # Operational metrics (admins only)
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
@@ -1,11 +1,11 @@
 import logging
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-from django.template.loader import render_to_string
 from django.core.mail import EmailMessage
 from django.conf import settings
 from datetime import datetime
 from django.utils.timezone import localtime
+from .mail import dispatcher, render_template
 logger = logging.getLogger(__name__)
 
 def generate_ticket_pdf(booking, output_path):
@@ -47,7 +47,7 @@ def generate_ticket_pdf(booking, output_path):
         c.drawString(50, height - 300, "Seat Information")
         
         c.setFont("Helvetica", 11)
-        seats_str = [str(seat) for seat in booking.selected_seats]
+        seats_str = booking.seat_labels
         c.drawString(50, height - 320, f"Seats: {', '.join(seats_str)}")
         
         # Payment Details
@@ -72,13 +72,13 @@ def generate_ticket_pdf(booking, output_path):
         logger.error(f"Failed to generate PDF for booking {booking.id}: {str(e)}")
         raise
 
-def send_ticket_email(booking, pdf_path):
+def send_ticket_email(booking, pdf_content):
     try:
         # Refresh the booking object to ensure we have latest data
         booking.refresh_from_db()
         
         subject = 'Your Trip Ticket'
-        message = render_to_string('email/ticket_email.html', {
+        message = render_template('email/ticket_email.html', {
             'customer_name': booking.customer_name,
             'customer_phone': booking.customer_phone,
             'trip': {
@@ -87,7 +87,7 @@ def send_ticket_email(booking, pdf_path):
                 'departure_date': booking.trip.departure_date,
                 'bus_type': booking.trip.bus_type
             },
-            'selected_seats': booking.selected_seats,
+            'selected_seats': booking.seat_labels,
             'total_price': booking.total_price
         })
         
@@ -97,10 +97,17 @@ def send_ticket_email(booking, pdf_path):
             from_email=settings.EMAIL_HOST_USER,
             to=[booking.user.email]
         )
-        email.attach(f'ticket-{booking.id}.pdf', open(pdf_path, 'rb').read(), 'application/pdf')
+        email.attach(f'ticket-{booking.id}.pdf', pdf_content, 'application/pdf')
         email.content_subtype = 'html'
-        email.send(fail_silently=False)
-        logger.info(f"Email sent successfully for booking {booking.id}")
+        dispatcher.enqueue(email)
+        logger.info(f"Email queued for booking {booking.id}")
     except Exception as e:
         logger.error(f"Failed to send email for booking {booking.id}: {str(e)}")
         raise
+
+# Cache backends that keep a separate store in every process
+PER_PROCESS_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+def shared_cache():
+    """Whether the default cache is one store for every process (Redis, Memcached...), not a per-process one."""
+    return settings.CACHES['default']['BACKEND'] not in PER_PROCESS_CACHES
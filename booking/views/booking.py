@@ -1,66 +1,122 @@
 from django.shortcuts import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
-from django.core.files.storage import default_storage
-from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
-from django.core.files.base import ContentFile
 from rest_framework.response import Response
-from ..serializers import BookingSerializer
+from ..serializers import BookingSerializer, BookingDetailSerializer, ArchivedBookingDetailSerializer
 from rest_framework.views import APIView
 from datetime import datetime, timedelta
 from rest_framework import serializers
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, Http404
+from django.core.handlers.asgi import ASGIRequest
 from django.core.cache import cache
 from ..models import Booking, Trip
 from django.db import transaction
+import asyncio
+import json
 import uuid
 import logging
 import requests
 from decouple import config
 from .payment import PaymentHelper
-from ..utils import generate_ticket_pdf, send_ticket_email
+from ..utils import send_ticket_email
+from ..tickets import ticket_fingerprint, ticket_store
+from ..archive import find_archived_booking
+from ..encoders import accepts_fast_json, json_response, render
+from ..seating import pick_seats
+from .. import admission, seat_events
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from asgiref.sync import sync_to_async
+from django.conf import settings
 
 # Define PAYMOB_ORDER_URL
 PAYMOB_ORDER_URL = config('PAY_ORDER_URL')
 logger = logging.getLogger(__name__)
 TEMP_LOCK_EXPIRY = 600
 
+def parse_seat_preferences(data):
+    """Seat count and preferences of an auto-assign request; ValueError with a client message when invalid."""
+    try:
+        count = int(data.get("seat_count"))
+    except (TypeError, ValueError):
+        count = 0
+    if count < 1:
+        raise ValueError("seat_count must be a positive integer")
+    preferences = data.get("preferences") or {}
+    if not isinstance(preferences, dict):
+        raise ValueError("preferences must be an object")
+    return {
+        'count': count,
+        'preferences': {
+            'together': bool(preferences.get('together', True)),
+            'window': bool(preferences.get('window', False)),
+            'front': bool(preferences.get('front', False)),
+        }
+    }
+
 class BookingCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, trip_id):
         cache_key = f"trip_seats_{trip_id}"
-        seats = cache.get(cache_key)
-        if not seats:
-            trip = get_object_or_404(
-                Trip.objects.select_related('start_location', 'destination').only(
-                    'id', 'total_seats', 'available_seats', 'seats',
-                    'start_location__name', 'destination__name', 'bus_type', 'departure_date', 'price'
-                ),
-                id=trip_id
-            )
+        body = cache.get(cache_key)  # The rendered JSON, see booking/encoders.py
+        if body is None:
+            # Read the version first: anything that changes after it shows up in the seat stream
+            version = seat_events.current_version(trip_id)
+            row = Trip.objects.filter(id=trip_id).values_list(
+                'total_seats', 'available_seats', 'occupancy', 'layout_id', 'layout__seats_per_row', 'layout__rows', 'layout__labels'
+            ).first()
+            if row is None:
+                raise Http404
+            total_seats, available_seats, occupancy, layout_id, seats_per_row, rows, labels = row
+            booked = int.from_bytes(bytes(occupancy or b''), 'little')
+            # Compact map: the shared layout plus the booked seats; every other seat is free
             seats = {
-                'total_seats': trip.total_seats,
-                'available_seats': trip.available_seats,
-                'seat_status': trip.seats,
-                'unavailable_seats': [
-                    seat_num for seat_num, status in trip.seats.items()
-                    if status != 'available'
-                ]
+                'total_seats': total_seats,
+                'available_seats': available_seats,
+                'layout': {'id': layout_id, 'seats_per_row': seats_per_row, 'rows': rows},
+                'unavailable_seats': [str(n) for n in range(1, total_seats + 1) if booked >> (n - 1) & 1],
+                'version': version,
             }
-            cache.set(cache_key, seats, timeout=300)  # Cache for 5 minutes
-        return Response(seats, status=200)
+            if labels != [str(n) for n in range(1, total_seats + 1)]:
+                seats['layout']['labels'] = labels
+            body = render(seats)
+            cache.set(cache_key, body, timeout=300)  # Cache for 5 minutes
+        if 'seat_status' in request.query_params.get('expand', '').split(','):
+            # Deprecated full status map, only for old seat map clients that ask for it
+            seats = json.loads(body)
+            booked = set(seats['unavailable_seats'])
+            seats['seat_status'] = {str(n): 'booked' if str(n) in booked else 'available' for n in range(1, seats['total_seats'] + 1)}
+            body = render(seats)
+        if accepts_fast_json(request):
+            return json_response(body)
+        return Response(json.loads(body), status=200)
 
+    @admission.admission_controlled
     def post(self, request, trip_id):
         trip = get_object_or_404(
-            Trip.objects.select_related('start_location', 'destination').only(
-                'id', 'total_seats', 'available_seats', 'seats', 'price',
-                'start_location__name', 'destination__name', 'bus_type', 'departure_date'
+            Trip.objects.select_related('start_location__city', 'destination__city', 'layout').only(
+                'id', 'total_seats', 'available_seats', 'occupancy', 'price', 'layout__seats_per_row',
+                'start_location__name', 'start_location__city__name',
+                'destination__name', 'destination__city__name', 'bus_type', 'departure_date'
             ),
             id=trip_id
         )
         seats = request.data.get("selected_seats", [])
         payment_type = request.data.get("payment_type", "ONLINE").upper()
+
+        # Auto-assign mode: only a seat count and preferences; the seats are picked at confirmation,
+        # under the trip lock. The current best pick is returned (and shown as held) as a preview.
+        auto_assign = None
+        if not seats and request.data.get("seat_count"):
+            try:
+                auto_assign = parse_seat_preferences(request.data)
+            except ValueError as exc:
+                return Response({"error": str(exc)}, status=400)
+            seats = pick_seats(trip.free_bitmap, trip.total_seats, auto_assign['count'],
+                               seats_per_row=trip.layout.seats_per_row, **auto_assign['preferences'])
+            if not seats:
+                return Response({"error": "Not enough available seats."}, status=400)
         
         if request.user.user_type == 'Passenger':
             customer_name = request.user.name
@@ -89,25 +145,98 @@ class BookingCreateView(APIView):
                 'user_id': request.user.id,
                 'payment_type': payment_type,
                 'customer_name': customer_name,
-                'customer_phone': customer_phone
+                'customer_phone': customer_phone,
+                'auto_assign': auto_assign
             }, timeout=TEMP_LOCK_EXPIRY)
+            expires_at = seat_events.hold(trip.id, temp_booking_ref, seats, TEMP_LOCK_EXPIRY)
 
             return Response({
                 "message": "Booking initiated",
                 "temp_booking_ref": temp_booking_ref,
-                "expires_at": (timezone.now() + timedelta(seconds=TEMP_LOCK_EXPIRY)).isoformat()
+                "selected_seats": seats,
+                "auto_assigned": auto_assign is not None,
+                "expires_at": expires_at
             }, status=200)
         except serializers.ValidationError as e:
             return Response({"error": str(e)}, status=400)
 
+async def stream_user(request):
+    """
+    The authenticated user of a seat stream, or None: a JWT access token from the Authorization
+    header or ?token= (EventSource can't set headers), else the session user.
+    """
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else request.GET.get('token')
+    if raw_token:
+        try:
+            return await sync_to_async(authentication.get_user)(authentication.get_validated_token(raw_token))
+        except (InvalidToken, AuthenticationFailed):
+            return None
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+async def seat_stream(request, trip_id):
+    """
+    Server-sent events with the seat deltas of one trip (ASGI server only, 501 under WSGI). Each event id
+    is the trip seat version; a reconnecting client sends Last-Event-ID (or ?since=) and only
+    receives what it missed, or a `reset` event when it must reload the seat map. Requires the
+    same authentication as the seat map.
+    """
+    # Under WSGI the open stream would hold a whole worker for SEAT_STREAM_MAX_SECONDS; clients
+    # there keep polling the seat map
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "The seat stream needs the ASGI server."}, status=501)
+    if await stream_user(request) is None:
+        return JsonResponse({"error": "Authentication credentials were not provided or are invalid."}, status=401)
+    if not await Trip.objects.filter(id=trip_id).aexists():
+        raise Http404("Trip not found")
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+
+    async def stream():
+        version = int(since) if since and since.isdigit() else await asyncio.to_thread(seat_events.current_version, trip_id)
+        subscription = seat_events.subscribe(trip_id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.SEAT_STREAM_MAX_SECONDS
+        idle = 0
+        try:
+            yield f"retry: {settings.SEAT_STREAM_RETRY_MS}\n\n"
+            while loop.time() < deadline:
+                events = await asyncio.to_thread(seat_events.events_since, trip_id, version)
+                if events is None:
+                    version = await asyncio.to_thread(seat_events.current_version, trip_id)
+                    yield f"id: {version}\nevent: reset\ndata: {json.dumps({'version': version})}\n\n"
+                for event in events or ():
+                    version = event['version']
+                    yield f"id: {version}\nevent: seats\ndata: {json.dumps(event)}\n\n"
+                # Woken immediately by publishes in this process; the timeout picks up other workers'
+                try:
+                    await asyncio.wait_for(subscription[1].wait(), timeout=settings.SEAT_STREAM_POLL_SECONDS)
+                    idle = 0
+                except asyncio.TimeoutError:
+                    idle += settings.SEAT_STREAM_POLL_SECONDS
+                    if idle >= settings.SEAT_STREAM_KEEPALIVE_SECONDS:
+                        idle = 0
+                        yield ": keep-alive\n\n"
+                subscription[1].clear()
+        finally:
+            seat_events.unsubscribe(trip_id, subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 class ConfirmBookingView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @admission.admission_controlled
     def post(self, request, trip_id, temp_booking_ref):
         trip = get_object_or_404(
-            Trip.objects.select_related('start_location', 'destination').only(
-                'id', 'total_seats', 'available_seats', 'seats', 'price',
-                'start_location__name', 'destination__name', 'bus_type', 'departure_date'
+            Trip.objects.select_related('start_location__city', 'destination__city', 'layout').only(
+                'id', 'total_seats', 'available_seats', 'occupancy', 'price', 'layout__seats_per_row',
+                'start_location__name', 'start_location__city__name',
+                'destination__name', 'destination__city__name', 'bus_type', 'departure_date'
             ),
             id=trip_id
         )
@@ -119,25 +248,31 @@ class ConfirmBookingView(APIView):
         if temp_booking['user_id'] != request.user.id:
             return Response({"error": "Unauthorized"}, status=403)
 
-        seats = temp_booking['seats']
+        auto_assign = temp_booking.get('auto_assign')
+        seats = [] if auto_assign else temp_booking['seats']
         payment_type = temp_booking['payment_type']
         customer_name = request.data.get('customer_name', temp_booking.get('customer_name'))
         customer_phone = request.data.get('customer_phone', temp_booking.get('customer_phone'))
 
         data = {
             "selected_seats": seats,
-            "seats_booked": len(seats),
+            "seats_booked": auto_assign['count'] if auto_assign else len(seats),
             "payment_type": payment_type,
             "customer_name": customer_name,
             "customer_phone": customer_phone
         }
-        serializer = BookingSerializer(data=data, context={'trip': trip, 'request': request})
+        serializer = BookingSerializer(data=data, context={
+            'trip': trip, 'request': request,
+            'seat_preferences': auto_assign['preferences'] if auto_assign else None
+        })
 
         try:
             serializer.is_valid(raise_exception=True)
             with transaction.atomic():
                 booking = serializer.save()
             cache.delete(cache_key)
+            seat_events.end_hold(temp_booking_ref)
+            seats = booking.selected_seats
 
             if payment_type == "ONLINE":
                 token = PaymentHelper.get_auth_token()
@@ -174,11 +309,8 @@ class ConfirmBookingView(APIView):
                 booking.payment_status = 'PAID'
                 booking.payment_type = 'CASH'
                 booking.save(update_fields=['status', 'payment_status', 'payment_type'])
-                pdf_path = f'tickets/ticket-{booking.id}.pdf'
-                default_storage.save(pdf_path, ContentFile(b''))
-                generate_ticket_pdf(booking, default_storage.path(pdf_path))
-                send_ticket_email(booking, default_storage.path(pdf_path))
-                default_storage.delete(pdf_path)
+                _, pdf_content = ticket_store.get_or_render(booking)
+                send_ticket_email(booking, pdf_content)
                 frontend_url = "https://busbooking-virid.vercel.app/booking-success"
                 redirect_url = f"{frontend_url}?order_id={booking.id}&success=true"
                 return Response({
@@ -199,7 +331,19 @@ class ConfirmBookingView(APIView):
                 booking.delete()
             return Response({"error": str(e)}, status=500)
 
-# Other views unchanged (BookingCancelView, BookingDetailView, run_scheduled_job)
+class AdmissionStatusView(APIView):
+    """Queue position of an admission ticket (see booking/admission.py): cache reads only, the user comes from the token."""
+    authentication_classes = [JWTStatelessUserAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, trip_id):
+        token = request.headers.get('X-Admission-Ticket') or request.query_params.get('admission_ticket')
+        ticket = admission.read_ticket(token, trip_id, request.user.id)
+        if ticket is None:
+            return Response({"error": "Invalid or expired admission ticket"}, status=400)
+        return Response(admission.status(trip_id, ticket), status=200)
+
+# Other views unchanged (BookingCancelView, BookingDetailView)
 class BookingCancelView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -214,26 +358,80 @@ class BookingCancelView(APIView):
 
 class BookingDetailView(APIView):
     permission_classes = [IsAuthenticated]
-    
+
     def get(self, request, order_id):
+        fields = [f for f in request.query_params.get('fields', '').split(',') if f]
+        expand = [e for e in request.query_params.get('expand', '').split(',') if e in BookingDetailSerializer.EXPANDABLE]
+
+        # One query whatever is requested: the trip areas and cities are joined for the
+        # location strings, the user for the expanded profile.
+        bookings = Booking.objects.select_related('user', 'trip__start_location__city', 'trip__destination__city')
+        serializer_class = BookingDetailSerializer
         try:
             if str(order_id).isdigit():
-                booking = Booking.objects.get(id=order_id)
+                booking = bookings.get(id=order_id)
             else:
-                booking = Booking.objects.get(payment_order_id=order_id)
+                booking = bookings.get(payment_order_id=order_id)
         except Booking.DoesNotExist:
-            return Response({"error": "Booking not found"}, status=404)
-        if booking.user != request.user and not request.user.is_staff:
+            # Bookings of departed trips are moved to the archive (booking/archive.py)
+            booking, serializer_class = find_archived_booking(order_id), ArchivedBookingDetailSerializer
+            if booking is None:
+                return Response({"error": "Booking not found"}, status=404)
+        if booking.user_id != request.user.id and not request.user.is_staff:
             return Response({"error": "Unauthorized"}, status=403)
-        serializer = BookingSerializer(booking)
+        serializer = serializer_class(booking, fields=fields, expand=expand)
         return Response({"booking": serializer.data}, status=200)
 
-@csrf_exempt
-def run_scheduled_job(request):
-    current_time = timezone.now()
-    expired_bookings = Booking.objects.filter(status='PENDING', expires_at__lt=current_time)
-    count = expired_bookings.count()
-    for booking in expired_bookings:
-        booking.cancel()
-    print(f"Cancelled {count} expired bookings.")
-    return JsonResponse({"status": "OK", "cancelled": count})
\ No newline at end of file
+class TicketDownloadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, booking_id):
+        booking = (Booking.objects.select_related('trip__start_location__city', 'trip__destination__city', 'trip__layout')
+                   .filter(id=booking_id).first())
+        if booking is None:
+            # Tickets of departed trips are printed from the archive, which keeps the seat labels
+            booking = find_archived_booking(booking_id)
+            if booking is None:
+                return Response({"error": "Booking not found"}, status=404)
+        if booking.user_id != request.user.id and not request.user.is_staff:
+            return Response({"error": "Unauthorized"}, status=403)
+        if booking.status != 'CONFIRMED':
+            return Response({"error": "Ticket is only available for confirmed bookings"}, status=409)
+
+        # The fingerprint is the ETag, so a revalidation is answered without loading or rendering the PDF
+        etag = f'"{ticket_fingerprint(booking)}"'
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            return response
+
+        _, content = ticket_store.get_or_render(booking)
+        status, start, end = 200, 0, len(content) - 1
+        range_header = request.headers.get('Range', '')
+        if range_header.startswith('bytes=') and ',' not in range_header and request.headers.get('If-Range', etag) == etag:
+            first, _, last = range_header[len('bytes='):].strip().partition('-')
+            try:
+                if first:
+                    start, end = int(first), min(int(last), end) if last else end
+                    valid = not last or int(last) >= start
+                else:
+                    start, valid = max(len(content) - int(last), 0), True
+            except ValueError:
+                valid = False
+            # A malformed range (bytes=500-100, bytes=abc) is ignored and the whole ticket sent
+            if not valid:
+                start, end = 0, len(content) - 1
+            elif start > end:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{len(content)}'
+                return response
+            else:
+                status = 206
+
+        response = HttpResponse(content[start:end + 1], status=status, content_type='application/pdf')
+        response['ETag'] = etag
+        response['Accept-Ranges'] = 'bytes'
+        response['Content-Disposition'] = f'attachment; filename="ticket-{booking.id}.pdf"'
+        if status == 206:
+            response['Content-Range'] = f'bytes {start}-{end}/{len(content)}'
+        return response
@@ -0,0 +1,46 @@
+from django.core.exceptions import ValidationError
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from ..disruption import cancel_trip, move_trip
+from ..models import Trip
+
+
+def flag(data, name, default):
+    value = data.get(name, default)
+    return value not in (False, 'false', '0')
+
+
+# Trip disruption (admins only): POST {"action": "cancel"} or
+# {"action": "move", "target_trip_id": 12, "seat_map": {"3": 7}, "keep_open": false}, optional "reason" and "notify"
+class TripDisruptionView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, trip_id):
+        if request.user.user_type != 'Admin' and not request.user.is_staff:
+            return Response({"error": "Only admins can disrupt trips"}, status=403)
+        action = request.data.get('action')
+        reason = str(request.data.get('reason', ''))
+        notify = flag(request.data, 'notify', True)
+        try:
+            if action == 'cancel':
+                bookings = cancel_trip(trip_id, reason=reason, notify=notify)
+                return Response({"message": "Trip cancelled", "cancelled": [booking.id for booking in bookings]}, status=200)
+            if action == 'move':
+                target = request.data.get('target_trip_id')
+                if not str(target).isdigit():
+                    return Response({"error": "target_trip_id is required"}, status=400)
+                seat_map = request.data.get('seat_map') or {}
+                if not isinstance(seat_map, dict):
+                    return Response({"error": "seat_map must map old seats to new seats"}, status=400)
+                plan = move_trip(trip_id, int(target), seat_map=seat_map, reason=reason, notify=notify,
+                                 close=not flag(request.data, 'keep_open', False))
+                return Response({"message": "Bookings moved", "target_trip_id": int(target),
+                                 "moved": {str(booking_id): seats for booking_id, seats in plan.items()}}, status=200)
+        except Trip.DoesNotExist as e:
+            return Response({"error": str(e)}, status=404)
+        except ValidationError as e:
+            return Response({"error": e.messages[0]}, status=409)
+        except (TypeError, ValueError):
+            return Response({"error": "seat_map must map old seats to new seats"}, status=400)
+        return Response({"error": "action must be cancel or move"}, status=400)
@@ -0,0 +1,56 @@
+from datetime import datetime
+from django.http import StreamingHttpResponse
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from ..models import Trip, ArchivedTrip
+from ..exports import (EXPORT_FORMATS, MANIFEST_COLUMNS, BOOKING_COLUMNS, manifest_rows, booking_history_rows)
+
+
+def _streaming_export(rows, columns, output, filename):
+    render, content_type = EXPORT_FORMATS[output]
+    response = StreamingHttpResponse(render(rows, columns), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{output}"'
+    return response
+
+
+# Passenger manifest for one trip (drivers, station agents)
+class TripManifestView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, trip_id):
+        if request.user.user_type != 'Admin' and not request.user.is_staff:
+            return Response({"error": "Only admins can export manifests"}, status=403)
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            return Response({"error": f"output must be one of {', '.join(EXPORT_FORMATS)}"}, status=400)
+        if not Trip.objects.filter(id=trip_id).exists() and not ArchivedTrip.objects.filter(id=trip_id).exists():
+            return Response({"error": "Trip not found"}, status=404)
+        return _streaming_export(manifest_rows(trip_id), MANIFEST_COLUMNS, output, f'manifest-trip-{trip_id}')
+
+
+# Bulk bookings export (finance), filtered by ?status=&trip=&since=&until= (YYYY-MM-DD booking dates)
+class BookingExportView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if request.user.user_type != 'Admin' and not request.user.is_staff:
+            return Response({"error": "Only admins can export bookings"}, status=403)
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            return Response({"error": f"output must be one of {', '.join(EXPORT_FORMATS)}"}, status=400)
+
+        filters = {}
+        if request.query_params.get('status'):
+            filters['status'] = request.query_params['status'].upper()
+        if request.query_params.get('trip', '').isdigit():
+            filters['trip_id'] = request.query_params['trip']
+        try:
+            if request.query_params.get('since'):
+                filters['booking_date__date__gte'] = datetime.strptime(request.query_params['since'], '%Y-%m-%d').date()
+            if request.query_params.get('until'):
+                filters['booking_date__date__lte'] = datetime.strptime(request.query_params['until'], '%Y-%m-%d').date()
+        except ValueError:
+            return Response({"error": "Dates must be YYYY-MM-DD"}, status=400)
+
+        return _streaming_export(booking_history_rows(**filters), BOOKING_COLUMNS, output, 'bookings')
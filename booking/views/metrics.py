@@ -0,0 +1,14 @@
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from .. import metrics
+
+
+# Operational counters (throttled requests, background job timings, ...)
+class MetricsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if request.user.user_type != 'Admin' and not request.user.is_staff:
+            return Response({"error": "Only admins can view metrics"}, status=403)
+        return Response({"metrics": metrics.snapshot()}, status=200)
@@ -1,3 +1,5 @@
+import hashlib
+import hmac
 import requests
 import json
 import logging
@@ -10,28 +12,24 @@ from functools import wraps
 from decouple import config
 from ..models import Booking
 from datetime import datetime
-from django.utils.timezone import now
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
-from ..utils import generate_ticket_pdf, send_ticket_email
+from .. import metrics, payment_events
 logger = logging.getLogger(__name__)
 
 PAYMOB_API_KEY = config('PAY_API_KEY')
 PAYMOB_AUTH_URL = config('PAY_AUTH_URL')
 PAYMOB_ORDER_URL = config('PAY_ORDER_URL')
 PAYMOB_PAYMENT_KEY_URL = config('PAY_PAYMENT_KEY_URL')
+PAYMOB_INQUIRY_URL = config('PAY_INQUIRY_URL', default='https://accept.paymob.com/api/ecommerce/orders/transaction_inquiry')
 PAYMOB_INTEGRATION_ID = config('PAY_INTEGRATION_ID')
 PAYMOB_HMAC_SECRET = config('PAY_HMAC_SECRET')
 CURRENCY = config('PAY_CURRENCY')
 TEMP_LOCK_EXPIRY = 600
+PAYMENT_KEY_EXPIRATION = config('PAY_KEY_EXPIRATION', default=3600, cast=int)
+PAYMENT_KEY_CACHE_MARGIN = 60  # Stop handing out a cached key this many seconds before the gateway expires it
+PAYMENT_VERIFY_ORDER = config('PAY_VERIFY_ORDER', default=False, cast=bool)  # Cross-check amounts with the gateway order
 
-def update_booking_status(booking, transaction_success, transaction_id=None):
-    booking.payment_status = "PAID" if transaction_success else "FAILED"
-    booking.status = "CONFIRMED" if transaction_success else "CANCELLED"
-    if transaction_id:
-        booking.payment_reference = transaction_id
-    booking.payment_date = now()
-    booking.save()
+def payment_key_cache_key(order_id):
+    return f"paymob_payment_key_{order_id}"
 
 def handle_exceptions(view_func):
     @wraps(view_func)
@@ -77,6 +75,19 @@ class PaymentHelper:
             }]
         }
 
+    @staticmethod
+    def create_order(trip, seats):
+        """Register an order for the seats with Paymob and return its id (None if auth fails)."""
+        token = PaymentHelper.get_auth_token()
+        if not token:
+            return None
+        res = requests.post(PAYMOB_ORDER_URL, json=PaymentHelper.create_order_data(trip, seats, token), headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }, timeout=10)
+        res.raise_for_status()
+        return res.json().get("id")
+
     @staticmethod
     def create_payment_key_data(token, order_id, amount, user):
         name = getattr(user, "name", "User Customer").split(maxsplit=1)
@@ -87,7 +98,7 @@ class PaymentHelper:
         return {
             "auth_token": token,
             "amount_cents": str(amount),
-            "expiration": 3600,
+            "expiration": PAYMENT_KEY_EXPIRATION,
             "order_id": order_id,
             "currency": CURRENCY,
             "integration_id": PAYMOB_INTEGRATION_ID,
@@ -111,57 +122,110 @@ class PaymentHelper:
 @csrf_exempt
 @handle_exceptions
 def get_payment_key(request, order_id):
+    booking = Booking.objects.select_related('user').get(payment_order_id=order_id)
+    if booking.status != 'PENDING':
+        return JsonResponse({"error": "Booking is not awaiting payment"}, status=409)
+
+    # Keys stay valid for their whole expiration, so a reloaded checkout reuses the one already issued
+    cache_key = payment_key_cache_key(order_id)
+    payment_key = cache.get(cache_key)
+    if payment_key:
+        metrics.incr('payment_key_cache_hits')
+        return JsonResponse({"payment_key": payment_key}, status=200)
+
     token = PaymentHelper.get_auth_token()
     if not token:
         return JsonResponse({"error": "Auth failed"}, status=500)
-    order_res = requests.get(f"{PAYMOB_ORDER_URL}/{order_id}", headers={"Authorization": f"Bearer {token}"})
-    if order_res.status_code != 200:
-        return JsonResponse({"error": "Invalid order_id"}, status=400)
-    amount = order_res.json().get("amount_cents")
-    booking = Booking.objects.get(payment_order_id=order_id)
-    user = booking.user
-    key_data = PaymentHelper.create_payment_key_data(token, order_id, amount, user)
+    amount = int(booking.total_price * 100)  # The order was registered for exactly the booking total
+    if PAYMENT_VERIFY_ORDER:
+        order_res = requests.get(f"{PAYMOB_ORDER_URL}/{order_id}", headers={"Authorization": f"Bearer {token}"}, timeout=10)
+        if order_res.status_code != 200:
+            return JsonResponse({"error": "Invalid order_id"}, status=400)
+        if int(float(order_res.json().get("amount_cents", 0))) != amount:
+            logger.warning(f"Order {order_id} amount {order_res.json().get('amount_cents')} does not match booking {booking.id}")
+            return JsonResponse({"error": "Order amount does not match booking"}, status=400)
+    key_data = PaymentHelper.create_payment_key_data(token, order_id, amount, booking.user)
     res = requests.post(PAYMOB_PAYMENT_KEY_URL, json=key_data, headers={
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
-    })
+    }, timeout=10)
     res.raise_for_status()
     payment_key = res.json().get("token")
     if not payment_key:
         return JsonResponse({"error": "No payment key"}, status=500)
+    cache.set(cache_key, payment_key, timeout=max(PAYMENT_KEY_EXPIRATION - PAYMENT_KEY_CACHE_MARGIN, 1))
+    metrics.incr('payment_keys_issued')
     return JsonResponse({"payment_key": payment_key}, status=200)
 
+def callback_params(request):
+    return dict(request.GET.items()) if request.method == "GET" else json.loads(request.body.decode())
+
+# Transaction fields Paymob signs, in order; nested ones are dotted paths into the processed callback's
+# "obj" and flat keys of the response callback's query string
+HMAC_FIELDS = [
+    'amount_cents', 'created_at', 'currency', 'error_occured', 'has_parent_transaction', 'id', 'integration_id',
+    'is_3d_secure', 'is_auth', 'is_capture', 'is_refunded', 'is_standalone_payment', 'is_voided', 'order.id',
+    'owner', 'pending', 'source_data.pan', 'source_data.sub_type', 'source_data.type', 'success',
+]
+
+def _hmac_value(params, field):
+    if field in params:
+        value = params[field]
+    elif field == 'order.id' and 'order' in params and not isinstance(params['order'], dict):
+        value = params['order']
+    else:
+        value = params
+        for part in field.split('.'):
+            value = value.get(part, '') if isinstance(value, dict) else ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '' if value is None else str(value)
+
+def callback_signature(params):
+    """The HMAC-SHA512 Paymob sends with a callback for these transaction fields."""
+    if isinstance(params, dict) and isinstance(params.get('obj'), dict):
+        params = params['obj']
+    message = ''.join(_hmac_value(params, field) for field in HMAC_FIELDS)
+    return hmac.new(PAYMOB_HMAC_SECRET.encode(), message.encode(), hashlib.sha512).hexdigest()
+
+def verified_callback_params(request):
+    """The callback's fields, or None when its hmac doesn't match: anyone can reach these URLs."""
+    params = callback_params(request)
+    received = request.GET.get('hmac', '')
+    if not isinstance(params, dict) or not received or not hmac.compare_digest(received, callback_signature(params)):
+        metrics.incr('payment_callbacks_forged')
+        return None
+    return params
+
+# Both callbacks only validate and store the event (booking/payment_events.py applies it), so the
+# gateway gets its answer without waiting on row locks, ticket rendering or email.
 @csrf_exempt
 @handle_exceptions
 def paymob_processed_callback(request):
-    params = dict(request.GET.items()) if request.method == "GET" else json.loads(request.body.decode())
-    if isinstance(params, dict) and 'obj' in params:
-        params = params['obj']
-    order_id = params.get("order")
-    transaction_success = str(params.get("success")).lower() == "true"
-    transaction_id = params.get("id")
-    booking = Booking.objects.get(payment_order_id=order_id)
-    update_booking_status(booking, transaction_success, transaction_id)
+    params = verified_callback_params(request)
+    if params is None:
+        return JsonResponse({"error": "Invalid signature"}, status=403)
+    try:
+        event = payment_events.record('PROCESSED', params)
+    except ValueError as e:
+        return JsonResponse({"error": f"Invalid callback: {e}"}, status=400)
     return JsonResponse({
-        "message": "Booking updated",
-        "status": booking.payment_status,
-        "transaction_id": transaction_id,
+        "message": "Event accepted",
+        "transaction_id": event.transaction_id,
     }, status=200)
 
 @csrf_exempt
 @handle_exceptions
 def paymob_response_callback(request):
-    params = dict(request.GET.items()) if request.method == "GET" else json.loads(request.body.decode())
-    order_id = params.get("order")
-    transaction_success = str(params.get("success")).lower() == "true"
-    booking = Booking.objects.get(payment_order_id=order_id)
-    update_booking_status(booking, transaction_success, params.get("id"))
-    if transaction_success:
-        pdf_path = f'tickets/ticket-{booking.id}.pdf'
-        default_storage.save(pdf_path, ContentFile(b''))
-        generate_ticket_pdf(booking, default_storage.path(pdf_path))
-        send_ticket_email(booking, default_storage.path(pdf_path))
-        default_storage.delete(pdf_path)
+    params = verified_callback_params(request)
+    if params is None:
+        return JsonResponse({"error": "Invalid signature"}, status=403)
+    try:
+        event = payment_events.record('RESPONSE', params)
+    except ValueError as e:
+        return JsonResponse({"error": f"Invalid callback: {e}"}, status=400)
+    # An order we don't know still sends the customer back to the frontend
+    booking_id = Booking.objects.filter(payment_order_id=event.order_id).values_list('id', flat=True).first()
     frontend_url = "https://busbooking-virid.vercel.app/booking-success"
-    redirect_url = f"{frontend_url}?order_id={booking.id}&success={transaction_success}"
-    return redirect(redirect_url)
\ No newline at end of file
+    redirect_url = f"{frontend_url}?order_id={booking_id or ''}&success={event.success}"
+    return redirect(redirect_url)
@@ -5,6 +5,10 @@ from ..models import City, Trip
 from ..serializers import TripSerializer
 from django.db.models.functions import TruncDate
 from datetime import datetime
+from ..autocomplete import get_index
+from ..utils import shared_cache
+from .. import search_cache
+from ..encoders import TRIP_FIELDS, accepts_fast_json, json_response, render_trip_rows
 
 # Location List View
 class LocationListView(generics.ListAPIView):
@@ -18,47 +22,117 @@ class LocationListView(generics.ListAPIView):
         ]
         return Response({'cities': data}, status=status.HTTP_200_OK)
 
+# Location Autocomplete View: ?q= prefix, optional ?type=city|area, ?city= (area suggestions within a city), ?limit=
+class LocationAutocompleteView(generics.GenericAPIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        kind = request.query_params.get('type') or None
+        if kind not in (None, 'city', 'area'):
+            return Response({'error': 'type must be city or area'}, status=status.HTTP_400_BAD_REQUEST)
+        city = request.query_params.get('city', '')
+        limit = request.query_params.get('limit', '10')
+        limit = min(int(limit), 50) if limit.isdigit() and int(limit) > 0 else 10
+        index = get_index()
+        matches = index.search(request.query_params.get('q', ''), kind, city_id=int(city) if city.isdigit() else None, limit=limit)
+        return Response({'results': [index.describe(*match) for match in matches]}, status=status.HTTP_200_OK)
+
 # Trip Search View
 class TripSearchView(generics.ListAPIView):
     serializer_class = TripSerializer
     permission_classes = [AllowAny]
 
     def get_queryset(self):
-        start_city = self.request.query_params.get('start_city', '')
-        start_area = self.request.query_params.get('start_area', '')
-        destination_city = self.request.query_params.get('destination_city', '')
-        destination_area = self.request.query_params.get('destination_area', '')
-        departure_date = self.request.query_params.get('departure_date', None)
+        criteria = self._criteria()
+        start_city, start_area, destination_city, destination_area = (
+            self.request.query_params.get(name, '')
+            for name in ('start_city', 'start_area', 'destination_city', 'destination_area'))
 
-        queryset = Trip.objects.filter(available_seats__gt=0)
+        # Sold-out trips are hidden unless asked for (e.g. to join their waitlist); cancelled ones always are
+        queryset = Trip.objects.filter(cancelled_at__isnull=True)
+        if not criteria['include_sold_out']:
+            queryset = queryset.filter(available_seats__gt=0)
 
-        if start_city:
-            if start_city.isdigit():
-                queryset = queryset.filter(start_location__city_id=start_city)
-            else:
-                queryset = queryset.filter(start_location__city__name__icontains=start_city)
-        if start_area:
-            if start_area.isdigit():
-                queryset = queryset.filter(start_location_id=start_area)
-            else:
-                queryset = queryset.filter(start_location__name__icontains=start_area)
+        # Typed names are resolved to ids through the autocomplete index; icontains is only the
+        # fallback for text the index has no prefix match for (e.g. the middle of a word)
+        if criteria['start_city_ids'] is not None:
+            queryset = queryset.filter(start_location__city_id__in=criteria['start_city_ids'])
+        elif start_city:
+            queryset = queryset.filter(start_location__city__name__icontains=start_city)
+        if criteria['start_area_ids'] is not None:
+            queryset = queryset.filter(start_location_id__in=criteria['start_area_ids'])
+        elif start_area:
+            queryset = queryset.filter(start_location__name__icontains=start_area)
 
-        if destination_city:
-            if destination_city.isdigit():
-                queryset = queryset.filter(destination__city_id=destination_city)
-            else:
-                queryset = queryset.filter(destination__city__name__icontains=destination_city)
-        if destination_area:
-            if destination_area.isdigit():
-                queryset = queryset.filter(destination_id=destination_area)
-            else:
-                queryset = queryset.filter(destination__name__icontains=destination_area)
+        if criteria['destination_city_ids'] is not None:
+            queryset = queryset.filter(destination__city_id__in=criteria['destination_city_ids'])
+        elif destination_city:
+            queryset = queryset.filter(destination__city__name__icontains=destination_city)
+        if criteria['destination_area_ids'] is not None:
+            queryset = queryset.filter(destination_id__in=criteria['destination_area_ids'])
+        elif destination_area:
+            queryset = queryset.filter(destination__name__icontains=destination_area)
 
-        if departure_date:
+        if criteria['day'] is not None:
+            queryset = queryset.annotate(date_only=TruncDate('departure_date')).filter(date_only=criteria['day'])
+        elif self.request.query_params.get('departure_date'):
+            queryset = queryset.none()  # Unparseable date
+
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        if not accepts_fast_json(request):
+            return super().list(request, *args, **kwargs)
+        # Searches by resolved route and day are served from the search cache (booking/search_cache.py)
+        key = self._cache_key()
+        body = search_cache.get(key) if key else None
+        if body is None:
+            # One values() query rendered straight to JSON, same bytes as TripSerializer
+            body = render_trip_rows(self.get_queryset().values_list(*TRIP_FIELDS))
+            if key:
+                search_cache.put(key, body)
+        return json_response(body)
+
+    def _criteria(self):
+        """The query resolved to ids (None where a value falls back to icontains or is absent), memoized per request."""
+        if getattr(self, '_resolved', None) is None:
+            params = self.request.query_params
+            start_city_ids = self._resolve(params.get('start_city', ''), 'city')
+            destination_city_ids = self._resolve(params.get('destination_city', ''), 'city')
             try:
-                date_obj = datetime.strptime(departure_date, '%Y-%m-%d').date()
-                queryset = queryset.annotate(date_only=TruncDate('departure_date')).filter(date_only=date_obj)
+                day = datetime.strptime(params['departure_date'], '%Y-%m-%d').date() if params.get('departure_date') else None
             except ValueError:
-                queryset = queryset.none()
+                day = None
+            self._resolved = {
+                'start_city_ids': start_city_ids,
+                'start_area_ids': self._resolve(params.get('start_area', ''), 'area', start_city_ids),
+                'destination_city_ids': destination_city_ids,
+                'destination_area_ids': self._resolve(params.get('destination_area', ''), 'area', destination_city_ids),
+                'day': day,
+                'include_sold_out': params.get('include_sold_out', '').lower() in ('1', 'true'),
+            }
+        return self._resolved
+
+    def _cache_key(self):
+        criteria = self._criteria()
+        params = self.request.query_params
+        # A value the index couldn't resolve is matched with icontains, which the cache can't key on
+        for ids, name in ((criteria['start_area_ids'], 'start_area'), (criteria['destination_area_ids'], 'destination_area')):
+            if ids is None and params.get(name):
+                return None
+        return search_cache.cache_key(**criteria)
 
-        return queryset
\ No newline at end of file
+    def _resolve(self, value, kind, city_ids=None):
+        """
+        Ids for an id or a typed name, or None when the caller should fall back to icontains. Names
+        are only resolved through the index when its invalidation reaches every process (a shared
+        cache); a per-process index can miss locations added elsewhere and would drop their trips.
+        """
+        if not value:
+            return None
+        if value.isdigit():
+            return [int(value)]
+        if not shared_cache():
+            return None
+        city_id = city_ids[0] if city_ids and len(city_ids) == 1 else None
+        return get_index().resolve(value, kind, city_id=city_id) or None
@@ -5,15 +5,20 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.contrib.auth import authenticate
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
-from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.contrib.auth.tokens import default_token_generator
 from django.conf import settings
 from ..models import User, Booking
-from ..serializers import UserSerializer, LightweightBookingSerializer
-from django.core.mail import send_mail
+from ..serializers import UserSerializer, LightweightBookingSerializer, LightweightArchivedBookingSerializer
+from ..archive import user_history
+from ..encoders import (BOOKING_LIST_FIELDS, ARCHIVED_BOOKING_LIST_FIELDS, accepts_fast_json, json_response,
+                        render, booking_list_rows)
+from django.core.mail import EmailMultiAlternatives
 from django.utils.timezone import now
 from rest_framework_simplejwt.tokens import RefreshToken
+from ..tokens import FilteredRefreshToken
+from ..mail import dispatcher, render_template
+from ..throttling import (LoginIPThrottle, LoginAccountThrottle, PasswordResetIPThrottle, PasswordResetAccountThrottle)
 
 # User Registration View
 class RegisterView(generics.CreateAPIView):
@@ -37,6 +42,7 @@ class RegisterView(generics.CreateAPIView):
 # User Login View
 class LoginView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [LoginIPThrottle, LoginAccountThrottle]
 
     def post(self, request):
         email = request.data.get('email')
@@ -63,7 +69,7 @@ class LogoutView(APIView):
     def post(self, request):
         try:
             refresh_token = request.data.get('refresh')
-            token = RefreshToken(refresh_token)
+            token = FilteredRefreshToken(refresh_token)
             token.blacklist()
             return Response({'message': 'Logout successful'}, status=status.HTTP_200_OK)
         except Exception as e:
@@ -72,6 +78,7 @@ class LogoutView(APIView):
 # Request Password Reset
 class PasswordResetRequestView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [PasswordResetIPThrottle, PasswordResetAccountThrottle]
 
     def post(self, request):
         email = request.data.get('email')
@@ -90,7 +97,7 @@ class PasswordResetRequestView(APIView):
             else:
                 reset_link = f"https://busbooking-virid.vercel.app/reset-password?uid={uid}&token={token}"
 
-            html_message = render_to_string('email/password_reset.html', {
+            html_message = render_template('email/password_reset.html', {
                 'user': user,
                 'reset_link': reset_link,
                 'valid_hours': 24
@@ -98,14 +105,14 @@ class PasswordResetRequestView(APIView):
 
             plain_message = strip_tags(html_message)
 
-            send_mail(
+            message = EmailMultiAlternatives(
                 subject='Reset Your Password',
-                message=plain_message,
+                body=plain_message,
                 from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[email],
-                html_message=html_message,
-                fail_silently=False,
+                to=[email],
             )
+            message.attach_alternative(html_message, 'text/html')
+            dispatcher.enqueue(message)
             return Response({'message': 'Password reset link sent to your email'}, status=status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response({'message': 'Password reset link sent to your email'}, status=status.HTTP_200_OK)
@@ -157,14 +164,17 @@ class UserProfileView(APIView):
         limit = int(request.query_params.get('limit', 5))
         offset = (page - 1) * limit
 
-        bookings = Booking.objects.filter(user=user).select_related(
-            'trip__start_location__city',
-            'trip__destination__city'
-        ).order_by('-booking_date')[offset:offset + limit]
-
-        bookings_serializer = LightweightBookingSerializer(bookings, many=True)
-
-        total_bookings = Booking.objects.filter(user=user).count()
+        # Live and archived bookings, merged newest first
+        fast = accepts_fast_json(request)
+        if fast:
+            rows, total_bookings = user_history(user, offset, limit, BOOKING_LIST_FIELDS, ARCHIVED_BOOKING_LIST_FIELDS)
+            bookings_data = booking_list_rows(rows)
+        else:
+            bookings, total_bookings = user_history(user, offset, limit)
+            bookings_data = [
+                (LightweightBookingSerializer if isinstance(booking, Booking) else LightweightArchivedBookingSerializer)(booking).data
+                for booking in bookings
+            ]
 
         profile_data = {
             'user': {
@@ -174,7 +184,7 @@ class UserProfileView(APIView):
                 'phone_number': user.phone_number,
                 'user_type': user.user_type
             },
-            'bookings': bookings_serializer.data,
+            'bookings': bookings_data,
             'pagination': {
                 'total': total_bookings,
                 'page': page,
@@ -183,4 +193,6 @@ class UserProfileView(APIView):
             }
         }
 
+        if fast:
+            return json_response(render(profile_data))
         return Response(profile_data, status=status.HTTP_200_OK)
\ No newline at end of file
@@ -0,0 +1,90 @@
+import requests
+from django.db import IntegrityError
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from ..models import Trip, WaitlistEntry
+from ..signals import seats_released
+from .. import waitlist
+from .payment import PaymentHelper
+
+
+def _entry_data(entry):
+    data = {'id': entry.id, 'trip': entry.trip_id, 'seats_requested': entry.seats_requested, 'status': entry.status}
+    if entry.status == 'WAITING':
+        data['position'] = waitlist.position(entry)
+    elif entry.booking:
+        booking = entry.booking
+        data['booking'] = {
+            'id': booking.id, 'selected_seats': booking.selected_seats, 'status': booking.status,
+            'total_price': str(booking.total_price), 'expires_at': booking.expires_at,
+            'order_id': booking.payment_order_id,
+        }
+    return data
+
+
+# Join / inspect / leave the waitlist of a trip
+class WaitlistView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def _current(self, request, trip_id):
+        return (WaitlistEntry.objects.select_related('booking').filter(trip_id=trip_id, user=request.user)
+                .exclude(status='LEFT').order_by('-id').first())
+
+    def get(self, request, trip_id):
+        entry = self._current(request, trip_id)
+        if not entry:
+            return Response({"error": "You are not on this trip's waitlist"}, status=404)
+        return Response({"waitlist": _entry_data(entry)}, status=200)
+
+    def post(self, request, trip_id):
+        trip = get_object_or_404(Trip.objects.only('id', 'total_seats', 'available_seats', 'departure_date', 'cancelled_at'), id=trip_id)
+        if trip.cancelled_at or trip.departure_date <= timezone.now():
+            return Response({"error": "This trip is no longer running"}, status=400)
+        try:
+            seats = int(request.data.get('seats', 1))
+        except (TypeError, ValueError):
+            seats = 0
+        if not 0 < seats <= trip.total_seats:
+            return Response({"error": "Invalid number of seats"}, status=400)
+        current = self._current(request, trip_id)
+        if current is not None and current.status == 'WAITING':
+            return Response({"error": "You are already on this trip's waitlist"}, status=400)
+        entry = WaitlistEntry.objects.create(trip=trip, user=request.user, seats_requested=seats)
+        if trip.available_seats:
+            # Seats came back between the search and the join: run the matcher right away
+            seats_released.send(sender=Trip, trip_id=trip.id)
+        return Response({"message": "Added to waitlist", "waitlist": _entry_data(entry)}, status=201)
+
+    def delete(self, request, trip_id):
+        updated = WaitlistEntry.objects.filter(trip_id=trip_id, user=request.user, status='WAITING').update(status='LEFT')
+        if not updated:
+            return Response({"error": "You are not waiting on this trip"}, status=404)
+        return Response({"message": "Removed from waitlist"}, status=200)
+
+
+# Pay for seats offered from the waitlist: creates the Paymob order for the held booking
+class WaitlistClaimView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, trip_id):
+        entry = get_object_or_404(
+            WaitlistEntry.objects.select_related('booking__trip__start_location__city', 'booking__trip__destination__city'),
+            trip_id=trip_id, user=request.user, status='OFFERED', booking__status='PENDING'
+        )
+        booking = entry.booking
+        if not booking.payment_order_id:
+            try:
+                order_id = PaymentHelper.create_order(booking.trip, booking.selected_seats)
+            except requests.RequestException as e:
+                return Response({"error": str(e)}, status=502)
+            if not order_id:
+                return Response({"error": "Payment auth failed"}, status=500)
+            booking.payment_order_id = order_id
+            try:
+                booking.save(update_fields=['payment_order_id'])
+            except IntegrityError:
+                return Response({"error": "Order already registered"}, status=409)
+        return Response({"waitlist": _entry_data(entry), "order_id": booking.payment_order_id}, status=200)
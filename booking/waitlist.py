@@ -0,0 +1,117 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.mail import EmailMessage
+from django.db import connections, transaction
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.timezone import localtime
+from . import metrics
+from .mail import dispatcher
+from .models import Booking, Trip, WaitlistEntry
+from .seating import pick_seats
+from .signals import seats_released
+
+logger = logging.getLogger(__name__)
+
+# One matcher thread per process: matches are serialized per trip by the row lock anyway,
+# and a single thread keeps released-seat bursts from fanning out into parallel transactions.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='waitlist')
+
+
+def position(entry):
+    # Queue order is (created_at, id): a requeued entry (see WaitlistEntry.requeue_unclaimed) is at the back
+    ahead = Q(created_at__lt=entry.created_at) | Q(created_at=entry.created_at, id__lte=entry.id)
+    return WaitlistEntry.objects.filter(ahead, trip_id=entry.trip_id, status='WAITING').count()
+
+
+def match_trip(trip_id):
+    """
+    Offer a trip's free seats to its waitlist in FIFO order, in one transaction holding the trip
+    lock. Every entry that fits gets a PENDING booking on the best seats, held for
+    WAITLIST_OFFER_MINUTES, and an email. Entries asking for more seats than are left keep
+    their place for the next release. Returns the number of offers made.
+    """
+    offers = []
+    with transaction.atomic():
+        trip = Trip.objects.select_for_update().select_related('layout').get(pk=trip_id)
+        if not trip.available_seats:
+            return 0
+        entries = (WaitlistEntry.objects.select_for_update().select_related('user')
+                   .filter(trip_id=trip_id, status='WAITING').order_by('created_at', 'id')
+                   [:settings.WAITLIST_MATCH_BATCH])
+        free, available = trip.free_bitmap, trip.available_seats
+        expires_at = timezone.now() + timezone.timedelta(minutes=settings.WAITLIST_OFFER_MINUTES)
+        for entry in entries:
+            if entry.seats_requested > available:
+                continue
+            seats = pick_seats(free, trip.total_seats, entry.seats_requested, seats_per_row=trip.layout.seats_per_row)
+            if not seats:
+                continue
+            booking = Booking(
+                user=entry.user, trip=trip, seats_booked=len(seats), selected_seats=seats,
+                customer_name=entry.user.name, customer_phone=entry.user.phone_number, payment_type='ONLINE',
+            )
+            try:
+                booking.save()  # Re-locks the same row inside this transaction and books the seats
+            except ValidationError as e:
+                logger.warning(f"Waitlist offer for entry {entry.id} failed: {e}")
+                continue
+            booking.expires_at = expires_at
+            booking.save(update_fields=['expires_at'])
+            for seat in seats:
+                free &= ~(1 << (seat - 1))
+            available -= len(seats)
+            entry.status, entry.booking, entry.offered_at = 'OFFERED', booking, timezone.now()
+            entry.save(update_fields=['status', 'booking', 'offered_at'])
+            offers.append(entry)
+            if not available:
+                break
+    for entry in offers:
+        notify_offer(entry)
+    metrics.incr('waitlist_offers', len(offers))
+    return len(offers)
+
+
+def notify_offer(entry):
+    booking = entry.booking
+    body = (f"Dear {entry.user.name},\n\n"
+            f"Seats {', '.join(booking.seat_labels)} on {booking.trip} are now held for you "
+            f"until {localtime(booking.expires_at):%a, %b %d, %I:%M %p}.\n"
+            f"Open your waitlist in the app to complete payment (booking #{booking.id}).")
+    dispatcher.enqueue(EmailMessage(
+        subject='Seats are available on your trip', body=body,
+        from_email=settings.EMAIL_HOST_USER, to=[entry.user.email],
+    ))
+
+
+def _match_in_background(trip_id):
+    try:
+        match_trip(trip_id)
+    except Exception:
+        logger.exception(f"Waitlist matching failed for trip {trip_id}")
+    finally:
+        connections.close_all()
+
+
+@receiver(seats_released)
+def on_seats_released(sender, trip_id, **kwargs):
+    if not WaitlistEntry.objects.filter(trip_id=trip_id, status='WAITING').exists():
+        return
+    if settings.WAITLIST_MATCH_ASYNC:
+        _executor.submit(_match_in_background, trip_id)
+    else:
+        match_trip(trip_id)
+
+
+def match_all(limit=None):
+    """Sweep every trip with waiting users and free seats (catches releases missed by a restart)."""
+    trip_ids = (WaitlistEntry.objects.filter(status='WAITING', trip__available_seats__gt=0,
+                                             trip__departure_date__gt=timezone.now(), trip__cancelled_at__isnull=True)
+                .values_list('trip_id', flat=True).distinct())
+    offered = 0
+    for trip_id in trip_ids[:limit] if limit else trip_ids:
+        offered += match_trip(trip_id)
+    return offered
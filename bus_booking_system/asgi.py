@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bus_booking_system.settings')
 
 application = get_asgi_application()
+
+# The maintenance scheduler runs inside the server processes only (when SCHEDULER_AUTOSTART is on)
+from booking.scheduler import start_in_background  # noqa: E402
+
+start_in_background()
@@ -33,6 +33,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'booking.profiling.ProfilingMiddleware',  # Removes itself unless PROFILING_ENABLED
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -117,6 +118,14 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated',],
+    # Sliding-window limits for the credential endpoints (see booking/throttling.py)
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': config('THROTTLE_LOGIN_IP', default='20/m'),
+        'login_account': config('THROTTLE_LOGIN_ACCOUNT', default='5/m'),
+        'password_reset_ip': config('THROTTLE_PASSWORD_RESET_IP', default='5/h'),
+        'password_reset_account': config('THROTTLE_PASSWORD_RESET_ACCOUNT', default='3/h'),
+    },
+    'NUM_PROXIES': config('NUM_PROXIES', default=None, cast=lambda v: None if v in (None, '') else int(v)),
 }
 
 # JWT settings
@@ -125,8 +134,13 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_REFRESH_SERIALIZER': 'booking.tokens.FilteredTokenRefreshSerializer',
 }
 
+# Revoked-token filter rebuild interval (seconds) and false-positive rate, see booking/tokens.py
+TOKEN_FILTER_REBUILD_SECONDS = config('TOKEN_FILTER_REBUILD_SECONDS', default=300, cast=int)
+TOKEN_FILTER_ERROR_RATE = config('TOKEN_FILTER_ERROR_RATE', default=0.01, cast=float)
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:8000",  # Django dev server
@@ -153,7 +167,8 @@ CSRF_TRUSTED_ORIGINS = [
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
 CORS_ALLOW_HEADERS = ['accept','accept-encoding','authorization','content-type','dnt','origin','user-agent',
-    'x-csrftoken','x-requested-with',]
+    'x-csrftoken','x-requested-with','x-admission-ticket',]
+CORS_EXPOSE_HEADERS = ['retry-after', 'x-admission-ticket']
 
 # Custom user model
 AUTH_USER_MODEL = 'booking.User'
@@ -165,6 +180,17 @@ EMAIL_PORT = config('EM_PORT')
 EMAIL_USE_TLS = config('EM_USE_TLS')
 EMAIL_HOST_USER = config('EM_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EM_HOST_PASSWORD')
+# Used when EM_BACKEND is django.core.mail.backends.filebased.EmailBackend (local runs and tests)
+EMAIL_FILE_PATH = config('EM_FILE_PATH', default=str(BASE_DIR / 'sent_emails'))
+
+# Outbound mail dispatcher (booking/mail.py). Set MAIL_DISPATCH_ASYNC=False to send inline.
+MAIL_DISPATCH_ASYNC = config('MAIL_DISPATCH_ASYNC', default=True, cast=bool)
+MAIL_DISPATCH_WORKERS = config('MAIL_DISPATCH_WORKERS', default=1, cast=int)
+MAIL_DISPATCH_BATCH_SIZE = config('MAIL_DISPATCH_BATCH_SIZE', default=50, cast=int)
+MAIL_DISPATCH_MAX_RETRIES = config('MAIL_DISPATCH_MAX_RETRIES', default=3, cast=int)
+MAIL_DISPATCH_RETRY_DELAY = config('MAIL_DISPATCH_RETRY_DELAY', default=2, cast=float)
+MAIL_DISPATCH_IDLE_TIMEOUT = config('MAIL_DISPATCH_IDLE_TIMEOUT', default=30, cast=float)
+MAIL_DISPATCH_RATE = config('MAIL_DISPATCH_RATE', default=20, cast=float)  # Messages per second per process, 0 = unlimited
 
 # Cache settings
 CACHES = {
@@ -178,6 +204,114 @@ CACHES = {
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'  # Directory for collected static files
 
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Rendered tickets are content-addressed by booking fingerprint, see booking/tickets.py
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'tickets': {
+        'BACKEND': config('TICKET_STORAGE_BACKEND', default='django.core.files.storage.FileSystemStorage'),
+        'OPTIONS': {'location': config('TICKET_STORAGE_LOCATION', default=str(BASE_DIR / 'media' / 'tickets'))},
+    },
+}
+TICKET_CACHE_MAX_BYTES = config('TICKET_CACHE_MAX_BYTES', default=32 * 1024 * 1024, cast=int)
+
+# Seat-change stream (booking/seat_events.py): how long deltas stay replayable and stream timings
+SEAT_EVENTS_TTL = config('SEAT_EVENTS_TTL', default=900, cast=int)
+SEAT_EVENTS_MAX_REPLAY = config('SEAT_EVENTS_MAX_REPLAY', default=200, cast=int)
+SEAT_STREAM_POLL_SECONDS = config('SEAT_STREAM_POLL_SECONDS', default=2, cast=float)
+SEAT_STREAM_KEEPALIVE_SECONDS = config('SEAT_STREAM_KEEPALIVE_SECONDS', default=20, cast=float)
+SEAT_STREAM_MAX_SECONDS = config('SEAT_STREAM_MAX_SECONDS', default=300, cast=float)
+SEAT_STREAM_RETRY_MS = config('SEAT_STREAM_RETRY_MS', default=3000, cast=int)
+
+# Waitlist (booking/waitlist.py): how long offered seats are held and how many entries one match step serves
+WAITLIST_OFFER_MINUTES = config('WAITLIST_OFFER_MINUTES', default=15, cast=int)
+WAITLIST_MATCH_BATCH = config('WAITLIST_MATCH_BATCH', default=50, cast=int)
+WAITLIST_MATCH_ASYNC = config('WAITLIST_MATCH_ASYNC', default=True, cast=bool)
+
+# Maintenance scheduler (booking/scheduler.py): one leader across all processes runs the jobs in booking/jobs.py.
+# Deployments must either set SCHEDULER_AUTOSTART, which runs it as a thread in each process started through
+# wsgi.py/asgi.py, or run `manage.py run_scheduler` separately: nothing else expires pending bookings.
+SCHEDULER_AUTOSTART = config('SCHEDULER_AUTOSTART', default=False, cast=bool)
+SCHEDULER_TICK_SECONDS = config('SCHEDULER_TICK_SECONDS', default=5, cast=float)
+SCHEDULER_LEADER_LOCK = config('SCHEDULER_LEADER_LOCK', default='auto')  # auto | db | cache
+SCHEDULER_LEASE_SECONDS = config('SCHEDULER_LEASE_SECONDS', default=30, cast=int)
+SCHEDULER_EXPIRY_BATCH = config('SCHEDULER_EXPIRY_BATCH', default=500, cast=int)
+SCHEDULER_JOB_INTERVALS = {
+    'expire_bookings': config('SCHEDULER_EXPIRY_SECONDS', default=5, cast=float),
+    'match_waitlists': config('SCHEDULER_WAITLIST_SECONDS', default=60, cast=float),
+    'prune_tokens': config('SCHEDULER_PRUNE_TOKENS_SECONDS', default=3600, cast=float),
+    'archive_trips': config('SCHEDULER_ARCHIVE_SECONDS', default=3600, cast=float),
+    'reconcile_payments': config('SCHEDULER_RECONCILE_SECONDS', default=60, cast=float),
+    'payment_events': config('SCHEDULER_PAYMENT_EVENTS_SECONDS', default=2, cast=float),
+    'check_inventory': config('SCHEDULER_INVENTORY_SECONDS', default=86400, cast=float),
+}
+
+# Payment reconciliation (booking/reconcile.py): pending online bookings older than this are looked up at the gateway
+RECONCILE_AFTER_MINUTES = config('RECONCILE_AFTER_MINUTES', default=3, cast=int)
+RECONCILE_BATCH_SIZE = config('RECONCILE_BATCH_SIZE', default=200, cast=int)
+RECONCILE_WORKERS = config('RECONCILE_WORKERS', default=8, cast=int)
+RECONCILE_TIMEOUT = config('RECONCILE_TIMEOUT', default=10, cast=float)
+# Expired bookings whose payment the gateway reports in progress are kept this long before expiry cancels them anyway;
+# they are asked about again once per SCHEDULER_RECONCILE_SECONDS
+RECONCILE_EXPIRY_GRACE_MINUTES = config('RECONCILE_EXPIRY_GRACE_MINUTES', default=15, cast=int)
+
+# Payment callback ingestion (booking/payment_events.py): events are applied in batches by the scheduler job,
+# and also right after they arrive by a background thread in the receiving process
+PAYMENT_EVENTS_BATCH = config('PAYMENT_EVENTS_BATCH', default=200, cast=int)
+PAYMENT_EVENTS_CONSUME_ON_RECEIVE = config('PAYMENT_EVENTS_CONSUME_ON_RECEIVE', default=True, cast=bool)
+
+# Archival (booking/archive.py): trips departed this many days ago move, with their bookings, to the archive tables
+ARCHIVE_AFTER_DAYS = config('ARCHIVE_AFTER_DAYS', default=30, cast=int)
+ARCHIVE_BATCH_SIZE = config('ARCHIVE_BATCH_SIZE', default=200, cast=int)
+
+# Seat inventory check (booking/inventory.py): trips whose seat columns drifted from their bookings are repaired
+# INVENTORY_REPAIR_BATCH trips per locked transaction by the nightly job when INVENTORY_AUTO_REPAIR is on
+INVENTORY_CHUNK_SIZE = config('INVENTORY_CHUNK_SIZE', default=1000, cast=int)  # Trips per keyset chunk of the check
+INVENTORY_REPAIR_BATCH = config('INVENTORY_REPAIR_BATCH', default=100, cast=int)
+INVENTORY_AUTO_REPAIR = config('INVENTORY_AUTO_REPAIR', default=True, cast=bool)
+
+# Trip search result cache (booking/search_cache.py): searches by city ids/names and a day are cached until a trip
+# on one of their routes that day changes; `manage.py warm_search_cache` fills the busiest ones after a deploy.
+# It stays off unless CACHES is shared by every process (Redis/Memcached): per-process locmem would serve stale seats.
+SEARCH_CACHE_TIMEOUT = config('SEARCH_CACHE_TIMEOUT', default=300, cast=int)
+SEARCH_CACHE_MAX_ROUTES = config('SEARCH_CACHE_MAX_ROUTES', default=16, cast=int)
+SEARCH_WARM_DAYS = config('SEARCH_WARM_DAYS', default=7, cast=int)
+
+# Admin changelists of the big tables (booking/pagination.py): above this planner estimate an unfiltered list shows
+# the estimate instead of running COUNT(*), and filtered lists count at most ADMIN_COUNT_LIMIT rows
+ADMIN_ESTIMATE_COUNT_ABOVE = config('ADMIN_ESTIMATE_COUNT_ABOVE', default=100000, cast=int)
+ADMIN_COUNT_LIMIT = config('ADMIN_COUNT_LIMIT', default=10000, cast=int)
+
+# Booking admission control (booking/admission.py): at most ADMISSION_CONCURRENCY booking requests per trip run at
+# once (0 = off; also off unless CACHES is shared by every process); the rest queue with a ticket. A slot lease
+# outlives a crashed worker by ADMISSION_LEASE_SECONDS
+ADMISSION_CONCURRENCY = config('ADMISSION_CONCURRENCY', default=8, cast=int)
+ADMISSION_LEASE_SECONDS = config('ADMISSION_LEASE_SECONDS', default=30, cast=int)
+ADMISSION_STALL_SECONDS = config('ADMISSION_STALL_SECONDS', default=10, cast=float)
+ADMISSION_TICKET_MAX_AGE = config('ADMISSION_TICKET_MAX_AGE', default=900, cast=int)
+ADMISSION_SERVICE_SECONDS = config('ADMISSION_SERVICE_SECONDS', default=0.5, cast=float)  # Initial wait estimate per request
+
+# Sampling profiler (booking/profiling.py): off by default. When enabled it profiles PROFILING_SAMPLE_RATE of
+# requests plus any request sending `X-Profile: <PROFILING_TOKEN>`; summarize with `manage.py profile_summary`
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=False, cast=bool)
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.0, cast=float)
+PROFILING_TOKEN = config('PROFILING_TOKEN', default='')
+PROFILING_INTERVAL_MS = config('PROFILING_INTERVAL_MS', default=5, cast=float)
+PROFILING_DIR = config('PROFILING_DIR', default=str(BASE_DIR / 'profiles'))
+PROFILING_FLUSH_SECONDS = config('PROFILING_FLUSH_SECONDS', default=30, cast=float)
+
+# Slow-query capture (booking/slow_queries.py): off by default, enable it per environment. Queries slower than the
+# threshold are aggregated by fingerprint with their call sites and an EXPLAIN plan, and written to SLOW_QUERY_DIR;
+# rank them with `manage.py slow_queries`
+SLOW_QUERY_ENABLED = config('SLOW_QUERY_ENABLED', default=False, cast=bool)
+SLOW_QUERY_THRESHOLD_MS = config('SLOW_QUERY_THRESHOLD_MS', default=200, cast=float)
+SLOW_QUERY_EXPLAIN = config('SLOW_QUERY_EXPLAIN', default=True, cast=bool)
+SLOW_QUERY_MAX_FINGERPRINTS = config('SLOW_QUERY_MAX_FINGERPRINTS', default=500, cast=int)
+SLOW_QUERY_DIR = config('SLOW_QUERY_DIR', default=str(BASE_DIR / 'slow_queries'))
+SLOW_QUERY_FLUSH_SECONDS = config('SLOW_QUERY_FLUSH_SECONDS', default=30, cast=float)
+
 """
 DATABASES = {
     'default': {